@@ -0,0 +1,52 @@
+#!/usr/bin/python2
+#
+# Copyright (C) 2016  FreeIPA Contributors see COPYING for license
+#
+"""Time binding, loading and releasing the session ccache of a request,
+stored in a file and in a memory file
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import timeit
+
+from ipalib import session
+
+# not a valid ccache, the session code does not parse it
+CCACHE_DATA = b'\x05\x04' + os.urandom(4096)
+
+
+def bind_load_release(memfd):
+    ccache_name = session.bind_ipa_ccache(CCACHE_DATA, memfd=memfd)
+    session.load_ccache_data(ccache_name)
+    session.release_ipa_ccache(ccache_name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=2000,
+                        help='number of requests (default: %(default)s)')
+    args = parser.parse_args()
+
+    fd = session._memfd_create('ccache_benchmark')
+    if fd is None:
+        parser.error('memfd_create(2) not supported')
+    os.close(fd)
+
+    tmpdir = tempfile.mkdtemp()
+    session.krbccache_dir = tmpdir
+    try:
+        for name, memfd in (('file', False), ('memory file', True)):
+            elapsed = timeit.timeit(lambda: bind_load_release(memfd),
+                                    number=args.count)
+            print('%-12s %.1f us/request' % (
+                name + ':', elapsed / args.count * 1e6))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
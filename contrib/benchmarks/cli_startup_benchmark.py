@@ -0,0 +1,61 @@
+#!/usr/bin/python2
+#
+# Copyright (C) 2016  FreeIPA Contributors see COPYING for license
+#
+"""Time loading the plugins of the CLI with and without the plugin index
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+STARTUP_SCRIPT = """
+import sys
+import time
+start = time.time()
+from ipalib import api
+api.bootstrap(context='cli', in_server=False, plugin_index=sys.argv[1])
+api.load_plugins(command=sys.argv[2] or None)
+api.finalize()
+api.Command[sys.argv[2] or 'ping'].ensure_finalized()
+print('%d %f' % (len(api.plugins), time.time() - start))
+"""
+
+
+def startup(index, command):
+    output = subprocess.check_output(
+        [sys.executable, '-c', STARTUP_SCRIPT, index, command])
+    plugins, elapsed = output.decode('ascii').split()
+    return float(elapsed), int(plugins)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--command', default='ping',
+                        help='command to load (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of startups (default: %(default)s)')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        index = os.path.join(tmpdir, 'plugins.index')
+        full = min(startup(index, '') for i in range(args.repeat))
+        # build the index
+        startup(index, args.command)
+        indexed = min(startup(index, args.command)
+                      for i in range(args.repeat))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    for name, (elapsed, plugins) in (('all plugins', full),
+                                     ('plugin index', indexed)):
+        print('%-13s %.3f s, %d plugins' % (name + ':', elapsed, plugins))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/python2
+#
+# Copyright (C) 2016  FreeIPA Contributors see COPYING for license
+#
+"""Time hashing, comparison and suffix matching of DN objects
+"""
+from __future__ import print_function
+
+import argparse
+import timeit
+
+from ipapython.dn import DN
+
+BASEDN = DN('dc=example,dc=com')
+CONTAINER = DN(('cn', 'users'), ('cn', 'accounts'), BASEDN)
+
+
+def make_dns(count):
+    return [DN(('uid', 'user%d' % i), CONTAINER) for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=2000,
+                        help='number of DNs (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='number of iterations (default: %(default)s)')
+    args = parser.parse_args()
+
+    # every iteration works on fresh DN objects, as a command would
+    dns = [make_dns(args.count) for i in range(args.repeat)]
+    lookups = [make_dns(args.count) for i in range(args.repeat)]
+
+    def build_set():
+        for values in dns:
+            set(values)
+
+    members = [set(values) for values in dns]
+
+    def membership():
+        for values, lookup in zip(members, lookups):
+            for dn in lookup:
+                dn in values
+
+    def endswith():
+        for values in lookups:
+            for dn in values:
+                dn.endswith(CONTAINER)
+
+    for name, func in (('building a set', build_set),
+                       ('set membership tests', membership),
+                       ('endswith(container)', endswith)):
+        print('%-22s %.3f s' % (name + ':', timeit.timeit(func, number=1)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/python2
+#
+# Copyright (C) 2016  FreeIPA Contributors see COPYING for license
+#
+"""Time the conversion and decoding of a large LDAP search result
+"""
+from __future__ import print_function
+
+import argparse
+import timeit
+
+from ipapython.ipaldap import LDAPClient
+
+BASEDN = 'cn=computers,cn=accounts,dc=example,dc=com'
+
+
+def make_result(count):
+    result = []
+    for i in range(count):
+        fqdn = ('host%d.example.com' % i).encode('utf-8')
+        dn = 'fqdn=%s,%s' % (fqdn.decode('utf-8'), BASEDN)
+        result.append((dn, {
+            'fqdn': [fqdn],
+            'cn': [fqdn],
+            'serverHostName': [fqdn.split(b'.')[0]],
+            'description': [b'benchmark host'],
+            'l': [b'Lab'],
+            'nsHardwarePlatform': [b'x86_64'],
+            'nsOsVersion': [b'Linux'],
+            'krbPrincipalName': [b'host/' + fqdn + b'@EXAMPLE.COM'],
+            'memberOf': [('cn=hostgroup%d,cn=hostgroups,cn=accounts,'
+                          'dc=example,dc=com' % j).encode('utf-8')
+                         for j in range(3)],
+        }))
+    return result
+
+
+def read_all(entries):
+    for entry in entries:
+        for name in list(entry.raw):
+            entry[name]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=10000,
+                        help='number of entries (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='number of iterations (default: %(default)s)')
+    args = parser.parse_args()
+
+    conn = LDAPClient('ldap://ipa.example.com', no_schema=True)
+    result = make_result(args.count)
+
+    convert = timeit.timeit(lambda: conn._convert_result(result),
+                            number=args.repeat)
+    print('%-18s %.3f s' % ('conversion:', convert))
+
+    def decode_entries(entries):
+        conn.decode_entries(entries)
+        read_all(entries)
+
+    # fill the attribute table of the connection before timing
+    read_all(conn._convert_result(result[:1]))
+
+    for name, func in (('decode on access', read_all),
+                       ('decode_entries()', decode_entries)):
+        elapsed = 0
+        for i in range(args.repeat):
+            entries = conn._convert_result(result)
+            start = timeit.default_timer()
+            func(entries)
+            elapsed += timeit.default_timer() - start
+        print('%-18s %.3f s' % (name + ':', elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/python2
+#
+# Copyright (C) 2016  FreeIPA Contributors see COPYING for license
+#
+"""Time logging the params of a command with debug logging disabled
+"""
+from __future__ import print_function
+
+import argparse
+import logging
+import timeit
+
+from ipalib import frontend
+
+
+class FakeAPI(object):
+    @staticmethod
+    def is_production_mode():
+        return False
+
+
+class example(frontend.Command):
+    takes_args = ('one',)
+    takes_options = ('two?', 'three?', 'four?')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=100000,
+                        help='number of calls (default: %(default)s)')
+    args = parser.parse_args()
+
+    command = example(FakeAPI())
+    command.finalize()
+    params = dict(one=u'user1', two=u'Some', three=u'More', four=u'Values')
+    logger = logging.getLogger('repr_params_benchmark')
+    logger.setLevel(logging.INFO)
+
+    def eager():
+        logger.debug('%s(%s)', command.name,
+                     ', '.join(command._repr_iter(**params)))
+
+    def lazy():
+        logger.debug('%s(%s)', command.name, command._repr_params(**params))
+
+    for name, func in (('formatted always', eager),
+                       ('formatted on emit', lazy)):
+        elapsed = timeit.timeit(func, number=args.count)
+        print('%-18s %.2f us/call' % (name + ':', elapsed / args.count * 1e6))
+
+
+if __name__ == '__main__':
+    main()
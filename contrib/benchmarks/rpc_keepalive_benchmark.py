@@ -0,0 +1,101 @@
+#!/usr/bin/python2
+#
+# Copyright (C) 2016  FreeIPA Contributors see COPYING for license
+#
+"""Time JSON-RPC commands against a local stand-in server, reusing pooled
+connections and opening a new connection per command
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import socket
+import threading
+import time
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves import http_client as httplib
+
+from ipalib import rpc
+from ipalib.request import context
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        body = json.dumps(
+            dict(result=dict(summary=None), error=None, id=0)).encode('ascii')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    connections = 0
+
+
+class HTTPKerbTransport(rpc.KerbTransport):
+    def _create_connection(self, host, dbdir):
+        conn = httplib.HTTPConnection(host)
+        conn.connect()
+        return conn
+
+
+def run(url, count):
+    proxy = rpc.JSONServerProxy(
+        url, HTTPKerbTransport(protocol='json'), 'UTF-8', 0, True)
+    start = time.time()
+    for i in range(count):
+        proxy.ping([], {})
+    return count / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=1000,
+                        help='number of commands (default: %(default)s)')
+    args = parser.parse_args()
+
+    server = StandInServer(('127.0.0.1', 0), StandInHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = 'http://127.0.0.1:%d/ipa/session/json' % server.server_address[1]
+    # skip the Kerberos negotiation
+    context.session_cookie = 'ipa_session=stand-in'
+
+    try:
+        results = []
+        for name, idle_timeout in (
+                ('keep-alive', rpc.connection_pool.idle_timeout),
+                ('new connection', 0)):
+            rpc.connection_pool.clear()
+            rpc.connection_pool.idle_timeout = idle_timeout
+            server.connections = 0
+            rate = run(url, args.count)
+            results.append((name, rate, server.connections))
+    finally:
+        server.shutdown()
+        server.server_close()
+        rpc.connection_pool.clear()
+
+    for name, rate, connections in results:
+        print('%-15s %.0f commands/s, %d connections' % (
+            name + ':', rate, connections))
+
+
+if __name__ == '__main__':
+    main()
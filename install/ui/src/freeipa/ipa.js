@@ -279,6 +279,7 @@ var IPA = function () {
             options: {
                 object: 'all'
             },
+            cache: true,
             on_success: function(data, text_status, xhr) {
                 metadata_provider.source.objects = data.result.objects;
             }
@@ -290,6 +291,7 @@ var IPA = function () {
             options: {
                 command: 'all'
             },
+            cache: true,
             on_success: function(data, text_status, xhr) {
                 metadata_provider.source.commands = data.result.commands;
             }
@@ -46,6 +46,7 @@ define([
  * @param {Object} spec.options - dict of options, e.g. {givenname: 'Petr'}
  * @param {Function} spec.on_success - callback function if command succeeds
  * @param {Function} spec.on_error - callback function if command fails
+ * @param {boolean} spec.cache - keep the result in the local storage (optional)
  *
  */
 rpc.command = function(spec) {
@@ -96,6 +97,16 @@ rpc.command = function(spec) {
      */
     that.retry = typeof spec.retry == 'undefined' ? true : spec.retry;
 
+    /**
+     * Keep the result in the local storage of the browser
+     *
+     * The stored result is used as long as the server answers with
+     * 304 Not Modified. Only for commands which send an entity tag with
+     * their result, like `json_metadata`. Not supported in batches.
+     * @property {Boolean} cache=false
+     */
+    that.cache = !!spec.cache;
+
     /** @property {string} error_message Default error message */
     that.error_message = text.get(spec.error_message || '@i18n:dialogs.batch_error_message', 'Some operations failed.');
 
@@ -335,6 +346,17 @@ rpc.command = function(spec) {
 
         function success_handler(data, text_status, xhr) {
 
+            if (cached && xhr.status === 304) {
+                data = {
+                    result: cached.result,
+                    error: null
+                };
+            } else if (that.cache && data && !data.error) {
+                rpc.set_cached_result(cache_key,
+                                      xhr.getResponseHeader('ETag'),
+                                      data.result);
+            }
+
             if (!data) {
                 // error_handler() calls IPA.hide_activity_icon()
                 error_handler.call(this, xhr, text_status, /* error_thrown */ {
@@ -413,6 +435,12 @@ rpc.command = function(spec) {
             error: error_handler_login
         };
 
+        var cache_key = that.name || that.data.method;
+        var cached = that.cache ? rpc.get_cached_result(cache_key) : null;
+        if (cached) {
+            that.request.headers = { 'If-None-Match': cached.etag };
+        }
+
         IPA.display_activity_icon();
         $.ajax(that.request);
         return deferred.promise;
@@ -961,6 +989,56 @@ rpc.create_4304_error_handler = function(adder_dialog) {
     };
 };
 
+/**
+ * Prefix of the local storage items holding command results
+ * @type {string}
+ */
+rpc.cache_prefix = 'ipa_rpc_';
+
+/**
+ * Get a command result kept in the local storage
+ *
+ * @param {string} key - command name
+ * @return {Object|null} `{ etag: string, result: Object }` or null
+ */
+rpc.get_cached_result = function(key) {
+
+    try {
+        var value = window.localStorage.getItem(rpc.cache_prefix + key);
+        return value ? JSON.parse(value) : null;
+    } catch (e) {
+        return null;
+    }
+};
+
+/**
+ * Keep a command result in the local storage
+ *
+ * The result is removed if the server did not send an entity tag for it.
+ *
+ * @param {string} key - command name
+ * @param {string|null} etag - entity tag of the result
+ * @param {Object} result
+ */
+rpc.set_cached_result = function(key, etag, result) {
+
+    var name = rpc.cache_prefix + key;
+    try {
+        if (etag) {
+            window.localStorage.setItem(name, JSON.stringify({
+                etag: etag,
+                result: result
+            }));
+        } else {
+            window.localStorage.removeItem(name);
+        }
+    } catch (e) {
+        // e.g. the storage quota is exceeded, the result is downloaded
+        // again next time
+        window.localStorage.removeItem(name);
+    }
+};
+
 /**
  * Property names to identify objects and values to extract in
  * `rpc.extract_objects(array)` method.
@@ -910,6 +910,27 @@ class API(plugable.API):
             result += ('ipaserver.install.plugins.*',)
         return result
 
+    def get_plugin_references(self, klass):
+        requires = set()
+        uses = set()
+        if issubclass(klass, Command):
+            # commands are forwarded to the server by the RPC client
+            requires.add('Backend.rpcclient')
+        if issubclass(klass, Method):
+            m = Method.NAME_REGEX.match(klass.__name__)
+            if m:
+                requires.add('Object.%s' % m.group('obj'))
+        if issubclass(klass, Object):
+            parent_object = getattr(klass, 'parent_object', None)
+            if parent_object:
+                requires.add('Object.%s' % parent_object)
+            # only class attributes of member objects are used, for example
+            # to build the member options of commands
+            for attr in ('attribute_members', 'reverse_members'):
+                for names in getattr(klass, attr, {}).values():
+                    uses.update('Object.%s' % name for name in names)
+        return requires, uses
+
 
 def create_api(mode='dummy'):
     """
@@ -1339,6 +1339,9 @@ def run(api):
         (options, argv) = api.bootstrap_with_global_options(context='cli')
         for klass in cli_plugins:
             api.add_plugin(klass)
+        if argv and api.env.plugins_on_demand:
+            # import only the plugin modules needed by the command
+            api.load_plugins(command=from_cli(argv[0]))
         api.finalize()
         if not 'config_loaded' in api.env and not 'help' in argv:
             raise NotConfiguredError()
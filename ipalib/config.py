@@ -493,6 +493,14 @@ class Env(object):
         if 'plugins_on_demand' not in self:
             self.plugins_on_demand = (self.context == 'cli')
 
+        # Set plugin_index:
+        if 'plugin_index' not in self:
+            self.plugin_index = self._join('dot_ipa', 'plugins.index')
+
+        # Set server_cache:
+        if 'server_cache' not in self:
+            self.server_cache = self._join('dot_ipa', 'servers.cache')
+
     def _finalize_core(self, **defaults):
         """
         Complete initialization of standard IPA environment.
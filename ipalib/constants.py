@@ -129,6 +129,16 @@ DEFAULT_CONFIG = (
 
     ('rpc_protocol', 'jsonrpc'),
 
+    # Pool of bound LDAP connections reused by the ldap2 backend in the server:
+    ('ldap_pool_size', 10),  # Maximum number of idle connections, 0 disables
+    ('ldap_pool_idle_timeout', 60),  # Seconds an idle connection is kept
+
+    # Seconds after which the server checks if the cached LDAP schema changed
+    ('ldap_schema_check_interval', 60),
+
+    # Maximum number of concurrently executed methods of a parallel batch
+    ('batch_max_parallel', 4),
+
     # Define an inclusive range of SSL/TLS version support
     ('tls_version_min', 'tls1.0'),
     ('tls_version_max', 'tls1.2'),
@@ -148,6 +158,9 @@ DEFAULT_CONFIG = (
     ('session_auth_duration', '20 minutes'),
     # How a session expiration is computed, see SessionManager.set_session_expiration_time()
     ('session_duration_type', 'inactivity_timeout'),
+    # How much a session expiration must be extended by to be written to the
+    # session store, see MemcacheSessionManager.store_session_data()
+    ('session_expiration_granularity', '1 minute'),
 
     # Debugging:
     ('verbose', 0),
@@ -220,6 +233,8 @@ DEFAULT_CONFIG = (
     ('conf', object),  # File containing context specific config
     ('conf_default', object),  # File containing context independent config
     ('plugins_on_demand', object),  # Whether to finalize plugins on-demand (bool)
+    ('plugin_index', object),  # File caching the index of plugin modules
+    ('server_cache', object),  # File caching the discovered IPA servers
 
     # Set in Env._finalize_core():
     ('in_server', object),  # Whether or not running in-server (bool)
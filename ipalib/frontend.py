@@ -376,6 +376,23 @@ class HasParam(Plugin):
         return context.current_frame
 
 
+class _ParamsRepr(object):
+    """
+    Lazily formatted ``repr()`` of the params of a command.
+
+    See `Command._repr_params`.
+    """
+
+    __slots__ = ('command', 'params')
+
+    def __init__(self, command, params):
+        self.command = command
+        self.params = params
+
+    def __str__(self):
+        return ', '.join(self.command._repr_iter(**self.params))
+
+
 class Command(HasParam):
     """
     A public IPA atomic operation.
@@ -421,6 +438,10 @@ class Command(HasParam):
     msg_summary = None
     msg_truncated = _('Results are truncated, try a more specific search')
 
+    # Commands which never modify any data opt in by setting this to True,
+    # they may then be executed concurrently (see the batch command)
+    read_only = False
+
     def __call__(self, *args, **options):
         """
         Perform validation and then execute the command.
@@ -435,7 +456,8 @@ class Command(HasParam):
 
     def __do_call(self, *args, **options):
         self.context.__messages = []
-        if 'version' in options:
+        version_sent = 'version' in options
+        if version_sent:
             self.verify_client_version(unicode(options['version']))
         elif self.api.env.skip_version_check and not self.api.env.in_server:
             options['version'] = u'2.0'
@@ -446,15 +468,17 @@ class Command(HasParam):
                 self.add_message(
                     messages.VersionMissing(server_version=API_VERSION))
         params = self.args_options_2_params(*args, **options)
-        self.debug(
-            'raw: %s(%s)', self.name, ', '.join(self._repr_iter(**params))
-        )
-        params.update(self.get_default(**params))
+        self.debug('raw: %s(%s)', self.name, self._repr_params(**params))
+        if getattr(context, 'call_params', False) is None:
+            # the RPC server logs the params of the command it executes as
+            # sent by the client, see `ipaserver.rpcserver.WSGIExecutioner`
+            context.call_params = dict(params)
+            if not version_sent:
+                context.call_params.pop('version', None)
+        params = dict(params, **self.get_default(**params))
         params = self.normalize(**params)
         params = self.convert(**params)
-        self.debug(
-            '%s(%s)', self.name, ', '.join(self._repr_iter(**params))
-        )
+        self.debug('%s(%s)', self.name, self._repr_params(**params))
         self.validate(**params)
         (args, options) = self.params_2_args_options(**params)
         ret = self.run(*args, **options)
@@ -487,6 +511,17 @@ class Command(HasParam):
             errors=errors,
         )
 
+    def _repr_params(self, **params):
+        """
+        Return the ``repr()`` of *safe* values of args and options for
+        logging.
+
+        The values are formatted by `Command._repr_iter` only when the
+        returned object is converted to a string, i.e. when a log record
+        using it is actually emitted.
+        """
+        return _ParamsRepr(self, params)
+
     def _repr_iter(self, **params):
         """
         Iterate through ``repr()`` of *safe* values of args and options.
@@ -792,6 +827,18 @@ class Command(HasParam):
         """
         raise NotImplementedError('%s.execute()' % self.name)
 
+    def get_etag(self, *args, **kw):
+        """
+        Return the entity tag of the result of this command, or None.
+
+        Commands whose result only changes with the server software, like
+        the meta-data for the webUI, can return a tag which identifies the
+        result for the given arguments. The RPC server sends it in the ETag
+        header and answers requests with a matching If-None-Match header
+        with 304 Not Modified, without executing the command.
+        """
+        return None
+
     def forward(self, *args, **kw):
         """
         Forward call over RPC to this same command on server.
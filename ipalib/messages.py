@@ -352,6 +352,17 @@ class BrokenTrust(PublicMessage):
                "running 'ipa trust-add' again.")
 
 
+class SearchResultPaged(PublicMessage):
+    """
+    **13019** Only one page of the LDAP search result has been returned
+    """
+
+    errno = 13019
+    type = "info"
+    format = _("%(remaining)d more entries match the search. Use page offset "
+               "%(offset)d to retrieve the next page.")
+
+
 def iter_messages(variables, base):
     """Return a tuple with all subclasses
     """
@@ -34,6 +34,8 @@ import optparse
 import textwrap
 import collections
 import importlib
+import json
+import re
 
 import six
 
@@ -288,6 +290,124 @@ class Registrar(collections.Mapping):
         return len(self.__registry)
 
 
+class PluginIndex(object):
+    """
+    Index of the plugins provided and referenced by plugin modules.
+
+    For every plugin module the index records the modification time of the
+    module file, the plugins the module provides, the plugins it requires
+    to be finalized, the plugins it merely refers to and the plugin modules
+    it imports from.  Plugins are named ``'<namespace>.<name>'``, for example
+    ``'Command.user_show'``.
+
+    The index is stored as JSON in ``filename``.  It is only valid as long
+    as no plugin module was added, removed or modified, see `is_current()`.
+    """
+
+    version = 1
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.modules = {}
+
+    def load(self):
+        """
+        Load the index from ``filename``, return True on success.
+        """
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return False
+        if not isinstance(data, dict) or data.get('version') != self.version:
+            return False
+        self.modules = data['modules']
+        return True
+
+    def save(self):
+        """
+        Atomically store the index to ``filename``, return True on success.
+        """
+        dirname = path.dirname(self.filename)
+        tmpname = '%s.%d' % (self.filename, os.getpid())
+        try:
+            if not path.isdir(dirname):
+                os.makedirs(dirname)
+            with open(tmpname, 'w') as f:
+                json.dump(dict(version=self.version, modules=self.modules), f)
+            os.rename(tmpname, self.filename)
+        except (IOError, OSError):
+            return False
+        return True
+
+    def is_current(self, files):
+        """
+        Return True if the index is up to date with the plugin modules.
+
+        :param files: A dict mapping plugin module names to their files.
+        """
+        if set(files) != set(self.modules):
+            return False
+        for name, filename in files.items():
+            try:
+                mtime = os.stat(filename).st_mtime
+            except OSError:
+                return False
+            if mtime != self.modules[name]['mtime']:
+                return False
+        return True
+
+    def add_module(self, name, filename, provides=(), requires=(), uses=(),
+                   imports=()):
+        """
+        Add or replace the index entry of the plugin module ``name``.
+        """
+        self.modules[name] = dict(
+            mtime=os.stat(filename).st_mtime,
+            provides=sorted(set(provides)),
+            requires=sorted(set(requires)),
+            uses=sorted(set(uses)),
+            imports=sorted(set(imports)),
+        )
+
+    def resolve(self, names):
+        """
+        Return the set of plugin modules needed to use the plugins ``names``.
+
+        The modules providing ``names`` are included, and recursively the
+        modules they import and the modules providing plugins they require.
+        Modules providing plugins which are only referred to are included,
+        but their own requirements are not.
+
+        None is returned if any of ``names`` is not provided by any module.
+        """
+        providers = {}
+        for module, info in self.modules.items():
+            for name in info['provides']:
+                providers.setdefault(name, []).append(module)
+
+        if not all(name in providers for name in names):
+            return None
+
+        modules = set()
+        expanded = set()
+        pending = [m for name in names for m in providers[name]]
+        while pending:
+            module = pending.pop()
+            modules.add(module)
+            if module in expanded:
+                continue
+            expanded.add(module)
+            info = self.modules[module]
+            pending.extend(m for m in info['imports'] if m in self.modules)
+            for name in info['requires']:
+                pending.extend(providers.get(name, ()))
+            for name in info['uses']:
+                modules.update(providers.get(name, ()))
+
+        return modules
+
+
 class API(ReadOnly):
     """
     Dynamic API object through which `Plugin` instances are accessed.
@@ -521,10 +641,17 @@ class API(ReadOnly):
         self.bootstrap(parser, **overrides)
         return (options, args)
 
-    def load_plugins(self):
+    def load_plugins(self, command=None):
         """
         Load plugins from all standard locations.
 
+        If ``command`` is given and ``env.plugin_index`` is set, only the
+        plugin modules needed to run the command named ``command`` are
+        imported, as recorded in the plugin index.  If the index is missing
+        or out of date, all plugin modules are imported and the index is
+        rebuilt.  All plugin modules are also imported if the command is not
+        in the index.
+
         `API.bootstrap` will automatically be called if it hasn't been
         already.
         """
@@ -532,9 +659,131 @@ class API(ReadOnly):
         self.__do_if_not_done('bootstrap')
         if self.env.mode in ('dummy', 'unit_test'):
             return
+        if command is not None and self.env.plugin_index:
+            files = self.__find_plugin_files()
+            if files is not None:
+                self.__load_indexed_plugins(files, command)
+                return
         for module in self.modules:
             self.import_plugins(module)
 
+    def __load_indexed_plugins(self, files, command):
+        index = PluginIndex(self.env.plugin_index)
+        is_current = index.load() and index.is_current(files)
+        needed = None
+        if is_current:
+            needed = index.resolve(['Command.%s' % command])
+        if needed is not None:
+            self.log.debug("importing %d of %d plugin modules for %s",
+                           len(needed), len(files), command)
+        for name in files:
+            if needed is None or name in needed:
+                self.__import_plugin_module(name)
+        if not is_current:
+            self.__build_plugin_index(index, files)
+
+    def __find_plugin_files(self):
+        """
+        Return an ordered dict mapping plugin module names to their files.
+
+        None is returned if some of the standard locations is not a plugins
+        sub-package.
+        """
+        files = collections.OrderedDict()
+        for module in self.modules:
+            if not module.endswith('.*'):
+                return None
+            subpackage = module[:-2]
+            plugins_dir = self.__find_plugins_dir(subpackage)
+            for name in find_modules_in_dir(plugins_dir):
+                files['.'.join((subpackage, name))] = path.join(
+                    plugins_dir, '%s.py' % name)
+        return files
+
+    def __build_plugin_index(self, index, files):
+        """
+        Rebuild the plugin index from the imported plugin modules.
+        """
+        bases = '|'.join(re.escape(base.__name__) for base in self.bases)
+        reference_re = re.compile(
+            r'\b(%s)(?:\.(\w+)|\[[\'"](\w+)[\'"]\])' % bases)
+
+        index.modules = {}
+        for name, filename in files.items():
+            module = sys.modules.get(name)
+            if module is None:
+                # skipped plugin module
+                index.add_module(name, filename)
+                continue
+
+            provides = set()
+            requires = set()
+            uses = set()
+            imports = set()
+            for value in vars(module).values():
+                if inspect.ismodule(value):
+                    if value.__name__ in files:
+                        imports.add(value.__name__)
+                    continue
+                other = getattr(value, '__module__', None)
+                if other in files and other != name:
+                    imports.add(other)
+                    continue
+                if not inspect.isclass(value) or value not in self.register:
+                    continue
+                provides.update(
+                    '%s.%s' % (base.__name__, value.__name__)
+                    for base in self.bases if issubclass(value, base))
+                klass_requires, klass_uses = self.get_plugin_references(value)
+                requires.update(klass_requires)
+                uses.update(klass_uses)
+
+            try:
+                with open(filename) as f:
+                    source = f.read()
+            except IOError as e:
+                # don't save an index which might be incomplete
+                self.log.debug("cannot read plugin module %s: %s", name, e)
+                return
+            # most of these are used only while executing in the server
+            for match in reference_re.finditer(source):
+                uses.add('%s.%s' % (match.group(1),
+                                    match.group(2) or match.group(3)))
+
+            index.add_module(name, filename, provides, requires, uses,
+                             imports)
+
+        if not index.save():
+            self.log.debug("cannot save plugin index %s", index.filename)
+
+    def get_plugin_references(self, klass):
+        """
+        Return the plugins referenced by the plugin class ``klass``.
+
+        Return a ``(requires, uses)`` tuple of plugin names in the form
+        described in `PluginIndex`.  Subclasses should override this to
+        describe the relationships between plugins of their namespaces.
+        """
+        return (), ()
+
+    def __find_plugins_dir(self, subpackage):
+        try:
+            plugins = importlib.import_module(subpackage)
+        except ImportError as e:
+            self.log.error("cannot import plugins sub-package %s: %s",
+                           subpackage, e)
+            raise
+        package, dot, part = subpackage.rpartition('.')
+        parent = sys.modules[package]
+
+        parent_dir = path.dirname(path.abspath(parent.__file__))
+        plugins_dir = path.dirname(path.abspath(plugins.__file__))
+        if parent_dir == plugins_dir:
+            raise errors.PluginsPackageError(
+                name=subpackage, file=plugins.__file__
+            )
+        return plugins_dir
+
     # FIXME: This method has no unit test
     def import_plugins(self, module):
         """
@@ -546,21 +795,7 @@ class API(ReadOnly):
         """
         if module.endswith('.*'):
             subpackage = module[:-2]
-            try:
-                plugins = importlib.import_module(subpackage)
-            except ImportError as e:
-                self.log.error("cannot import plugins sub-package %s: %s",
-                               subpackage, e)
-                raise
-            package, dot, part = subpackage.rpartition('.')
-            parent = sys.modules[package]
-
-            parent_dir = path.dirname(path.abspath(parent.__file__))
-            plugins_dir = path.dirname(path.abspath(plugins.__file__))
-            if parent_dir == plugins_dir:
-                raise errors.PluginsPackageError(
-                    name=subpackage, file=plugins.__file__
-                )
+            plugins_dir = self.__find_plugins_dir(subpackage)
 
             self.log.debug("importing all plugin modules in %s...", subpackage)
             modules = find_modules_in_dir(plugins_dir)
@@ -569,19 +804,22 @@ class API(ReadOnly):
             modules = [module]
 
         for name in modules:
-            self.log.debug("importing plugin module %s", name)
-            try:
-                module = importlib.import_module(name)
-            except errors.SkipPluginModule as e:
-                self.log.debug("skipping plugin module %s: %s", name, e.reason)
-            except Exception as e:
-                if self.env.startup_traceback:
-                    import traceback
-                    self.log.error("could not load plugin module %s\n%s", name,
-                                   traceback.format_exc())
-                raise
-            else:
-                self.add_module(module)
+            self.__import_plugin_module(name)
+
+    def __import_plugin_module(self, name):
+        self.log.debug("importing plugin module %s", name)
+        try:
+            module = importlib.import_module(name)
+        except errors.SkipPluginModule as e:
+            self.log.debug("skipping plugin module %s: %s", name, e.reason)
+        except Exception as e:
+            if self.env.startup_traceback:
+                import traceback
+                self.log.error("could not load plugin module %s\n%s", name,
+                               traceback.format_exc())
+            raise
+        else:
+            self.add_module(module)
 
     def add_module(self, module):
         """
@@ -695,6 +695,7 @@ class aci_find(crud.Search):
     members of that group indirectly.
     """
     NO_CLI = True
+    read_only = True
     msg_summary = ngettext('%(count)d ACI matched', '%(count)d ACIs matched', 0)
 
     takes_options = (_prefix_option.clone_rename("aciprefix?", required=False),
@@ -885,6 +886,7 @@ class aci_show(crud.Retrieve):
     Display a single ACI given an ACI name.
     """
     NO_CLI = True
+    read_only = True
 
     has_output_params = (
         Str('aci',
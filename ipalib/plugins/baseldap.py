@@ -35,8 +35,11 @@ from ipalib import output
 from ipalib.text import _
 from ipalib.util import json_serialize, validate_hostname
 from ipalib.capabilities import client_has_capability
-from ipalib.messages import add_message, SearchResultTruncated
+from ipalib.messages import (
+    add_message, SearchResultTruncated, SearchResultPaged)
+from ipalib.request import context
 from ipapython.dn import DN
+from ipapython.ipaldap import MatchedValuesControl
 from ipapython.version import API_VERSION
 
 if six.PY3:
@@ -562,6 +565,9 @@ class LDAPObject(Object):
     label = _('Entry')
     label_singular = _('Entry')
     managed_permissions = {}
+    # Maximum number of entries resolved by one search in
+    # get_indirect_members_batch()
+    indirect_members_batch_size = 100
 
     container_not_found_msg = _('container entry (%(container)s) not found')
     parent_not_found_msg = _('%(parent)s: %(oname)s not found')
@@ -595,17 +601,89 @@ class LDAPObject(Object):
         entry = self.backend.get_entry(dn, [''])
         return entry.dn
 
+    def _get_primary_key_cache(self):
+        """
+        Return the DN -> primary key cache of the current command call.
+
+        The cache lives in the context frame of the command, so it never
+        outlives the command and renamed entries are never reported under
+        their old name.
+        """
+        frame = getattr(context, 'current_frame', None)
+        if frame is None:
+            return None
+        try:
+            cache = frame.primary_key_cache
+        except AttributeError:
+            cache = frame.primary_key_cache = {}
+        return cache.setdefault(self.name, {})
+
+    def get_primary_keys_from_dns(self, dns):
+        """
+        Resolve the primary keys of entries with rdn_attribute set in bulk.
+
+        DNs not resolved yet in the current command call are looked up with
+        one search per chunk of ``indirect_members_batch_size`` DNs and the
+        results are stored in the primary key cache used by
+        get_primary_key_from_dn().
+        """
+        cache = self._get_primary_key_cache()
+        if not self.rdn_attribute or cache is None:
+            return
+
+        container_dn = DN(self.container_dn, self.api.env.basedn)
+        unknown = []
+        seen = set()
+        for dn in dns:
+            if (dn not in cache and dn not in seen and
+                    dn.endswith(container_dn) and
+                    len(dn) > len(container_dn)):
+                seen.add(dn)
+                unknown.append(dn)
+        if len(unknown) < 2:
+            return
+
+        size = self.indirect_members_batch_size
+        for i in range(0, len(unknown), size):
+            chunk = unknown[i:i + size]
+            chunk_dns = set(chunk)
+            filters = [
+                self.backend.make_filter_from_attr(dn[0].attr, dn[0].value)
+                for dn in chunk]
+            filter = self.backend.combine_filters(
+                filters, self.backend.MATCH_ANY)
+            try:
+                entries, truncated = self.backend.find_entries(
+                    filter, [self.primary_key.name], container_dn,
+                    size_limit=-1, paged_search=True)
+            except errors.NotFound:
+                entries = []
+
+            for entry in entries:
+                if entry.dn not in chunk_dns:
+                    continue
+                try:
+                    cache[entry.dn] = entry[self.primary_key.name][0]
+                except (KeyError, IndexError):
+                    cache[entry.dn] = ''
+
     def get_primary_key_from_dn(self, dn):
         assert isinstance(dn, DN)
         try:
             if self.rdn_attribute:
+                cache = self._get_primary_key_cache()
+                if cache is not None and dn in cache:
+                    return cache[dn]
                 entry_attrs = self.backend.get_entry(
                     dn, [self.primary_key.name]
                 )
                 try:
-                    return entry_attrs[self.primary_key.name][0]
+                    pkey = entry_attrs[self.primary_key.name][0]
                 except (KeyError, IndexError):
-                    return ''
+                    pkey = ''
+                if cache is not None:
+                    cache[dn] = pkey
+                return pkey
         except errors.NotFound:
             pass
         try:
@@ -648,6 +726,8 @@ class LDAPObject(Object):
                 continue
             del entry_attrs[attr]
 
+            members = []
+            obj_members = {}
             for member in value:
                 memberdn = DN(member)
                 for ldap_obj_name in self.attribute_members[attr]:
@@ -659,76 +739,139 @@ class LDAPObject(Object):
                         container_dns[ldap_obj_name] = container_dn
 
                     if memberdn.endswith(container_dn):
-                        new_value = ldap_obj.get_primary_key_from_dn(memberdn)
-                        new_attr_name = '%s_%s' % (attr, ldap_obj.name)
-                        try:
-                            new_attr = new_attrs[new_attr_name]
-                        except KeyError:
-                            new_attr = entry_attrs.setdefault(new_attr_name, [])
-                            new_attrs[new_attr_name] = new_attr
-                        new_attr.append(new_value)
+                        members.append((memberdn, ldap_obj))
+                        obj_members.setdefault(ldap_obj, []).append(memberdn)
                         break
 
+            for ldap_obj, memberdns in obj_members.items():
+                ldap_obj.get_primary_keys_from_dns(memberdns)
+
+            for memberdn, ldap_obj in members:
+                new_value = ldap_obj.get_primary_key_from_dn(memberdn)
+                new_attr_name = '%s_%s' % (attr, ldap_obj.name)
+                try:
+                    new_attr = new_attrs[new_attr_name]
+                except KeyError:
+                    new_attr = entry_attrs.setdefault(new_attr_name, [])
+                    new_attrs[new_attr_name] = new_attr
+                new_attr.append(new_value)
+
     def get_indirect_members(self, entry_attrs, attrs_list):
-        if 'memberindirect' in attrs_list:
-            self.get_memberindirect(entry_attrs)
-        if 'memberofindirect' in attrs_list:
-            self.get_memberofindirect(entry_attrs)
+        self.get_indirect_members_batch([entry_attrs], attrs_list)
 
-    def get_memberindirect(self, group_entry):
-        """
-        Get indirect members
+    def get_indirect_members_batch(self, entries, attrs_list):
         """
+        Get indirect members and indirect memberships of several entries
 
-        mo_filter = self.backend.make_filter({'memberof': group_entry.dn})
-        filter = self.backend.combine_filters(
-            ('(member=*)', mo_filter), self.backend.MATCH_ALL)
+        Instead of searching the whole tree once per entry, the entries are
+        resolved in chunks of ``indirect_members_batch_size`` with one
+        search per chunk.
+        """
+        size = self.indirect_members_batch_size
+        for i in range(0, len(entries), size):
+            chunk = entries[i:i + size]
+            if 'memberindirect' in attrs_list:
+                self.get_memberindirect_batch(chunk)
+            if 'memberofindirect' in attrs_list:
+                self.get_memberofindirect_batch(chunk)
+
+    def _find_membership_entries(self, filter, attrs_list, serverctrls=None):
         try:
             result, truncated = self.backend.find_entries(
                 base_dn=self.api.env.basedn,
                 filter=filter,
-                attrs_list=['member'],
+                attrs_list=attrs_list,
                 size_limit=-1, # paged search will get everything anyway
-                paged_search=True)
+                paged_search=True,
+                serverctrls=serverctrls)
             if truncated:
                 raise errors.LimitsExceeded()
         except errors.NotFound:
             result = []
+        return result
 
-        indirect = set()
-        for entry in result:
-            indirect.update(entry.raw.get('member', []))
-        indirect.difference_update(group_entry.raw.get('member', []))
+    def get_memberindirect(self, group_entry):
+        """
+        Get indirect members
+        """
+        self.get_memberindirect_batch([group_entry])
+
+    def get_memberindirect_batch(self, group_entries):
+        """
+        Get indirect members of several groups with a single search
+        """
+        indirect = {}
+        for group_entry in group_entries:
+            indirect[group_entry.dn] = set()
 
-        if indirect:
-            group_entry.raw['memberindirect'] = list(indirect)
+        mo_filter = self.backend.make_filter(
+            {'memberof': [group_entry.dn for group_entry in group_entries]})
+        filter = self.backend.combine_filters(
+            ('(member=*)', mo_filter), self.backend.MATCH_ALL)
+        result = self._find_membership_entries(filter, ['member', 'memberof'])
+
+        for entry in result:
+            members = entry.raw.get('member', [])
+            for memberof in entry.raw.get('memberof', []):
+                memberof = DN(memberof)
+                if memberof in indirect:
+                    indirect[memberof].update(members)
+
+        for group_entry in group_entries:
+            members = indirect[group_entry.dn]
+            members.difference_update(group_entry.raw.get('member', []))
+            if members:
+                group_entry.raw['memberindirect'] = list(members)
 
     def get_memberofindirect(self, entry):
+        self.get_memberofindirect_batch([entry])
 
-        dn = entry.dn
+    def get_memberofindirect_batch(self, entries):
+        """
+        Get indirect memberships of several entries with a single search
+        """
+        member_attrs = ['member', 'memberuser', 'memberhost']
+        dns = [entry.dn for entry in entries]
         filter = self.backend.make_filter(
-            {'member': dn, 'memberuser': dn, 'memberhost': dn})
-        try:
-            result, truncated = self.backend.find_entries(
-                base_dn=self.api.env.basedn,
-                filter=filter,
-                attrs_list=[''])
-            if truncated:
-                raise errors.LimitsExceeded()
-        except errors.NotFound:
-            result = []
-
-        direct = set()
-        indirect = set(entry.raw.get('memberof', []))
-        for group_entry in result:
-            dn = str(group_entry.dn)
-            if dn in indirect:
-                indirect.remove(dn)
-                direct.add(dn)
+            dict((attr, dns) for attr in member_attrs))
+
+        direct = {}
+        for entry in entries:
+            direct[entry.dn] = set()
+
+        if len(entries) == 1:
+            # every entry found is a direct parent, there is no need to
+            # retrieve the member values
+            result = self._find_membership_entries(filter, [''])
+            direct[entries[0].dn].update(
+                group_entry.dn for group_entry in result)
+        else:
+            # groups such as ipausers have a huge number of members, ask the
+            # server to return only the values referring to these entries
+            ctrl = MatchedValuesControl(
+                [(attr, dn) for attr in member_attrs for dn in dns])
+            result = self._find_membership_entries(
+                filter, member_attrs, serverctrls=[ctrl])
+            for group_entry in result:
+                for attr in member_attrs:
+                    for member in group_entry.raw.get(attr, []):
+                        parents = direct.get(DN(member))
+                        if parents is not None:
+                            parents.add(group_entry.dn)
+
+        for entry in entries:
+            parents = direct[entry.dn]
+            memberof = set()
+            indirect = set()
+            for dn in entry.raw.get('memberof', []):
+                if DN(dn) in parents:
+                    memberof.add(dn)
+                else:
+                    indirect.add(dn)
 
-        entry.raw['memberof'] = list(direct)
-        if indirect:
-            entry.raw['memberofindirect'] = list(indirect)
+            entry.raw['memberof'] = list(memberof)
+            if indirect:
+                entry.raw['memberofindirect'] = list(indirect)
 
     def get_password_attributes(self, ldap, dn, entry_attrs):
         """
@@ -1341,6 +1484,8 @@ class LDAPRetrieve(LDAPQuery):
     """
     Retrieve an LDAP entry.
     """
+    read_only = True
+
     has_output = output.standard_entry
     has_output_params = global_output_params
 
@@ -1700,6 +1845,31 @@ class LDAPModMember(LDAPQuery):
                         failed[attr][ldap_obj_name].append((name, unicode(e)))
         return (dns, failed)
 
+    def _get_member_dn_list(self, objs):
+        """
+        Flatten member DNs of one member attribute into a list and a dict
+        mapping each DN to the name of the object it belongs to.
+        """
+        m_dns = []
+        obj_names = {}
+        for ldap_obj_name, dns in objs.items():
+            for m_dn in dns:
+                assert isinstance(m_dn, DN)
+                if not m_dn:
+                    continue
+                m_dns.append(m_dn)
+                obj_names[m_dn] = ldap_obj_name
+        return (m_dns, obj_names)
+
+    def _report_failed_members(self, failed, attr, obj_names, m_failed):
+        for m_dn, e in m_failed:
+            ldap_obj_name = obj_names[m_dn]
+            ldap_obj = self.api.Object[ldap_obj_name]
+            failed[attr][ldap_obj_name].append((
+                ldap_obj.get_primary_key_from_dn(m_dn),
+                unicode(e),)
+            )
+
 
 class LDAPAddMember(LDAPModMember):
     """
@@ -1737,21 +1907,13 @@ class LDAPAddMember(LDAPModMember):
 
         completed = 0
         for (attr, objs) in member_dns.items():
-            for ldap_obj_name in objs:
-                for m_dn in member_dns[attr][ldap_obj_name]:
-                    assert isinstance(m_dn, DN)
-                    if not m_dn:
-                        continue
-                    try:
-                        ldap.add_entry_to_group(m_dn, dn, attr, allow_same=self.allow_same)
-                    except errors.PublicError as e:
-                        ldap_obj = self.api.Object[ldap_obj_name]
-                        failed[attr][ldap_obj_name].append((
-                            ldap_obj.get_primary_key_from_dn(m_dn),
-                            unicode(e),)
-                        )
-                    else:
-                        completed += 1
+            (m_dns, obj_names) = self._get_member_dn_list(objs)
+            if not m_dns:
+                continue
+            m_failed = ldap.add_entries_to_group(
+                m_dns, dn, attr, allow_same=self.allow_same)
+            self._report_failed_members(failed, attr, obj_names, m_failed)
+            completed += len(m_dns) - len(m_failed)
 
         if options.get('all', False):
             attrs_list = ['*'] + self.obj.default_attributes
@@ -1838,21 +2000,12 @@ class LDAPRemoveMember(LDAPModMember):
 
         completed = 0
         for (attr, objs) in member_dns.items():
-            for ldap_obj_name, m_dns in objs.items():
-                for m_dn in m_dns:
-                    assert isinstance(m_dn, DN)
-                    if not m_dn:
-                        continue
-                    try:
-                        ldap.remove_entry_from_group(m_dn, dn, attr)
-                    except errors.PublicError as e:
-                        ldap_obj = self.api.Object[ldap_obj_name]
-                        failed[attr][ldap_obj_name].append((
-                            ldap_obj.get_primary_key_from_dn(m_dn),
-                            unicode(e),)
-                        )
-                    else:
-                        completed += 1
+            (m_dns, obj_names) = self._get_member_dn_list(objs)
+            if not m_dns:
+                continue
+            m_failed = ldap.remove_entries_from_group(m_dns, dn, attr)
+            self._report_failed_members(failed, attr, obj_names, m_failed)
+            completed += len(m_dns) - len(m_failed)
 
         if options.get('all', False):
             attrs_list = ['*'] + self.obj.default_attributes
@@ -1917,6 +2070,8 @@ class LDAPSearch(BaseLDAPCommand, crud.Search):
     """
     Retrieve all LDAP entries matching the given criteria.
     """
+    read_only = True
+
     member_attributes = []
     member_param_incl_doc = _('Search for %(searched_object)s with these %(relationship)s %(ldap_object)s.')
     member_param_excl_doc = _('Search for %(searched_object)s without these %(relationship)s %(ldap_object)s.')
@@ -1941,6 +2096,20 @@ class LDAPSearch(BaseLDAPCommand, crud.Search):
             minvalue=0,
             autofill=False,
         ),
+        Int('page_size?',
+            label=_('Page Size'),
+            doc=_('Maximum number of entries returned in one page'),
+            flags=['no_display'],
+            minvalue=1,
+            autofill=False,
+        ),
+        Int('page_offset?',
+            label=_('Page Offset'),
+            doc=_('Index of the first entry of the page (default 0)'),
+            flags=['no_display'],
+            minvalue=0,
+            autofill=False,
+        ),
     )
 
     def get_args(self):
@@ -2072,30 +2241,42 @@ class LDAPSearch(BaseLDAPCommand, crud.Search):
                 self, ldap, filter, attrs_list, base_dn, scope, *args, **options)
             assert isinstance(base_dn, DN)
 
+        if self.obj.primary_key:
+            def sort_key(x):
+                return self.obj.primary_key.sort_key(
+                    x[self.obj.primary_key.name][0])
+
+        remaining = 0
         try:
-            (entries, truncated) = self._exc_wrapper(args, options, ldap.find_entries)(
-                filter, attrs_list, base_dn, scope,
-                time_limit=options.get('timelimit', None),
-                size_limit=options.get('sizelimit', None)
-            )
+            if options.get('page_size') and self.obj.primary_key:
+                (entries, truncated, remaining) = self._find_page(
+                    ldap, filter, attrs_list, base_dn, scope, sort_key,
+                    *args, **options)
+            else:
+                (entries, truncated) = self._exc_wrapper(args, options, ldap.find_entries)(
+                    filter, attrs_list, base_dn, scope,
+                    time_limit=options.get('timelimit', None),
+                    size_limit=options.get('sizelimit', None)
+                )
         except errors.EmptyResult:
             (entries, truncated) = ([], False)
         except errors.NotFound:
             self.api.Object[self.obj.parent_object].handle_not_found(*args[:-1])
 
+        if not options.get('raw', False):
+            # all attributes are converted by entry_to_dict() below
+            ldap.decode_entries(entries)
+
         for callback in self.get_callbacks('post'):
             truncated = callback(self, ldap, entries, truncated, *args, **options)
 
         if self.sort_result_entries:
             if self.obj.primary_key:
-                def sort_key(x):
-                    return self.obj.primary_key.sort_key(
-                        x[self.obj.primary_key.name][0])
                 entries.sort(key=sort_key)
 
         if not options.get('raw', False):
+            self.obj.get_indirect_members_batch(entries, attrs_list)
             for e in entries:
-                self.obj.get_indirect_members(e, attrs_list)
                 self.obj.convert_attribute_members(e, *args, **options)
 
         for (i, e) in enumerate(entries):
@@ -2105,14 +2286,73 @@ class LDAPSearch(BaseLDAPCommand, crud.Search):
         result = dict(
             result=entries,
             count=len(entries),
-            truncated=truncated,
+            truncated=truncated or remaining > 0,
         )
 
         if truncated:
             add_message(options['version'], result, SearchResultTruncated())
+        if remaining:
+            add_message(
+                options['version'], result,
+                SearchResultPaged(
+                    remaining=remaining,
+                    offset=(options.get('page_offset') or 0) + len(entries)))
 
         return result
 
+    def _find_page(self, ldap, filter, attrs_list, base_dn, scope, sort_key,
+                   *args, **options):
+        """
+        Retrieve one page of the search result.
+
+        Only the primary keys of all the matching entries are read and
+        sorted first, the requested attributes are then read for the entries
+        of the page only, so the memory needed to serve a single request does
+        not grow with the size of the directory. Clients iterate over the
+        result by repeating the search with page_offset moved by the number
+        of returned entries until no entries remain.
+
+        Returns a (entries, truncated, remaining) tuple, where remaining is
+        the number of matching entries following the page.
+        """
+        pkey_name = self.obj.primary_key.name
+        page_size = options['page_size']
+        page_offset = options.get('page_offset') or 0
+
+        (entries, truncated) = self._exc_wrapper(args, options, ldap.find_entries)(
+            filter, [pkey_name], base_dn, scope,
+            time_limit=options.get('timelimit', None),
+            size_limit=-1, # paged search will get everything anyway
+            paged_search=True
+        )
+        entries.sort(key=sort_key)
+        page = entries[page_offset:page_offset + page_size]
+        remaining = max(len(entries) - page_offset - len(page), 0)
+        del entries
+
+        if not page or options.get('pkey_only', False):
+            return (page, truncated, remaining)
+
+        pkeys = []
+        for entry in page:
+            pkeys.extend(entry[pkey_name])
+        page_filter = ldap.combine_filters(
+            (filter, ldap.make_filter_from_attr(pkey_name, pkeys)),
+            rules=ldap.MATCH_ALL
+        )
+        try:
+            (entries, _truncated) = self._exc_wrapper(args, options, ldap.find_entries)(
+                page_filter, attrs_list, base_dn, scope,
+                time_limit=options.get('timelimit', None),
+                size_limit=0
+            )
+        except errors.EmptyResult:
+            # entries of the page were deleted in the meantime
+            entries = []
+        entries.sort(key=sort_key)
+
+        return (entries, truncated, remaining)
+
     def pre_callback(self, ldap, filters, attrs_list, base_dn, scope, *args, **options):
         assert isinstance(base_dn, DN)
         return (filters, base_dn, scope)
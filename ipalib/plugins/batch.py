@@ -43,16 +43,27 @@ The format of the response is nested the same way.  At the top you will see
 
 And then a nested response for each IPA command method sent in the request
 
+With the "parallel" option set to true, consecutive read-only methods
+(commands with read_only set, such as most *_show and *_find commands) are
+executed concurrently, using at most batch_max_parallel threads on the
+server, each with its own LDAP connection.
+Other methods are still executed one at a time in the order in which they
+were sent. The results are always returned in the order of the request.
+
 """
 
+import os
+import threading
+
 import six
+from six.moves import queue
 
-from ipalib import api, errors
+from ipalib import errors
 from ipalib import Command
-from ipalib.parameters import Str, Any
+from ipalib.parameters import Str, Any, Flag
 from ipalib.output import Output
 from ipalib.text import _
-from ipalib.request import context
+from ipalib.request import context, destroy_context
 from ipalib.plugable import Registry
 from ipapython.version import API_VERSION
 
@@ -87,53 +98,135 @@ class batch(Command):
         Output('results', (list, tuple), doc='')
     )
 
+    takes_options = (
+        Flag('parallel?',
+            doc=_('Execute read-only methods concurrently'),
+            default=False,
+            autofill=True,
+        ),
+    )
+
+    # request context attributes made available to the worker threads
+    parallel_context_attrs = ('principal', 'languages', 'client_ip')
+
     def execute(self, *args, **options):
+        methods = args[0]
+        version = options['version']
+        if not options.get('parallel') or not self.api.env.in_server:
+            results = [self._execute_method(arg, version) for arg in methods]
+            return dict(count=len(results), results=results)
+
         results = []
-        for arg in args[0]:
-            params = dict()
-            name = None
+        group = []
+        for arg in methods:
+            if self._is_read_only(arg):
+                group.append(arg)
+                continue
+            results.extend(self._execute_parallel(group, version))
+            group = []
+            results.append(self._execute_method(arg, version))
+        results.extend(self._execute_parallel(group, version))
+        return dict(count=len(results), results=results)
+
+    def _is_read_only(self, arg):
+        try:
+            name = arg['method']
+        except (KeyError, TypeError):
+            return False
+        if name not in self.Command:
+            return False
+        return self.Command[name].read_only
+
+    def _execute_parallel(self, methods, version):
+        """
+        Execute methods concurrently and return their results in order.
+        """
+        max_parallel = min(len(methods), self.api.env.batch_max_parallel)
+        if max_parallel <= 1:
+            return [self._execute_method(arg, version) for arg in methods]
+
+        results = [None] * len(methods)
+        pending = queue.Queue()
+        for i, arg in enumerate(methods):
+            pending.put((i, arg))
+
+        ccache = os.environ.get('KRB5CCNAME')
+        state = dict((name, getattr(context, name))
+                     for name in self.parallel_context_attrs
+                     if hasattr(context, name))
+
+        def worker():
+            for name, value in state.items():
+                setattr(context, name, value)
             try:
-                if 'method' not in arg:
-                    raise errors.RequirementError(name='method')
-                if 'params' not in arg:
-                    raise errors.RequirementError(name='params')
-                name = arg['method']
-                if name not in self.Command:
-                    raise errors.CommandError(name=name)
-                a, kw = arg['params']
-                newkw = dict((str(k), v) for k, v in kw.items())
-                params = api.Command[name].args_options_2_params(*a, **newkw)
-                newkw.setdefault('version', options['version'])
-
-                result = api.Command[name](*a, **newkw)
+                self.api.Backend.ldap2.connect(ccache=ccache)
+                while True:
+                    try:
+                        i, arg = pending.get_nowait()
+                    except queue.Empty:
+                        break
+                    results[i] = self._execute_method(arg, version)
+            except Exception as e:
+                self.error('batch: parallel worker failed: %s', e)
+            finally:
+                destroy_context()
+
+        threads = [threading.Thread(target=worker)
+                   for i in range(max_parallel)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # methods left over by failed workers are executed here
+        for i, arg in enumerate(methods):
+            if results[i] is None:
+                results[i] = self._execute_method(arg, version)
+        return results
+
+    def _execute_method(self, arg, version):
+        params = dict()
+        name = None
+        try:
+            if 'method' not in arg:
+                raise errors.RequirementError(name='method')
+            if 'params' not in arg:
+                raise errors.RequirementError(name='params')
+            name = arg['method']
+            if name not in self.Command:
+                raise errors.CommandError(name=name)
+            a, kw = arg['params']
+            newkw = dict((str(k), v) for k, v in kw.items())
+            params = self.Command[name].args_options_2_params(*a, **newkw)
+            newkw.setdefault('version', version)
+
+            result = self.Command[name](*a, **newkw)
+            self.info(
+                '%s: batch: %s(%s): SUCCESS', context.principal, name, ', '.join(self.Command[name]._repr_iter(**params))
+            )
+            result['error']=None
+        except Exception as e:
+            if isinstance(e, errors.RequirementError) or \
+                isinstance(e, errors.CommandError):
                 self.info(
-                    '%s: batch: %s(%s): SUCCESS', context.principal, name, ', '.join(api.Command[name]._repr_iter(**params))
+                    '%s: batch: %s',
+                    context.principal,  # pylint: disable=no-member
+                    e.__class__.__name__
                 )
-                result['error']=None
-            except Exception as e:
-                if isinstance(e, errors.RequirementError) or \
-                    isinstance(e, errors.CommandError):
-                    self.info(
-                        '%s: batch: %s',
-                        context.principal,  # pylint: disable=no-member
-                        e.__class__.__name__
-                    )
-                else:
-                    self.info(
-                        '%s: batch: %s(%s): %s',
-                        context.principal, name,  # pylint: disable=no-member
-                        ', '.join(api.Command[name]._repr_iter(**params)),
-                        e.__class__.__name__
-                    )
-                if isinstance(e, errors.PublicError):
-                    reported_error = e
-                else:
-                    reported_error = errors.InternalError()
-                result = dict(
-                    error=reported_error.strerror,
-                    error_code=reported_error.errno,
-                    error_name=unicode(type(reported_error).__name__),
+            else:
+                self.info(
+                    '%s: batch: %s(%s): %s',
+                    context.principal, name,  # pylint: disable=no-member
+                    ', '.join(self.Command[name]._repr_iter(**params)),
+                    e.__class__.__name__
                 )
-            results.append(result)
-        return dict(count=len(results) , results=results)
-
+            if isinstance(e, errors.PublicError):
+                reported_error = e
+            else:
+                reported_error = errors.InternalError()
+            result = dict(
+                error=reported_error.strerror,
+                error_code=reported_error.errno,
+                error_name=unicode(type(reported_error).__name__),
+            )
+        return result
@@ -33,6 +33,7 @@ from ipalib import ngettext
 from ipalib.plugable import Registry
 from ipalib.plugins.virtual import VirtualCommand
 from ipalib.plugins.baseldap import pkey_to_value
+from ipalib.messages import add_message, SearchResultTruncated
 from ipalib.plugins.service import split_any_principal
 from ipalib.plugins.certprofile import validate_profile_id
 import ipalib.plugins.caacl
@@ -788,7 +789,7 @@ class cert_find(Command):
         ),
         Int('sizelimit?',
             label=_('Size Limit'),
-            doc=_('Maximum number of certs returned'),
+            doc=_('Maximum number of certs returned (0 is unlimited)'),
             flags=['no_display'],
             minvalue=0,
             default=100,
@@ -814,11 +815,27 @@ class cert_find(Command):
 
     def execute(self, **options):
         ca_enabled_check()
+
+        sizelimit = options.get('sizelimit', 100)
+        if sizelimit == 0:
+            # no limit
+            result = list(self.Backend.ra.find_iter(options, limit=None))
+            truncated = False
+        else:
+            # Request one more certificate than the limit to know whether
+            # the result was truncated
+            result = list(
+                self.Backend.ra.find_iter(options, limit=sizelimit + 1))
+            truncated = len(result) > sizelimit
+            del result[sizelimit:]
+
         ret = dict(
-            result=self.Backend.ra.find(options)
+            result=result,
+            count=len(result),
+            truncated=truncated,
         )
-        ret['count'] = len(ret['result'])
-        ret['truncated'] = False
+        if truncated:
+            add_message(options['version'], ret, SearchResultTruncated())
         return ret
 
 
@@ -189,6 +189,7 @@ class delegation_mod(crud.Update):
 @register()
 class delegation_find(crud.Search):
     __doc__ = _('Search for delegations.')
+    read_only = True
 
     msg_summary = ngettext(
         '%(count)d delegation matched', '%(count)d delegations matched', 0
@@ -215,6 +216,7 @@ class delegation_find(crud.Search):
 @register()
 class delegation_show(crud.Retrieve):
     __doc__ = _('Display information about a delegation.')
+    read_only = True
 
     has_output_params = output_params
 
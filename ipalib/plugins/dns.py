@@ -21,7 +21,10 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
+import collections
+import json
 import netaddr
+import threading
 import time
 import re
 import binascii
@@ -31,6 +34,7 @@ import dns.name
 import dns.exception
 import dns.rdatatype
 import dns.resolver
+import dns.zone
 import six
 
 from ipalib.request import context
@@ -40,7 +44,7 @@ from ipalib.capabilities import (
     VERSION_WITHOUT_CAPABILITIES,
     client_has_capability)
 from ipalib.parameters import (Flag, Bool, Int, Decimal, Str, StrEnum, Any,
-                               DeprecatedParam, DNSNameParam)
+                               DeprecatedParam, DNSNameParam, File)
 from ipalib.plugable import Registry
 from ipalib.plugins.baseldap import (
     pkey_to_value,
@@ -222,6 +226,13 @@ EXAMPLES:
  Delegate zone sub.example to another nameserver:
    ipa dnsrecord-add example.com ns.sub --a-rec=203.0.113.1
    ipa dnsrecord-add example.com sub --ns-rec=ns.sub.example.com.
+""") + _("""
+ Import the resource records of zone example.com from a zone file:
+   ipa dnsrecord-import example.com --file=example.com.zone
+""") + _("""
+ Import resource records from a JSON document which maps record names to
+ record types and values, e.g. {"www": {"A": ["192.0.2.2"]}}:
+   ipa dnsrecord-import example.com --file=records.json --format=json
 """) + _("""
  Delete zone example.com with all resource records:
    ipa dnszone-del example.com
@@ -1579,6 +1590,127 @@ def check_ns_rec_resolvable(zone, name, log):
                      'A/AAAA record') % {'host': name}
         )
 
+class DNSZoneInfo(collections.namedtuple(
+        'DNSZoneInfo', ['name', 'dn', 'master', 'forward', 'active'])):
+    """
+    DNS zone in the `DNSZoneMap`.
+
+    name is the absolute zone name, master and forward tell whether it is
+    a master or a forward zone.
+    """
+
+
+class DNSZoneMap(object):
+    """
+    Per-process map of the DNS zones in LDAP.
+
+    The map answers the zone lookups of the DNS commands, which would
+    otherwise search the zone container for every record, from memory.
+    It is loaded with a single search and kept for ``ttl`` seconds, or
+    until a zone is added, modified or deleted in this process. A map is
+    kept per bound principal, each one only contains the zones the
+    principal can read.
+
+    A zone which is not in the map may have been added by another process
+    since it was loaded, callers which need to be certain look it up in
+    LDAP.
+    """
+
+    ttl = 5
+    max_maps = 16
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._maps = collections.OrderedDict()
+
+    def invalidate(self):
+        """
+        Discard all the maps.
+        """
+        with self._lock:
+            self._maps.clear()
+
+    def _load(self, api):
+        ldap = api.Backend.ldap2
+        container_dn = DN(api.env.container_dns, api.env.basedn)
+
+        try:
+            ldap.get_entry(container_dn, [])
+        except errors.NotFound:
+            return None
+
+        search_filter = ldap.make_filter(
+            {'objectclass': ['idnszone', 'idnsforwardzone']},
+            rules=ldap.MATCH_ANY)
+        try:
+            entries, truncated = ldap.find_entries(
+                filter=search_filter,
+                attrs_list=['idnsname', 'objectclass', 'idnszoneactive'],
+                base_dn=container_dn,
+                scope=ldap.SCOPE_ONELEVEL,
+                size_limit=0,
+                paged_search=True
+            )
+        except errors.NotFound:
+            entries, truncated = [], False
+
+        zones = {}
+        for entry in entries:
+            name = entry.single_value['idnsname'].make_absolute()
+            objectclasses = [o.lower() for o in entry.get('objectclass', [])]
+            # like the (idnsZoneActive=true) filter of the LDAP lookups, a
+            # zone without the attribute is not active
+            active = entry.single_value.get('idnszoneactive')
+            zones[name] = DNSZoneInfo(
+                name=name,
+                dn=entry.dn,
+                master='idnszone' in objectclasses,
+                forward='idnsforwardzone' in objectclasses,
+                active=active is not None and active.upper() == u'TRUE',
+            )
+        return zones, truncated
+
+    def get(self, api):
+        """
+        :return: tuple (zones, complete); zones is a dict mapping absolute
+            zone names to `DNSZoneInfo`, or None if DNS is not configured;
+            complete is False if the search for zones was truncated
+        """
+        key = getattr(context, 'principal', None)
+        now = time.time()
+        with self._lock:
+            cached = self._maps.get(key)
+            if cached is not None and cached[0] > now:
+                return cached[1]
+
+        loaded = self._load(api)
+        if loaded is None:
+            result = None, True
+        else:
+            zones, truncated = loaded
+            result = zones, not truncated
+
+        with self._lock:
+            self._maps.pop(key, None)
+            self._maps[key] = (now + self.ttl, result)
+            while len(self._maps) > self.max_maps:
+                self._maps.popitem(last=False)
+        return result
+
+    def get_zone(self, api, name):
+        """
+        :return: `DNSZoneInfo` of the zone name, or None if it is not in
+            the map
+        """
+        zones, complete = self.get(api)
+        if zones is None:
+            return None
+        return zones.get(name.make_absolute())
+
+
+_dns_zone_map = DNSZoneMap()
+
+
 def dns_container_exists(ldap):
     try:
         ldap.get_entry(DN(api.env.container_dns, api.env.basedn), [])
@@ -1773,6 +1905,16 @@ def _get_auth_zone_ldap(api, name):
 
     # Create all possible parent zone names
     search_name = name.make_absolute()
+
+    zones, complete = _dns_zone_map.get(api)
+    if zones is not None:
+        # longest match first. A zone added since the map was loaded is
+        # not in it, the name is looked up in LDAP if no zone matches.
+        for i in range(len(search_name)):
+            zone_info = zones.get(DNSName(search_name[i:]))
+            if zone_info is not None and zone_info.master and zone_info.active:
+                return zone_info.name, False
+
     zone_names = []
     for i, name in enumerate(search_name):
         zone_name_abs = DNSName(search_name[i:]).ToASCII()
@@ -1894,6 +2036,20 @@ def _find_subtree_forward_zones_ldap(api, name, child_zones_only=False):
     assert isinstance(name, DNSName)
     ldap = api.Backend.ldap2
 
+    zones, complete = _dns_zone_map.get(api)
+    if zones is not None and complete:
+        name = name.make_absolute()
+        result = []
+        for zone_info in zones.values():
+            if not zone_info.forward or not zone_info.active:
+                continue
+            if zone_info.name == name:
+                if not child_zones_only:
+                    result.append(zone_info.name)
+            elif zone_info.name.is_subdomain(name):
+                result.append(zone_info.name)
+        return result, False
+
     # prepare for filter "*.<name>."
     search_name = u".%s" % name.make_absolute().ToASCII()
 
@@ -2048,12 +2204,17 @@ class DNSZoneBase(LDAPObject):
     )
 
     def get_dn(self, *keys, **options):
-        if not dns_container_exists(self.api.Backend.ldap2):
-            raise errors.NotFound(reason=_('DNS is not configured'))
-
         zone = keys[-1]
         assert isinstance(zone, DNSName)
         assert zone.is_absolute()
+
+        zone_info = _dns_zone_map.get_zone(self.api, zone)
+        if zone_info is not None:
+            return zone_info.dn
+
+        if not dns_container_exists(self.api.Backend.ldap2):
+            raise errors.NotFound(reason=_('DNS is not configured'))
+
         zone_a = zone.ToASCII()
 
         # special case when zone is the root zone ('.')
@@ -2162,9 +2323,21 @@ class DNSZoneBase_add(LDAPCreate):
 
         return dn
 
+    def execute(self, *keys, **options):
+        try:
+            return super(DNSZoneBase_add, self).execute(*keys, **options)
+        finally:
+            _dns_zone_map.invalidate()
+
 
 class DNSZoneBase_del(LDAPDelete):
 
+    def execute(self, *keys, **options):
+        try:
+            return super(DNSZoneBase_del, self).execute(*keys, **options)
+        finally:
+            _dns_zone_map.invalidate()
+
     def pre_callback(self, ldap, dn, *nkeys, **options):
         assert isinstance(dn, DN)
         if not _check_DN_objectclass(ldap, dn, self.obj.object_class):
@@ -2183,6 +2356,12 @@ class DNSZoneBase_del(LDAPDelete):
 class DNSZoneBase_mod(LDAPUpdate):
     has_output_params = LDAPUpdate.has_output_params + dnszone_output_params
 
+    def execute(self, *keys, **options):
+        try:
+            return super(DNSZoneBase_mod, self).execute(*keys, **options)
+        finally:
+            _dns_zone_map.invalidate()
+
     def post_callback(self, ldap, dn, entry_attrs, *keys, **options):
         assert isinstance(dn, DN)
         self.obj._make_zonename_absolute(entry_attrs, **options)
@@ -2267,6 +2446,7 @@ class DNSZoneBase_disable(LDAPQuery):
             ldap.update_entry(entry)
         except errors.EmptyModlist:
             pass
+        _dns_zone_map.invalidate()
 
         return dict(result=True, value=pkey_to_value(keys[-1], options))
 
@@ -2292,6 +2472,7 @@ class DNSZoneBase_enable(LDAPQuery):
             ldap.update_entry(entry)
         except errors.EmptyModlist:
             pass
+        _dns_zone_map.invalidate()
 
         return dict(result=True, value=pkey_to_value(keys[-1], options))
 
@@ -3129,6 +3310,10 @@ class dnsrecord(LDAPObject):
         """
         Check if zone exists and if is master zone
         """
+        zone_info = _dns_zone_map.get_zone(self.api, zone)
+        if zone_info is not None and zone_info.master:
+            return zone_info.dn
+
         parent_object = self.api.Object[self.parent_object]
         dn = parent_object.get_dn(zone, **options)
         ldap = self.api.Backend.ldap2
@@ -3147,9 +3332,6 @@ class dnsrecord(LDAPObject):
 
 
     def get_dn(self, *keys, **options):
-        if not dns_container_exists(self.api.Backend.ldap2):
-            raise errors.NotFound(reason=_('DNS is not configured'))
-
         dn = self.check_zone(keys[-2], **options)
 
         if self.is_pkey_zone_record(*keys):
@@ -4210,6 +4392,301 @@ class dnsrecord_find(LDAPSearch):
         return truncated
 
 
+@register()
+class dnsrecord_import(LDAPQuery):
+    __doc__ = _('Import DNS resource records into a zone.')
+
+    takes_options = (
+        File('file',
+            label=_('File'),
+            doc=_('Zone file or JSON document with the resource records'),
+            cli_name='file',
+        ),
+        StrEnum('format?',
+            label=_('Format'),
+            doc=_('Format of the file'),
+            values=(u'zonefile', u'json'),
+            default=u'zonefile',
+            autofill=True,
+        ),
+        Flag('force',
+            label=_('Force'),
+            doc=_('force NS record creation even if its hostname is not in DNS'),
+        ),
+        Flag('continue',
+            cli_name='continue',
+            doc=_("Continuous mode: Don't stop on errors."),
+        ),
+    )
+
+    has_output = (
+        output.summary,
+        output.Output('result',
+            type=dict,
+            doc=_('Numbers of record names added, updated and unchanged.'),
+        ),
+        output.Output('failed',
+            type=dict,
+            doc=_('Record names which could not be imported, with the reason.'),
+        ),
+    )
+
+    # log the progress after every progress_interval record names
+    progress_interval = 1000
+
+    def get_args(self):
+        # records are imported into the zone, there is no record name
+        for key in self.obj.get_ancestor_primary_keys():
+            yield key
+
+    def _parse_zonefile(self, zone, data):
+        """
+        Parse the records of a zone file into a dict mapping record names
+        to dicts of record attributes.
+        """
+        try:
+            dns_zone = dns.zone.from_text(data, origin=zone, relativize=True,
+                                          check_origin=False)
+        except dns.exception.DNSException as e:
+            raise errors.ValidationError(name='file', error=unicode(e))
+
+        records = collections.OrderedDict()
+        for name, node in sorted(dns_zone.nodes.items()):
+            record = {}
+            ttls = []
+            for rdataset in node.rdatasets:
+                # the SOA record is managed by the dnszone commands
+                if rdataset.rdtype == dns.rdatatype.SOA:
+                    continue
+                attr = '%srecord' % (
+                    dns.rdatatype.to_text(rdataset.rdtype).lower())
+                record[attr] = [
+                    unicode(rdata.to_text(origin=zone, relativize=False))
+                    for rdata in rdataset]
+                ttls.append(rdataset.ttl)
+            if record:
+                # there is a single TTL per record name in LDAP
+                record['dnsttl'] = min(ttls)
+                records[DNSName(name)] = record
+        return records
+
+    def _parse_json(self, data):
+        """
+        Parse a JSON object mapping record names to objects which map record
+        types to lists of values, e.g. {"www": {"A": ["192.0.2.1"]}}.
+        """
+        try:
+            document = json.loads(
+                data, object_pairs_hook=collections.OrderedDict)
+        except ValueError as e:
+            raise errors.ValidationError(name='file', error=unicode(e))
+
+        if not isinstance(document, dict) or not all(
+                isinstance(v, dict) for v in document.values()):
+            raise errors.ValidationError(
+                name='file',
+                error=_('must be an object mapping record names to objects '
+                        'with the records'))
+
+        records = collections.OrderedDict()
+        for name, rrsets in document.items():
+            record = {}
+            for rrtype, values in rrsets.items():
+                attr = str(rrtype.lower())
+                if attr in ('ttl', 'dnsttl'):
+                    record['dnsttl'] = values
+                    continue
+                if not attr.endswith('record'):
+                    attr = '%srecord' % attr
+                if not isinstance(values, list):
+                    values = [values]
+                record[attr] = values
+            records[name] = record
+        return records
+
+    def _get_entries(self, ldap, zone_dn):
+        """
+        Get the records of the zone with a single search.
+        """
+        attrs_list = ['idnsname', 'dnsttl'] + _record_attributes
+        entries = [ldap.get_entry(zone_dn, attrs_list)]
+        try:
+            children, truncated = ldap.find_entries(
+                filter='(objectclass=idnsrecord)',
+                attrs_list=attrs_list,
+                base_dn=zone_dn,
+                scope=ldap.SCOPE_ONELEVEL,
+                size_limit=0,
+                paged_search=True
+            )
+        except errors.NotFound:
+            pass
+        else:
+            entries.extend(children)
+        return dict((entry.dn, entry) for entry in entries)
+
+    def _normalize_name(self, zone, name):
+        """
+        Convert a record name to a `DNSName` relative to the zone if it is
+        in the zone.
+        """
+        if not isinstance(name, DNSName):
+            try:
+                name = DNSName(name)
+            except dns.exception.SyntaxError as e:
+                raise errors.ValidationError(name='idnsname',
+                                             error=unicode(e))
+        zone = zone.make_absolute()
+        if name.is_absolute() and name.is_subdomain(zone):
+            name = name.relativize(zone)
+        return name
+
+    def _merge_record(self, merged, record):
+        """
+        Merge the records of a record name into the records of another
+        name referring to the same record name.
+        """
+        for attr, values in record.items():
+            if attr == 'dnsttl':
+                if attr in merged and unicode(merged[attr]) != unicode(values):
+                    raise errors.ValidationError(
+                        name=attr,
+                        error=_('conflicting TTLs of the same record name'))
+                merged[attr] = values
+                continue
+            old_values = merged.setdefault(attr, [])
+            old_values.extend(v for v in values if v not in old_values)
+
+    def _prepare_entry(self, ldap, existing, zone, name, record, **options):
+        """
+        Validate the records of a record name and merge them with its
+        existing records.
+
+        :return: tuple (name, entry); entry is the new entry to add, the
+            updated existing entry, or None if the existing entry already
+            contains all the records
+        """
+        keys = (zone, name)
+        dn = self.obj.get_dn(*keys, **options)
+
+        entry_attrs = ldap.make_entry(dn)
+        entry_attrs[self.obj.primary_key.name] = [name]
+        for attr, values in record.items():
+            if attr == 'dnsttl':
+                entry_attrs[attr] = [self.obj.params[attr](values)]
+                continue
+            if (attr not in self.obj.params or
+                    not isinstance(self.obj.params[attr], DNSRecord)):
+                raise errors.ValidationError(
+                    name=attr,
+                    error=_('unknown DNS resource record type'))
+            entry_attrs[attr] = list(self.obj.params[attr](values))
+
+        self.obj.run_precallback_validators(dn, entry_attrs, *keys, **options)
+
+        old_entry = existing.get(dn)
+        new_rrattrs = self.obj.updated_rrattrs(None, entry_attrs)
+        if old_entry is not None:
+            for attr, values in new_rrattrs.items():
+                old_values = old_entry.get(attr, [])
+                new_rrattrs[attr] = old_values + [
+                    v for v in values if v not in old_values]
+        rrattrs = self.obj.updated_rrattrs(old_entry, new_rrattrs)
+        self.obj.check_record_type_dependencies(keys, rrattrs)
+        self.obj.check_record_type_collisions(keys, rrattrs)
+
+        if old_entry is None:
+            entry_attrs.update(new_rrattrs)
+            entry_attrs['objectclass'] = self.obj.object_class
+            return name, entry_attrs
+
+        modified = False
+        for attr, values in new_rrattrs.items():
+            if values != old_entry.get(attr, []):
+                old_entry[attr] = values
+                modified = True
+        if 'dnsttl' in entry_attrs and (
+                old_entry.get('dnsttl') != entry_attrs['dnsttl']):
+            old_entry['dnsttl'] = entry_attrs['dnsttl']
+            modified = True
+        if not modified:
+            return name, None
+        return name, old_entry
+
+    def execute(self, *keys, **options):
+        ldap = self.obj.backend
+        zone = keys[-1]
+        zone_dn = self.obj.check_zone(zone, **options)
+
+        if options.get('format') == u'json':
+            records = self._parse_json(options['file'])
+        else:
+            records = self._parse_zonefile(zone, options['file'])
+
+        existing = self._get_entries(ldap, zone_dn)
+        failed = {}
+
+        # names such as "www" and "www.<zone>." refer to the same record
+        # name, merge their records
+        grouped = collections.OrderedDict()
+        for name, record in records.items():
+            try:
+                name = self._normalize_name(zone, name)
+                self._merge_record(grouped.setdefault(name, {}), record)
+            except errors.PublicError as e:
+                if not options.get('continue'):
+                    raise errors.ValidationError(name=unicode(name),
+                                                 error=unicode(e))
+                failed[unicode(name)] = unicode(e)
+
+        # validate all the records before anything is written
+        entries = []
+        for name, record in grouped.items():
+            if unicode(name) in failed:
+                continue
+            try:
+                entries.append(self._prepare_entry(
+                    ldap, existing, zone, name, record, **options))
+            except errors.PublicError as e:
+                if not options.get('continue'):
+                    raise errors.ValidationError(name=unicode(name),
+                                                 error=unicode(e))
+                failed[unicode(name)] = unicode(e)
+
+        # write a single add or modify per record name
+        counts = dict(added=0, updated=0, unchanged=0)
+        entry_mods = {}
+        for count, (name, entry) in enumerate(entries, 1):
+            try:
+                if entry is None:
+                    counts['unchanged'] += 1
+                elif entry.dn in existing:
+                    ldap.update_entry(entry)
+                    counts['updated'] += 1
+                else:
+                    ldap.add_entry(entry)
+                    counts['added'] += 1
+            except errors.PublicError as e:
+                if not options.get('continue'):
+                    raise
+                failed[unicode(name)] = unicode(e)
+            else:
+                if entry is not None:
+                    entry_mods[(zone, name)] = entry
+
+            if count % self.progress_interval == 0:
+                self.log.info('%s: %d of %d record names of zone %s written',
+                              self.name, count, len(entries), zone)
+
+        if self.api.env['wait_for_dns']:
+            self.obj.wait_for_modified_entries(entry_mods)
+
+        summary = _('Imported %(count)d record names, %(failed)d failed') % dict(
+            count=counts['added'] + counts['updated'],
+            failed=len(failed))
+        return dict(result=counts, failed=failed, summary=unicode(summary))
+
+
 @register()
 class dns_resolve(Command):
     __doc__ = _('Resolve a host name in DNS. (Deprecated)')
@@ -24,23 +24,98 @@ Plugins not accessible directly through the CLI, commands used internally
 """
 from __future__ import print_function
 
+import hashlib
 import json
+import os
+import threading
 
 from ipalib import Command
 from ipalib import Str
 from ipalib.output import Output
+from ipalib.request import context
 from ipalib.text import _
 from ipalib.util import json_serialize
 from ipalib.plugable import Registry
+from ipapython.version import VERSION, API_VERSION
 
 register = Registry()
 
+
+def _get_languages():
+    """
+    Return the languages the texts of the current request are translated to.
+    """
+    languages = getattr(context, 'languages', None)
+    if languages:
+        return tuple(languages)
+    # the same variables as are used by gettext
+    return tuple(os.environ.get(name)
+                 for name in ('LANGUAGE', 'LC_ALL', 'LC_MESSAGES', 'LANG'))
+
+
+class CachedCommand(Command):
+    """
+    Base class for commands whose result only depends on the loaded plugins,
+    the language of the request and the arguments.
+
+    The result is computed once per process for every language and
+    arguments, and identified by an entity tag for HTTP conditional requests.
+    """
+    NO_CLI = True
+
+    # maximum number of results kept
+    cache_size = 64
+
+    def _on_finalize(self):
+        super(CachedCommand, self)._on_finalize()
+        self.__cache = {}
+        self.__lock = threading.Lock()
+        # the plugin is locked once finalized, keep the digest of the API
+        # in a mutable object
+        self.__api_digest = []
+
+    def _get_cache_key(self, args, options):
+        options = sorted(
+            (k, v) for (k, v) in options.items() if k != 'version')
+        return (_get_languages(), tuple(args), tuple(options))
+
+    def get_cached(self, create, *args, **options):
+        """
+        Return the result for the arguments, calling create to create it if
+        it is not cached yet.
+        """
+        key = self._get_cache_key(args, options)
+        with self.__lock:
+            try:
+                return self.__cache[key]
+            except KeyError:
+                pass
+            result = create(*args, **options)
+            if len(self.__cache) >= self.cache_size:
+                self.__cache.clear()
+            self.__cache[key] = result
+            return result
+
+    def get_etag(self, *args, **options):
+        if not self.__api_digest:
+            digest = hashlib.sha1()
+            digest.update(repr((VERSION, API_VERSION)).encode('utf-8'))
+            for namespace in (self.api.Object, self.api.Command):
+                for plugin in namespace():
+                    digest.update(plugin.fullname.encode('utf-8'))
+            self.__api_digest[:] = [digest.hexdigest()]
+
+        digest = hashlib.sha1(self.__api_digest[0].encode('utf-8'))
+        digest.update(
+            repr(self._get_cache_key(args, options)).encode('utf-8'))
+        return '"%s"' % digest.hexdigest()
+
+
 @register()
-class json_metadata(Command):
+class json_metadata(CachedCommand):
     """
     Export plugin meta-data for the webUI.
     """
-    NO_CLI = True
 
 
     takes_args = (
@@ -71,6 +146,10 @@ class json_metadata(Command):
     )
 
     def execute(self, objname, methodname, **options):
+        return self.get_cached(self._get_metadata, objname, methodname,
+                               **options)
+
+    def _get_metadata(self, objname, methodname, **options):
         objects = dict()
         methods = dict()
         commands = dict()
@@ -142,8 +221,7 @@ class json_metadata(Command):
 
 
 @register()
-class i18n_messages(Command):
-    NO_CLI = True
+class i18n_messages(CachedCommand):
 
     messages = {
         "ajax": {
@@ -858,6 +936,9 @@ class i18n_messages(Command):
         Output('texts', dict, doc=_('Dict of I18N messages')),
     )
     def execute(self, **options):
+        return self.get_cached(self._get_messages, **options)
+
+    def _get_messages(self, **options):
         return dict(texts=json_serialize(self.messages))
 
     def output_for_cli(self, textui, result, *args, **options):
@@ -17,16 +17,20 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import re
+import threading
 from ldap import MOD_ADD
 from ldap import SCOPE_BASE, SCOPE_ONELEVEL, SCOPE_SUBTREE
 
 import six
+from six.moves import queue
 
 from ipalib import api, errors, output
-from ipalib import Command, Password, Str, Flag, StrEnum, DNParam, File, Bool
+from ipalib import Command, Password, Str, Flag, StrEnum, DNParam, File, Bool, Int
 from ipalib.cli import to_cli
 from ipalib.plugable import Registry
+from ipalib import request
 from ipalib.plugins.user import NO_UPG_MAGIC
 if api.env.in_server and api.env.context in ['lite', 'server']:
     try:
@@ -82,11 +86,19 @@ If a base DN is not provided with --basedn then IPA will use either
 the value of defaultNamingContext if it is set or the first value
 in namingContexts set in the root of the remote LDAP server.
 
+Entries are read from the remote server in pages and migrated in
+batches of --batch-size entries (100 by default). The entries of a batch
+can be written to IPA over several LDAP connections at once, see the
+--parallel option.
+
 Users are added as members to the default user group. This can be a
-time-intensive task so during migration this is done in a batch
-mode for every 100 users. As a result there will be a window in which
-users will be added to IPA but will not be members of the default
-user group.
+time-intensive task so during migration this is done once for every
+batch of users. As a result there will be a window in which users will
+be added to IPA but will not be members of the default user group.
+
+An interrupted migration can be resumed by running the same command
+again. Users which already exist in IPA are skipped without querying
+the remote server for them.
 
 EXAMPLES:
 
@@ -119,15 +131,20 @@ EXAMPLES:
        --user-ignore-attribute=radiusgroupname \\
        ldap://ds.example.com:389
 
+ Migrate a large directory in batches of 1000 entries, using 4 LDAP
+ connections to write the entries to IPA:
+    ipa migrate-ds --batch-size=1000 --parallel=4 \\
+       ldap://ds.example.com:389
+
 LOGGING
 
 Migration will log warnings and errors to the Apache error log. This
 file should be evaluated post-migration to correct or investigate any
 issues that were discovered.
 
-For every 100 users migrated an info-level message will be displayed to
-give the current progress and duration to make it possible to track
-the progress of migration.
+For every batch of entries migrated an info-level message will be
+displayed to give the current progress and duration to make it possible
+to track the progress of migration.
 
 If the log level is debug, either by setting debug = True in
 /etc/ipa/default.conf or /etc/ipa/server.conf, then an entry will be printed
@@ -172,10 +189,18 @@ def _pre_migrate_user(ldap, pkey, dn, entry_attrs, failed, config, ctx, **kwargs
                          % (entry_attrs['gidnumber'][0], pkey))
         elif entry_attrs['gidnumber'][0] not in valid_gids:
             try:
-                remote_entry = ds_ldap.find_entry_by_attr(
-                    'gidnumber', entry_attrs['gidnumber'][0], 'posixgroup',
-                    [''], search_bases['group']
-                )
+                group_gids = ctx.get('group_gids')
+                if group_gids is None:
+                    ds_ldap.find_entry_by_attr(
+                        'gidnumber', entry_attrs['gidnumber'][0],
+                        'posixgroup', [''], search_bases['group']
+                    )
+                else:
+                    found = group_gids.get(entry_attrs['gidnumber'][0], 0)
+                    if found == 0:
+                        raise errors.NotFound(reason=u'no such group')
+                    elif found > 1:
+                        raise errors.SingleMatchExpected(found=found)
                 valid_gids.add(entry_attrs['gidnumber'][0])
             except errors.NotFound:
                 api.log.warning('GID number %s of migrated user %s does not point to a known group.' \
@@ -250,9 +275,8 @@ def _pre_migrate_user(ldap, pkey, dn, entry_attrs, failed, config, ctx, **kwargs
                             'in attribute %s which could not be converted to DN: %s',
                                 pkey, value, type(value), attr, e)
                         continue
-                try:
-                    remote_entry = ds_ldap.get_entry(value, [api.Object.user.primary_key.name, api.Object.group.primary_key.name])
-                except errors.NotFound:
+                remote_entry = _get_remote_entry(ds_ldap, ctx, value)
+                if remote_entry is None:
                     api.log.warning('%s: attribute %s refers to non-existent entry %s' % (pkey, attr, value))
                     continue
                 if value.endswith(search_bases['user']):
@@ -276,12 +300,47 @@ def _pre_migrate_user(ldap, pkey, dn, entry_attrs, failed, config, ctx, **kwargs
     return dn
 
 
+def _get_remote_entry(ds_ldap, ctx, dn):
+    """
+    Return the primary keys of the remote entry dn, or None if it does not
+    exist.
+
+    The entries are looked up in the table in ctx['remote_entries'] first,
+    entries not found there are retrieved and added to the table.
+    """
+    remote_entries = ctx.setdefault('remote_entries', {})
+    try:
+        return remote_entries[dn]
+    except KeyError:
+        pass
+
+    try:
+        remote_entry = ds_ldap.get_entry(
+            dn, [api.Object.user.primary_key.name,
+                 api.Object.group.primary_key.name])
+    except errors.NotFound:
+        remote_entry = None
+    else:
+        remote_entry = _remote_entry_keys(remote_entry)
+    remote_entries[dn] = remote_entry
+    return remote_entry
+
+
+def _remote_entry_keys(entry):
+    """
+    Return the user and group primary keys of a remote entry.
+    """
+    keys = {}
+    for obj_name in ('user', 'group'):
+        name = api.Object[obj_name].primary_key.name
+        if entry.get(name):
+            keys[name] = list(entry[name])
+    return keys
+
+
 def _post_migrate_user(ldap, pkey, dn, entry_attrs, failed, config, ctx):
     assert isinstance(dn, DN)
 
-    if 'def_group_dn' in ctx:
-        _update_default_group(ldap, ctx, False)
-
     if 'description' in entry_attrs and NO_UPG_MAGIC in entry_attrs['description']:
         entry_attrs['description'].remove(NO_UPG_MAGIC)
         try:
@@ -298,7 +357,6 @@ def _update_default_group(ldap, ctx, force):
     # Purposely let this fire when migrate_cnt == 0 so on re-running migration
     # it can catch any users migrated but not added to the default group.
     if force or migrate_cnt % 100 == 0:
-        s = datetime.datetime.now()
         searchfilter = "(&(objectclass=posixAccount)(!(memberof=%s)))" % group_dn
         try:
             (result, truncated) = ldap.find_entries(searchfilter,
@@ -309,19 +367,28 @@ def _update_default_group(ldap, ctx, force):
             return
 
         member_dns = [m.dn for m in result]
-        modlist = [(MOD_ADD, 'member', ldap.encode(member_dns))]
-        try:
-            with ldap.error_handler():
-                ldap.conn.modify_s(str(group_dn), modlist)
-        except errors.DatabaseError as e:
-            api.log.error('Adding new members to default group failed: %s \n'
-                          'members: %s', e, ','.join(member_dns))
-
-        e = datetime.datetime.now()
-        d = e - s
-        mode = " (forced)" if force else ""
-        api.log.info('Adding %d users to group%s duration %s',
-                      len(member_dns), mode, d)
+        _add_default_group_members(ldap, ctx, member_dns, force)
+
+
+def _add_default_group_members(ldap, ctx, member_dns, force=False):
+    group_dn = ctx['def_group_dn']
+    if not member_dns:
+        return
+
+    s = datetime.datetime.now()
+    modlist = [(MOD_ADD, 'member', ldap.encode(member_dns))]
+    try:
+        with ldap.error_handler():
+            ldap.conn.modify_s(str(group_dn), modlist)
+    except errors.DatabaseError as e:
+        api.log.error('Adding new members to default group failed: %s \n'
+                      'members: %s', e, ','.join(str(m) for m in member_dns))
+
+    e = datetime.datetime.now()
+    d = e - s
+    mode = " (forced)" if force else ""
+    api.log.info('Adding %d users to group%s duration %s',
+                  len(member_dns), mode, d)
 
 # GROUP MIGRATION CALLBACKS AND VARS
 
@@ -494,6 +561,9 @@ class migrate_ds(Command):
     }
     migrate_order = ('user', 'group')
 
+    # request context attributes passed to the parallel writers
+    parallel_context_attrs = ('principal', 'languages', 'client_ip')
+
     takes_args = (
         Str('ldapuri', validate_ldapuri,
             cli_name='ldap_uri',
@@ -630,6 +700,25 @@ class migrate_ds(Command):
             default=_default_scope,
             autofill=True,
         ),
+        Int('batch_size?',
+            cli_name='batch_size',
+            label=_('Batch size'),
+            doc=_('Number of entries read from DS and written to IPA at a '
+                  'time (default: 100)'),
+            minvalue=1,
+            default=100,
+            autofill=True,
+        ),
+        Int('parallel?',
+            cli_name='parallel',
+            label=_('Parallel connections'),
+            doc=_('Number of LDAP connections used to write the entries to '
+                  'IPA (default: 1)'),
+            minvalue=1,
+            maxvalue=32,
+            default=1,
+            autofill=True,
+        ),
     )
 
     has_output = (
@@ -715,6 +804,205 @@ can use their Kerberos accounts.''')
             search_bases[ldap_obj_name] = search_base
         return search_bases
 
+    def _iter_source_entries(self, ds_ldap, ldap_obj, search_filter,
+                             search_base, scope, page_size):
+        """
+        Iterate over the entries to be migrated from DS, one page at a time.
+        """
+        try:
+            for entry_attrs in ds_ldap.iter_entries(
+                    search_filter, ['*'], search_base, scope,
+                    time_limit=0, size_limit=-1,
+                    search_refs=True,   # migrated DS may contain search references
+                    paged_search=True, page_size=page_size):
+                yield entry_attrs
+        except errors.NotFound:
+            pass
+        except errors.LimitsExceeded:
+            self.log.error(
+                '%s: %s' % (
+                    ldap_obj.name, self.truncated_err_msg
+                )
+            )
+
+    def _get_group_gids(self, ds_ldap, search_bases, page_size):
+        """
+        Return the number of groups in DS for each GID number, or None if the
+        groups cannot be all retrieved.
+
+        Entries found while at it are added to the remote entry table in
+        remote_entries.
+        """
+        group_gids = {}
+        try:
+            for entry in ds_ldap.iter_entries(
+                    '(&(objectclass=posixgroup)(gidnumber=*))',
+                    ['gidnumber'], search_bases['group'],
+                    time_limit=0, size_limit=-1,
+                    paged_search=True, page_size=page_size):
+                for gid in entry.get('gidnumber', []):
+                    group_gids[gid] = group_gids.get(gid, 0) + 1
+        except errors.NotFound:
+            pass
+        except errors.LimitsExceeded:
+            self.log.warning('Search limit exceeded searching for GID numbers')
+            return None
+        return group_gids
+
+    def _get_remote_groups(self, ds_ldap, search_filter, search_bases, scope,
+                           page_size):
+        """
+        Return the primary keys of the groups in DS, keyed by DN.
+        """
+        remote_entries = {}
+        attrs_list = [api.Object.user.primary_key.name,
+                      api.Object.group.primary_key.name]
+        try:
+            for entry in ds_ldap.iter_entries(
+                    search_filter, attrs_list, search_bases['group'], scope,
+                    time_limit=0, size_limit=-1,
+                    paged_search=True, page_size=page_size):
+                remote_entries[entry.dn] = _remote_entry_keys(entry)
+        except (errors.NotFound, errors.LimitsExceeded):
+            pass
+        return remote_entries
+
+    def _get_existing_pkeys(self, ldap, ldap_obj, page_size):
+        """
+        Return the primary keys of the objects which already exist in IPA.
+        """
+        pkey_name = ldap_obj.primary_key.name
+        existing = set()
+        try:
+            for entry in ldap.iter_entries(
+                    '(%s=*)' % pkey_name, [pkey_name],
+                    DN(ldap_obj.container_dn, api.env.basedn),
+                    ldap.SCOPE_ONELEVEL, time_limit=-1, size_limit=-1,
+                    paged_search=True, page_size=page_size):
+                existing.update(v.lower() for v in entry.get(pkey_name, []))
+        except (errors.NotFound, errors.LimitsExceeded):
+            pass
+        return existing
+
+    def _add_entry(self, ldap, ldap_obj_name, pkey, entry_attrs, failed,
+                   config, ctx, options):
+        """
+        Add a migrated entry to IPA.
+
+        Return None on success, an error message otherwise.
+        """
+        try:
+            ldap.add_entry(entry_attrs)
+        except errors.ExecutionError as e:
+            callback = self.migrate_objects[ldap_obj_name]['exc_callback']
+            if callable(callback):
+                try:
+                    callback(
+                        ldap, entry_attrs.dn, entry_attrs, e, options)
+                except errors.ExecutionError as e:
+                    return unicode(e)
+            else:
+                return unicode(e)
+
+        callback = self.migrate_objects[ldap_obj_name]['post_callback']
+        if callable(callback):
+            callback(
+                ldap, pkey, entry_attrs.dn, entry_attrs, failed, config, ctx)
+        return None
+
+    def _start_writers(self, parallel):
+        """
+        Start parallel - 1 threads which add entries to IPA over their own
+        LDAP connection.
+
+        Return a queue of tasks for the threads and the list of threads.
+        Tasks are added with `_write_batch`, the threads are stopped with
+        `_stop_writers`.
+        """
+        tasks = queue.Queue()
+        threads = []
+        if parallel <= 1:
+            return tasks, threads
+
+        ccache = os.environ.get('KRB5CCNAME')
+        state = dict((name, getattr(request.context, name))
+                     for name in self.parallel_context_attrs
+                     if hasattr(request.context, name))
+
+        def writer():
+            for name, value in state.items():
+                setattr(request.context, name, value)
+            try:
+                self.api.Backend.ldap2.connect(ccache=ccache)
+                while True:
+                    task = tasks.get()
+                    try:
+                        if task is None:
+                            break
+                        self._run_task(task)
+                    finally:
+                        tasks.task_done()
+            except Exception as e:
+                self.error('migrate-ds: parallel writer failed: %s', e)
+            finally:
+                request.destroy_context()
+
+        for i in range(parallel - 1):
+            thread = threading.Thread(target=writer)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        return tasks, threads
+
+    def _stop_writers(self, tasks, threads):
+        for thread in threads:
+            tasks.put(None)
+        for thread in threads:
+            thread.join()
+
+    def _run_task(self, task):
+        args, result = task
+        try:
+            result.append(self._add_entry(self.api.Backend.ldap2, *args))
+        except Exception as e:
+            result.append(e)
+
+    def _write_batch(self, tasks, threads, batch):
+        """
+        Add the entries of a batch to IPA and return a list of error messages,
+        None for the entries added successfully.
+
+        The entries are added by the writer threads and by the current
+        thread, which also takes over the tasks left by failed writers.
+        """
+        results = []
+        for args in batch:
+            result = []
+            results.append(result)
+            if threads:
+                tasks.put((args, result))
+            else:
+                self._run_task((args, result))
+
+        if threads:
+            while True:
+                try:
+                    task = tasks.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    self._run_task(task)
+                finally:
+                    tasks.task_done()
+            tasks.join()
+
+        for result in results:
+            if not result:
+                raise errors.InternalError()
+            if isinstance(result[0], Exception):
+                raise result[0]
+        return [result[0] for result in results]
+
     def migrate(self, ldap, config, ds_ldap, ds_base_dn, options):
         """
         Migrate objects from DS to LDAP.
@@ -726,149 +1014,201 @@ can use their Kerberos accounts.''')
         migration_start = datetime.datetime.now()
 
         scope = _supported_scopes[options.get('scope')]
+        batch_size = options.get('batch_size') or 100
 
-        for ldap_obj_name in self.migrate_order:
-            ldap_obj = self.api.Object[ldap_obj_name]
+        tasks, threads = self._start_writers(options.get('parallel') or 1)
+        try:
+            for ldap_obj_name in self.migrate_order:
+                self._migrate_objects(
+                    ldap, config, ds_ldap, ldap_obj_name, search_bases,
+                    scope, batch_size, tasks, threads, migrated, failed,
+                    migration_start, options)
+        finally:
+            self._stop_writers(tasks, threads)
 
-            template = self.migrate_objects[ldap_obj_name]['filter_template']
-            oc_list = options[to_cli(self.migrate_objects[ldap_obj_name]['oc_option'])]
-            search_filter = construct_filter(template, oc_list)
+        return (migrated, failed)
 
-            exclude = options['exclude_%ss' % to_cli(ldap_obj_name)]
-            context = dict(ds_ldap = ds_ldap)
+    def _migrate_objects(self, ldap, config, ds_ldap, ldap_obj_name,
+                         search_bases, scope, batch_size, tasks, threads,
+                         migrated, failed, migration_start, options):
+        """
+        Migrate objects of a single type, one batch at a time.
+        """
+        ldap_obj = self.api.Object[ldap_obj_name]
 
-            migrated[ldap_obj_name] = []
-            failed[ldap_obj_name] = {}
+        template = self.migrate_objects[ldap_obj_name]['filter_template']
+        oc_list = options[to_cli(self.migrate_objects[ldap_obj_name]['oc_option'])]
+        search_filter = construct_filter(template, oc_list)
 
-            try:
-                entries, truncated = ds_ldap.find_entries(
-                    search_filter, ['*'], search_bases[ldap_obj_name],
-                    scope,
-                    time_limit=0, size_limit=-1,
-                    search_refs=True    # migrated DS may contain search references
-                )
-            except errors.NotFound:
-                if not options.get('continue',False):
-                    raise errors.NotFound(
-                        reason=_('%(container)s LDAP search did not return any result '
-                                 '(search base: %(search_base)s, '
-                                 'objectclass: %(objectclass)s)')
-                                 % {'container': ldap_obj_name,
-                                    'search_base': search_bases[ldap_obj_name],
-                                    'objectclass': ', '.join(oc_list)}
-                    )
-                else:
-                    truncated = False
-                    entries = []
-            if truncated:
-                self.log.error(
-                    '%s: %s' % (
-                        ldap_obj.name, self.truncated_err_msg
-                    )
-                )
+        exclude = options['exclude_%ss' % to_cli(ldap_obj_name)]
+        context = dict(ds_ldap = ds_ldap)
 
-            blacklists = {}
-            for blacklist in ('oc_blacklist', 'attr_blacklist'):
-                blacklist_option = self.migrate_objects[ldap_obj_name][blacklist+'_option']
-                if blacklist_option is not None:
-                    blacklists[blacklist] = options.get(blacklist_option, tuple())
-                else:
-                    blacklists[blacklist] = tuple()
+        migrated[ldap_obj_name] = []
+        failed[ldap_obj_name] = {}
 
-            # get default primary group for new users
-            if 'def_group_dn' not in context and options.get('use_def_group'):
-                def_group = config.get('ipadefaultprimarygroup')
-                context['def_group_dn'] = api.Object.group.get_dn(def_group)
-                try:
-                    ldap.get_entry(context['def_group_dn'], ['gidnumber', 'cn'])
-                except errors.NotFound:
-                    error_msg = _('Default group for new users not found')
-                    raise errors.NotFound(reason=error_msg)
-
-            context['has_upg'] = ldap.has_upg()
-
-            valid_gids = set()
-            invalid_gids = set()
-            migrate_cnt = 0
-            context['migrate_cnt'] = 0
-            for entry_attrs in entries:
-                context['migrate_cnt'] = migrate_cnt
-                s = datetime.datetime.now()
-
-                ava = entry_attrs.dn[0][0]
-                if ava.attr == ldap_obj.primary_key.name:
-                    # In case if pkey attribute is in the migrated object DN
-                    # and the original LDAP is multivalued, make sure that
-                    # we pick the correct value (the unique one stored in DN)
-                    pkey = ava.value.lower()
-                else:
-                    pkey = entry_attrs[ldap_obj.primary_key.name][0].lower()
+        blacklists = {}
+        for blacklist in ('oc_blacklist', 'attr_blacklist'):
+            blacklist_option = self.migrate_objects[ldap_obj_name][blacklist+'_option']
+            if blacklist_option is not None:
+                blacklists[blacklist] = options.get(blacklist_option, tuple())
+            else:
+                blacklists[blacklist] = tuple()
 
-                if pkey in exclude:
+        # get default primary group for new users
+        if 'def_group_dn' not in context and options.get('use_def_group'):
+            def_group = config.get('ipadefaultprimarygroup')
+            context['def_group_dn'] = api.Object.group.get_dn(def_group)
+            try:
+                ldap.get_entry(context['def_group_dn'], ['gidnumber', 'cn'])
+            except errors.NotFound:
+                error_msg = _('Default group for new users not found')
+                raise errors.NotFound(reason=error_msg)
+
+        context['has_upg'] = ldap.has_upg()
+
+        # lookup tables used by the callbacks, retrieved once instead of
+        # searching DS for each migrated entry
+        if ldap_obj_name == 'user':
+            context['group_gids'] = self._get_group_gids(
+                ds_ldap, search_bases, batch_size)
+            group_filter = construct_filter(
+                self.migrate_objects['group']['filter_template'],
+                options[to_cli(self.migrate_objects['group']['oc_option'])])
+            context['remote_entries'] = self._get_remote_groups(
+                ds_ldap, group_filter, search_bases, scope, batch_size)
+
+        # entries which already exist in IPA are skipped right away, unless
+        # the exc_callback may handle them
+        if self.migrate_objects[ldap_obj_name]['exc_callback'] is None:
+            existing = self._get_existing_pkeys(ldap, ldap_obj, batch_size)
+        else:
+            existing = set()
+
+        valid_gids = set()
+        invalid_gids = set()
+        found_cnt = 0
+        migrate_cnt = 0
+        context['migrate_cnt'] = 0
+        batch = []
+        entries = self._iter_source_entries(
+            ds_ldap, ldap_obj, search_filter, search_bases[ldap_obj_name],
+            scope, batch_size)
+        while True:
+            entry_attrs = next(entries, None)
+            if entry_attrs is not None:
+                found_cnt += 1
+                pkey = self._prepare_entry(
+                    ldap, config, ldap_obj, entry_attrs, exclude, existing,
+                    failed[ldap_obj_name], context, search_bases,
+                    valid_gids, invalid_gids, blacklists, options)
+                if pkey is not None:
+                    batch.append((ldap_obj_name, pkey, entry_attrs,
+                                  failed[ldap_obj_name], config, context,
+                                  options))
+                if len(batch) < batch_size:
                     continue
+            elif not batch:
+                break
+
+            s = datetime.datetime.now()
+            errors_list = self._write_batch(tasks, threads, batch)
+            member_dns = []
+            for args, error in zip(batch, errors_list):
+                pkey, entry_attrs = args[1], args[2]
+                if error is not None:
+                    failed[ldap_obj_name][pkey] = error
+                    continue
+                migrated[ldap_obj_name].append(pkey)
+                member_dns.append(entry_attrs.dn)
+            migrate_cnt += len(member_dns)
+            context['migrate_cnt'] = migrate_cnt
+            batch = []
+
+            if ldap_obj_name == 'user' and 'def_group_dn' in context:
+                _add_default_group_members(ldap, context, member_dns)
+
+            e = datetime.datetime.now()
+            api.log.info(
+                "%d %ss migrated, %d failed, %d read. %s elapsed." % (
+                    migrate_cnt, ldap_obj_name, len(failed[ldap_obj_name]),
+                    found_cnt, e - migration_start))
+            api.log.debug("%d %ss migrated, batch duration: %s" % (
+                len(member_dns), ldap_obj_name, e - s))
+
+        if not found_cnt and not options.get('continue', False):
+            raise errors.NotFound(
+                reason=_('%(container)s LDAP search did not return any result '
+                         '(search base: %(search_base)s, '
+                         'objectclass: %(objectclass)s)')
+                         % {'container': ldap_obj_name,
+                            'search_base': search_bases[ldap_obj_name],
+                            'objectclass': ', '.join(oc_list)}
+            )
 
-                entry_attrs.dn = ldap_obj.get_dn(pkey)
-                entry_attrs['objectclass'] = list(
-                    set(
-                        config.get(
-                            ldap_obj.object_class_config, ldap_obj.object_class
-                        ) + [o.lower() for o in entry_attrs['objectclass']]
-                    )
-                )
-                entry_attrs[ldap_obj.primary_key.name][0] = entry_attrs[ldap_obj.primary_key.name][0].lower()
-
-                callback = self.migrate_objects[ldap_obj_name]['pre_callback']
-                if callable(callback):
-                    try:
-                        entry_attrs.dn = callback(
-                            ldap, pkey, entry_attrs.dn, entry_attrs,
-                            failed[ldap_obj_name], config, context,
-                            schema=options['schema'],
-                            search_bases=search_bases,
-                            valid_gids=valid_gids,
-                            invalid_gids=invalid_gids,
-                            **blacklists
-                        )
-                        if not entry_attrs.dn:
-                            continue
-                    except errors.NotFound as e:
-                        failed[ldap_obj_name][pkey] = unicode(e.reason)
-                        continue
+        # catch users migrated but not added to the default group, also by
+        # an earlier, interrupted migration
+        if ldap_obj_name == 'user' and 'def_group_dn' in context:
+            _update_default_group(ldap, context, True)
 
-                try:
-                    ldap.add_entry(entry_attrs)
-                except errors.ExecutionError as e:
-                    callback = self.migrate_objects[ldap_obj_name]['exc_callback']
-                    if callable(callback):
-                        try:
-                            callback(
-                                ldap, entry_attrs.dn, entry_attrs, e, options)
-                        except errors.ExecutionError as e:
-                            failed[ldap_obj_name][pkey] = unicode(e)
-                            continue
-                    else:
-                        failed[ldap_obj_name][pkey] = unicode(e)
-                        continue
+    def _prepare_entry(self, ldap, config, ldap_obj, entry_attrs, exclude,
+                       existing, failed, context, search_bases, valid_gids,
+                       invalid_gids, blacklists, options):
+        """
+        Convert an entry retrieved from DS to an IPA entry.
 
-                migrated[ldap_obj_name].append(pkey)
+        Return the primary key of the entry, or None if the entry is not to
+        be migrated.
+        """
+        ava = entry_attrs.dn[0][0]
+        if ava.attr == ldap_obj.primary_key.name:
+            # In case if pkey attribute is in the migrated object DN
+            # and the original LDAP is multivalued, make sure that
+            # we pick the correct value (the unique one stored in DN)
+            pkey = ava.value.lower()
+        else:
+            pkey = entry_attrs[ldap_obj.primary_key.name][0].lower()
+
+        if ldap_obj.name == 'user':
+            # the entry may be referred to by the users to come
+            context.setdefault('remote_entries', {})[entry_attrs.dn] = (
+                _remote_entry_keys(entry_attrs))
+
+        if pkey in exclude:
+            return None
+
+        if pkey in existing:
+            failed[pkey] = unicode(errors.DuplicateEntry())
+            return None
+
+        entry_attrs.dn = ldap_obj.get_dn(pkey)
+        entry_attrs['objectclass'] = list(
+            set(
+                config.get(
+                    ldap_obj.object_class_config, ldap_obj.object_class
+                ) + [o.lower() for o in entry_attrs['objectclass']]
+            )
+        )
+        entry_attrs[ldap_obj.primary_key.name][0] = entry_attrs[ldap_obj.primary_key.name][0].lower()
 
-                callback = self.migrate_objects[ldap_obj_name]['post_callback']
-                if callable(callback):
-                    callback(
-                        ldap, pkey, entry_attrs.dn, entry_attrs,
-                        failed[ldap_obj_name], config, context)
-                e = datetime.datetime.now()
-                d = e - s
-                total_dur = e - migration_start
-                migrate_cnt += 1
-                if migrate_cnt > 0 and migrate_cnt % 100 == 0:
-                    api.log.info("%d %ss migrated. %s elapsed." % (migrate_cnt, ldap_obj_name, total_dur))
-                api.log.debug("%d %ss migrated, duration: %s (total %s)" % (migrate_cnt, ldap_obj_name, d, total_dur))
-
-        if 'def_group_dn' in context:
-            _update_default_group(ldap, context, True)
+        callback = self.migrate_objects[ldap_obj.name]['pre_callback']
+        if callable(callback):
+            try:
+                entry_attrs.dn = callback(
+                    ldap, pkey, entry_attrs.dn, entry_attrs,
+                    failed, config, context,
+                    schema=options['schema'],
+                    search_bases=search_bases,
+                    valid_gids=valid_gids,
+                    invalid_gids=invalid_gids,
+                    **blacklists
+                )
+                if not entry_attrs.dn:
+                    return None
+            except errors.NotFound as e:
+                failed[pkey] = unicode(e.reason)
+                return None
 
-        return (migrated, failed)
+        return pkey
 
     def execute(self, ldapuri, bindpw, **options):
         ldap = self.api.Backend.ldap2
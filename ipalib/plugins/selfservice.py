@@ -186,6 +186,7 @@ class selfservice_mod(crud.Update):
 @register()
 class selfservice_find(crud.Search):
     __doc__ = _('Search for a self-service permission.')
+    read_only = True
 
     msg_summary = ngettext(
         '%(count)d selfservice matched', '%(count)d selfservices matched', 0
@@ -213,6 +214,7 @@ class selfservice_find(crud.Search):
 @register()
 class selfservice_show(crud.Retrieve):
     __doc__ = _('Display information about a self-service permission.')
+    read_only = True
 
     has_output_params = output_params
 
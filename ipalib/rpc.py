@@ -38,6 +38,8 @@ import base64
 import json
 import socket
 import gzip
+import threading
+import time
 
 import gssapi
 from dns import resolver, rdatatype
@@ -60,7 +62,7 @@ from ipapython.cookie import Cookie
 from ipapython.dnsutil import DNSName
 from ipalib.text import _
 import ipapython.nsslib
-from ipapython.nsslib import NSSConnection
+from ipapython.nsslib import NSSConnection, ConnectionPool
 from ipalib.krb_utils import KRB5KDC_ERR_S_PRINCIPAL_UNKNOWN, KRB5KRB_AP_ERR_TKT_EXPIRED, \
                              KRB5_FCC_PERM, KRB5_FCC_NOFILE, KRB5_CC_FORMAT, \
                              KRB5_REALM_CANT_RESOLVE, KRB5_CC_NOTFOUND, get_principal
@@ -316,6 +318,101 @@ def json_encode_binary(val, version):
         return val
 
 
+def json_dumps_binary(val, version):
+    '''
+    Serialize val to compact JSON.
+
+    Binary and other special values are encoded the same way as by
+    json_encode_binary(), but in a single pass over val, without building
+    a copy of it first. The result is the same as of::
+
+        json.dumps(json_encode_binary(val, version), separators=(',', ':'))
+
+    except that the keys of dicts are not sorted.
+    '''
+    escape = json.encoder.encode_basestring_ascii
+    datetime_values = capabilities.client_has_capability(
+        version, 'datetime_values')
+    dns_name_values = capabilities.client_has_capability(
+        version, 'dns_name_values')
+    chunks = []
+    append = chunks.append
+
+    def encode_key(key):
+        if isinstance(key, six.string_types):
+            return escape(key)
+        elif key is True:
+            return '"true"'
+        elif key is False:
+            return '"false"'
+        elif key is None:
+            return '"null"'
+        elif isinstance(key, six.integer_types + (float,)):
+            return '"%s"' % json.dumps(key)
+        raise TypeError('key %r is not a string' % (key,))
+
+    def encode(val):
+        if isinstance(val, unicode):
+            append(escape(val))
+        elif isinstance(val, dict):
+            append('{')
+            first = True
+            for k, v in val.items():
+                if first:
+                    first = False
+                else:
+                    append(',')
+                append(encode_key(k))
+                append(':')
+                encode(v)
+            append('}')
+        elif isinstance(val, (list, tuple)):
+            append('[')
+            first = True
+            for v in val:
+                if first:
+                    first = False
+                else:
+                    append(',')
+                encode(v)
+            append(']')
+        elif val is None:
+            append('null')
+        elif val is True:
+            append('true')
+        elif val is False:
+            append('false')
+        elif isinstance(val, six.integer_types):
+            append(str(int(val)))
+        elif isinstance(val, bytes):
+            append('{"__base64__":%s}' % escape(
+                base64.b64encode(val).decode('ascii')))
+        elif isinstance(val, float):
+            append(json.dumps(val))
+        elif isinstance(val, Decimal):
+            append('{"__base64__":%s}' % escape(
+                base64.b64encode(str(val).encode('ascii')).decode('ascii')))
+        elif isinstance(val, DN):
+            append(escape(str(val)))
+        elif isinstance(val, datetime.datetime):
+            value = escape(val.strftime(LDAP_GENERALIZED_TIME_FORMAT))
+            if datetime_values:
+                append('{"__datetime__":%s}' % value)
+            else:
+                append(value)
+        elif isinstance(val, DNSName):
+            value = escape(unicode(val))
+            if dns_name_values:
+                append('{"__dns_name__":%s}' % value)
+            else:
+                append(value)
+        else:
+            raise TypeError('%r is not JSON serializable' % (val,))
+
+    encode(val)
+    return ''.join(chunks)
+
+
 def json_decode_binary(val):
     '''
     JSON cannot transport binary data. In order to transport binary data we
@@ -459,9 +556,16 @@ class LanguageAwareTransport(MultiProtocolTransport):
 
         return (host, extra_headers, x509)
 
+connection_pool = ConnectionPool()
+
+
 class SSLTransport(LanguageAwareTransport):
     """Handles an HTTPS transaction to an XML-RPC server."""
 
+    # set to True by make_connection() if the connection was taken from
+    # the pool
+    _reused = False
+
     def get_connection_dbdir(self):
         """
         If there is a connections open it may have already initialized
@@ -480,11 +584,29 @@ class SSLTransport(LanguageAwareTransport):
 
     def make_connection(self, host):
         host, self._extra_headers, x509 = self.get_host_info(host)
+        return self.connect(host)
 
+    def connect(self, host):
+        """
+        Return the connection to ``host``, taken from the pool or opened.
+
+        The requests sent by the transport use the returned connection.
+        """
         if self._connection and host == self._connection[0]:
             return self._connection[1]
 
         dbdir = getattr(context, 'nss_dir', paths.IPA_NSSDB_DIR)
+        self.dbdir=dbdir
+
+        conn = connection_pool.get((host, dbdir))
+        self._reused = conn is not None
+        if conn is None:
+            conn = self._create_connection(host, dbdir)
+
+        self._connection = host, conn
+        return self._connection[1]
+
+    def _create_connection(self, host, dbdir):
         connection_dbdir = self.get_connection_dbdir()
 
         if connection_dbdir:
@@ -500,12 +622,19 @@ class SSLTransport(LanguageAwareTransport):
         conn = NSSConnection(host, 443, dbdir=dbdir, no_init=no_init,
                              tls_version_min=api.env.tls_version_min,
                              tls_version_max=api.env.tls_version_max)
-        self.dbdir=dbdir
 
         conn.connect()
 
-        self._connection = host, conn
-        return self._connection[1]
+        return conn
+
+    def release_connection(self):
+        """
+        Keep the current connection open for reuse by the next request.
+        """
+        host, conn = self._connection
+        if conn is not None:
+            self._connection = (None, None)
+            connection_pool.put((host, self.dbdir), conn)
 
 
 class KerbTransport(SSLTransport):
@@ -601,8 +730,15 @@ class KerbTransport(SSLTransport):
             return False
         return True
 
+    def request(self, host, handler, request_body, verbose=0):
+        # Transport.request() sends the request again when the response
+        # could not be read, single_request() retries by itself when it
+        # fails to send the request over a pooled connection
+        return self.single_request(host, handler, request_body, verbose)
+
     def single_request(self, host, handler, request_body, verbose=0):
         # Based on Python 2.7's xmllib.Transport.single_request
+        keep_alive = False
         try:
             h = SSLTransport.make_connection(self, host)
 
@@ -610,14 +746,28 @@ class KerbTransport(SSLTransport):
                 h.set_debuglevel(1)
 
             while True:
+                try:
+                    if six.PY2:
+                        self.send_request(h, handler, request_body)
+                        self.send_host(h, host)
+                        self.send_user_agent(h)
+                        self.send_content(h, request_body)
+                    else:
+                        self.__send_request(h, host, handler, request_body, verbose)
+                except (socket.error, NSPRError):
+                    if not self._reused:
+                        raise
+                    # The server closed the idle connection, so it did not
+                    # receive the request, retry on a new connection. Once
+                    # the request is sent it is never retried, the server
+                    # might have executed it already.
+                    self.close()
+                    h = SSLTransport.make_connection(self, host)
+                    continue
+
                 if six.PY2:
-                    self.send_request(h, handler, request_body)
-                    self.send_host(h, host)
-                    self.send_user_agent(h)
-                    self.send_content(h, request_body)
                     response = h.getresponse(buffering=True)
                 else:
-                    self.__send_request(h, host, handler, request_body, verbose)
                     response = h.getresponse()
 
                 if response.status != 200:
@@ -636,11 +786,16 @@ class KerbTransport(SSLTransport):
                 self.verbose = verbose
                 if not self._auth_complete(response):
                     continue
-                return self.parse_response(response)
+                result = self.parse_response(response)
+                keep_alive = not response.will_close
+                return result
         except gssapi.exceptions.GSSError as e:
             self._handle_exception(e)
         finally:
-            self.close()
+            if keep_alive:
+                self.release_connection()
+            else:
+                self.close()
 
     if six.PY3:
         def __send_request(self, connection, host, handler, request_body, debug):
@@ -721,6 +876,172 @@ class DelegatedKerbTransport(KerbTransport):
              gssapi.RequirementFlag.out_of_sequence_detection]
 
 
+class ServerCache(object):
+    """
+    Cache of discovered IPA servers and of their health.
+
+    For every domain the cache records the servers found in its
+    ``_ldap._tcp`` SRV records and the time the records expire according to
+    their TTL. For every server (the network location of its URLs) it
+    records a smoothed round trip time of the probes sent to it and the
+    time of its last failure.
+
+    The cache is stored as JSON in ``filename``.
+    """
+
+    version = 1
+
+    # How long to remember a failed SRV lookup (in seconds)
+    negative_ttl = 60
+
+    # How long a failed server is ranked after the other ones (in seconds)
+    failure_timeout = 300
+
+    # How long a server which answered a probe is considered healthy without
+    # being probed again (in seconds)
+    health_timeout = 600
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.domains = {}
+        self.servers = {}
+        self.modified = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Load the cache from ``filename``, return True on success.
+        """
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return False
+        if not isinstance(data, dict) or data.get('version') != self.version:
+            return False
+        self.domains = data['domains']
+        self.servers = data['servers']
+        self.modified = False
+        return True
+
+    def save(self):
+        """
+        Atomically store the cache to ``filename`` if it was modified,
+        return True on success.
+        """
+        with self._lock:
+            if not self.modified:
+                return True
+            data = json.dumps(dict(version=self.version, domains=self.domains,
+                                   servers=self.servers))
+            self.modified = False
+        dirname = os.path.dirname(self.filename)
+        tmpname = '%s.%d' % (self.filename, os.getpid())
+        try:
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            with open(tmpname, 'w') as f:
+                f.write(data)
+            os.rename(tmpname, self.filename)
+        except (IOError, OSError):
+            return False
+        return True
+
+    def get_servers(self, domain):
+        """
+        Return the servers of ``domain`` or None if they are not cached or
+        their records have expired.
+        """
+        entry = self.domains.get(domain)
+        if entry is None or entry['expires'] <= time.time():
+            return None
+        return entry['servers']
+
+    def set_servers(self, domain, servers, ttl):
+        with self._lock:
+            self.domains[domain] = dict(expires=time.time() + ttl,
+                                        servers=list(servers))
+            self.modified = True
+
+    def record_success(self, url, rtt):
+        """
+        Record a successful request to ``url`` which took ``rtt`` seconds.
+        """
+        netloc = urllib.parse.urlparse(url).netloc
+        with self._lock:
+            server = self.servers.get(netloc, {})
+            if server.get('rtt') is not None:
+                rtt = 0.7 * server['rtt'] + 0.3 * rtt
+            self.servers[netloc] = dict(rtt=rtt, checked=time.time(),
+                                        failed=None)
+            self.modified = True
+
+    def record_failure(self, url):
+        """
+        Record a failed request to ``url``.
+        """
+        netloc = urllib.parse.urlparse(url).netloc
+        with self._lock:
+            server = self.servers.setdefault(
+                netloc, dict(rtt=None, checked=None))
+            server['failed'] = time.time()
+            self.modified = True
+
+    def has_failed(self, url):
+        """
+        Return True if ``url`` failed in the last ``failure_timeout``
+        seconds.
+        """
+        server = self.servers.get(urllib.parse.urlparse(url).netloc)
+        return (server is not None and server['failed'] is not None and
+                server['failed'] > time.time() - self.failure_timeout)
+
+    def is_healthy(self, url):
+        """
+        Return True if ``url`` answered a recent probe and has not failed
+        since.
+        """
+        server = self.servers.get(urllib.parse.urlparse(url).netloc)
+        return (server is not None and server['failed'] is None and
+                server['checked'] > time.time() - self.health_timeout)
+
+    def rank(self, urls):
+        """
+        Sort ``urls`` by their health.
+
+        Healthy servers come first, the fastest one first, followed by the
+        servers never contacted, in the original order, and by servers
+        which failed recently, the one which failed first first.
+        """
+        def key(url):
+            server = self.servers.get(urllib.parse.urlparse(url).netloc)
+            if server is None:
+                return (1, 0)
+            if server['failed'] is not None:
+                if self.has_failed(url):
+                    return (2, server['failed'])
+                return (1, 0)
+            return (0, server['rtt'])
+
+        return sorted(urls, key=key)
+
+
+_server_caches = {}
+_server_caches_lock = threading.Lock()
+
+
+def get_server_cache(filename):
+    """
+    Return the `ServerCache` stored in ``filename``, loaded once per process.
+    """
+    with _server_caches_lock:
+        cache = _server_caches.get(filename)
+        if cache is None:
+            cache = _server_caches[filename] = ServerCache(filename)
+            cache.load()
+        return cache
+
+
 class RPCClient(Connectible):
     """
     Forwarding backend plugin for XML-RPC client.
@@ -734,6 +1055,50 @@ class RPCClient(Connectible):
     protocol = None
     env_rpc_uri_key = None
 
+    def get_server_cache(self):
+        """
+        Return the cache of discovered servers or None if it is disabled.
+        """
+        if not self.env.server_cache:
+            return None
+        return get_server_cache(self.env.server_cache)
+
+    def record_server_failure(self, url):
+        """
+        Rank ``url`` after the other servers in the next connections.
+        """
+        cache = self.get_server_cache()
+        if cache is not None and url:
+            cache.record_failure(url)
+            cache.save()
+
+    def discover_servers(self):
+        """
+        Return the names of the IPA servers found in DNS.
+
+        The result is kept in the server cache until the SRV records expire.
+        """
+        cache = self.get_server_cache()
+        if cache is not None:
+            servers = cache.get_servers(self.env.domain)
+            if servers is not None:
+                return servers
+
+        name = '_ldap._tcp.%s.' % self.env.domain
+
+        try:
+            answers = resolver.query(name, rdatatype.SRV)
+        except DNSException as e:
+            servers = []
+            ttl = ServerCache.negative_ttl
+        else:
+            servers = [str(answer.target).rstrip(".") for answer in answers]
+            ttl = answers.rrset.ttl
+
+        if cache is not None:
+            cache.set_servers(self.env.domain, servers, ttl)
+        return servers
+
     def get_url_list(self, rpc_uri):
         """
         Create a list of urls consisting of the available IPA servers.
@@ -742,15 +1107,8 @@ class RPCClient(Connectible):
         (scheme, netloc, path, params, query, fragment
             ) = urllib.parse.urlparse(rpc_uri)
         servers = []
-        name = '_ldap._tcp.%s.' % self.env.domain
-
-        try:
-            answers = resolver.query(name, rdatatype.SRV)
-        except DNSException as e:
-            answers = []
 
-        for answer in answers:
-            server = str(answer.target).rstrip(".")
+        for server in self.discover_servers():
             servers.append('https://%s%s' % (ipautil.format_netloc(server), path))
 
         servers = list(set(servers))
@@ -765,6 +1123,14 @@ class RPCClient(Connectible):
         else:
             servers.insert(0, cfg_server)
 
+        cache = self.get_server_cache()
+        if cache is not None:
+            if cache.has_failed(cfg_server):
+                servers = cache.rank(servers)
+            else:
+                # the configured server stays the first one to try
+                servers = [cfg_server] + cache.rank(servers[1:])
+
         return servers
 
     def get_session_cookie_from_persistent_storage(self, principal):
@@ -873,70 +1239,99 @@ class RPCClient(Connectible):
         if nss_dir:
             context.nss_dir = nss_dir
         urls = self.get_url_list(rpc_uri)
-        serverproxy = None
-        for url in urls:
-            kw = dict(allow_none=True, encoding='UTF-8')
-            kw['verbose'] = verbose
-            if url.startswith('https://'):
-                if delegate:
-                    transport_class = DelegatedKerbTransport
+        cache = self.get_server_cache()
+        try:
+            serverproxy = None
+            for url in urls:
+                kw = dict(allow_none=True, encoding='UTF-8')
+                kw['verbose'] = verbose
+                if url.startswith('https://'):
+                    if delegate:
+                        transport_class = DelegatedKerbTransport
+                    else:
+                        transport_class = KerbTransport
                 else:
-                    transport_class = KerbTransport
-            else:
-                transport_class = LanguageAwareTransport
-            kw['transport'] = transport_class(protocol=self.protocol)
-            self.log.info('trying %s' % url)
-            setattr(context, 'request_url', url)
-            serverproxy = self.server_proxy_class(url, **kw)
-            if len(urls) == 1:
-                # if we have only 1 server and then let the
-                # main requester handle any errors. This also means it
-                # must handle a 401 but we save a ping.
-                return serverproxy
-            try:
-                command = getattr(serverproxy, 'ping')
+                    transport_class = LanguageAwareTransport
+                kw['transport'] = transport_class(protocol=self.protocol)
+                self.log.info('trying %s' % url)
+                setattr(context, 'request_url', url)
+                serverproxy = self.server_proxy_class(url, **kw)
+                if len(urls) == 1:
+                    # if we have only 1 server and then let the
+                    # main requester handle any errors. This also means it
+                    # must handle a 401 but we save a ping.
+                    return serverproxy
+                if (cache is not None and cache.is_healthy(url) and
+                        isinstance(kw['transport'], SSLTransport)):
+                    # the server answered before and has not failed since,
+                    # save the ping and let the main requester handle any
+                    # errors once the server accepted the connection
+                    try:
+                        kw['transport'].connect(
+                            urllib.parse.urlparse(url).netloc)
+                    except (socket.error, NSPRError) as e:
+                        cache.record_failure(url)
+                        if not fallback:
+                            raise
+                        self.log.info('Connection to %s failed with %s',
+                                      url, e)
+                        serverproxy = None
+                        continue
+                    return serverproxy
                 try:
-                    response = command([], {})
-                except Fault as e:
-                    e = decode_fault(e)
-                    if e.faultCode in errors_by_code:
-                        error = errors_by_code[e.faultCode]
-                        raise error(message=e.faultString)
-                    else:
-                        raise UnknownError(
-                            code=e.faultCode,
-                            error=e.faultString,
-                            server=url,
-                        )
-                # We don't care about the response, just that we got one
-                break
-            except KerberosError as krberr:
-                # kerberos error on one server is likely on all
-                raise errors.KerberosError(message=unicode(krberr))
-            except ProtocolError as e:
-                if hasattr(context, 'session_cookie') and e.errcode == 401:
-                    # Unauthorized. Remove the session and try again.
-                    delattr(context, 'session_cookie')
+                    command = getattr(serverproxy, 'ping')
+                    start = time.time()
                     try:
-                        delete_persistent_client_session_data(principal)
-                    except Exception as e:
-                        # This shouldn't happen if we have a session but it isn't fatal.
-                        pass
-                    return self.create_connection(ccache, verbose, fallback, delegate)
-                if not fallback:
-                    raise
-                serverproxy = None
-            except Exception as e:
-                if not fallback:
-                    raise
-                else:
-                    self.log.info('Connection to %s failed with %s', url, e)
-                serverproxy = None
+                        response = command([], {})
+                    except Fault as e:
+                        e = decode_fault(e)
+                        if e.faultCode in errors_by_code:
+                            error = errors_by_code[e.faultCode]
+                            raise error(message=e.faultString)
+                        else:
+                            raise UnknownError(
+                                code=e.faultCode,
+                                error=e.faultString,
+                                server=url,
+                            )
+                    # We don't care about the response, just that we got one
+                    if cache is not None:
+                        cache.record_success(url, time.time() - start)
+                    break
+                except KerberosError as krberr:
+                    # kerberos error on one server is likely on all
+                    raise errors.KerberosError(message=unicode(krberr))
+                except ProtocolError as e:
+                    if hasattr(context, 'session_cookie') and e.errcode == 401:
+                        # Unauthorized. Remove the session and try again.
+                        delattr(context, 'session_cookie')
+                        try:
+                            delete_persistent_client_session_data(principal)
+                        except Exception as e:
+                            # This shouldn't happen if we have a session but it isn't fatal.
+                            pass
+                        return self.create_connection(ccache, verbose, fallback, delegate)
+                    if cache is not None:
+                        cache.record_failure(url)
+                    if not fallback:
+                        raise
+                    serverproxy = None
+                except Exception as e:
+                    if cache is not None:
+                        cache.record_failure(url)
+                    if not fallback:
+                        raise
+                    else:
+                        self.log.info('Connection to %s failed with %s', url, e)
+                    serverproxy = None
 
-        if serverproxy is None:
-            raise NetworkError(uri=_('any of the configured servers'),
-                error=', '.join(urls))
-        return serverproxy
+            if serverproxy is None:
+                raise NetworkError(uri=_('any of the configured servers'),
+                    error=', '.join(urls))
+            return serverproxy
+        finally:
+            if cache is not None:
+                cache.save()
 
     def destroy_connection(self):
         conn = getattr(context, self.id, None)
@@ -985,6 +1380,7 @@ class RPCClient(Connectible):
                 server=server,
             )
         except NSPRError as e:
+            self.record_server_failure(server)
             raise NetworkError(uri=server, error=str(e))
         except ProtocolError as e:
             # By catching a 401 here we can detect the case where we have
@@ -1020,6 +1416,7 @@ class RPCClient(Connectible):
                 return self.forward(name, *args, **kw)
             raise NetworkError(uri=server, error=e.errmsg)
         except socket.error as e:
+            self.record_server_failure(server)
             raise NetworkError(uri=server, error=str(e))
         except (OverflowError, TypeError) as e:
             raise XMLRPCMarshallError(error=str(e))
@@ -21,6 +21,10 @@ import random
 import os
 import re
 import time
+import ctypes
+import errno
+import collections
+import threading
 
 from six.moves.urllib.parse import urlparse
 
@@ -709,6 +713,44 @@ class SessionAuthManager(object):
 
 #-------------------------------------------------------------------------------
 
+class SessionData(dict):
+    '''
+    Session data dict which remembers the values last written to the
+    session store, so the session manager can tell which items were
+    modified since.
+    '''
+
+    # Items which change on every access of the session
+    timestamp_keys = frozenset(['session_access_timestamp',
+                                'session_expiration_timestamp'])
+
+    def __init__(self, *args, **kwargs):
+        super(SessionData, self).__init__(*args, **kwargs)
+        self.stored = None
+
+    def mark_stored(self):
+        '''
+        Record the current values as the values in the session store.
+        '''
+        self.stored = dict(self)
+
+    def is_modified(self):
+        '''
+        Return True if the session data was never stored or any item
+        besides the timestamps was modified since it was stored.
+        '''
+        if self.stored is None:
+            return True
+        keys = set(self) | set(self.stored)
+        for key in keys - self.timestamp_keys:
+            if key not in self or key not in self.stored:
+                return True
+            if self[key] != self.stored[key]:
+                return True
+        return False
+
+#-------------------------------------------------------------------------------
+
 class SessionManager(object):
 
     '''
@@ -797,6 +839,9 @@ class MemcacheSessionManager(SessionManager):
     session_cookie_name = 'ipa_session'
     mc_server_stat_name_re = re.compile(r'(.+)\s+\((\d+)\)')
 
+    # Number of sessions whose expiration updated with touch is remembered
+    max_touched = 1024
+
     def __init__(self):
         '''
         :returns:
@@ -807,6 +852,15 @@ class MemcacheSessionManager(SessionManager):
         self.servers = ['unix:%s' % self.memcached_socket_path]
         self.mc = memcache.Client(self.servers, debug=0)
 
+        # An expiration extended by less than this number of seconds is
+        # not written to the memcache, see `store_session_data()`
+        self.expiration_granularity = 0
+
+        # session key -> expiration last set with touch, shared by the
+        # threads of the process
+        self.touched = collections.OrderedDict()
+        self._touched_lock = threading.Lock()
+
         if not self.servers_running():
             self.warning("session memcached servers not running")
 
@@ -901,11 +955,11 @@ class MemcacheSessionManager(SessionManager):
         '''
 
         now = time.time()
-        return {'session_id'                   : session_id,
-                'session_start_timestamp'      : now,
-                'session_access_timestamp'     : now,
-                'session_expiration_timestamp' : 0,
-               }
+        return SessionData({'session_id'                   : session_id,
+                            'session_start_timestamp'      : now,
+                            'session_access_timestamp'     : now,
+                            'session_expiration_timestamp' : 0,
+                           })
 
     def session_key(self, session_id):
         '''
@@ -935,6 +989,9 @@ class MemcacheSessionManager(SessionManager):
         session_data = self.mc.get(session_key)
 
         if session_data is not None:
+            session_data = SessionData(session_data)
+            session_data.mark_stored()
+
             # update the access timestamp
             now = time.time()
             session_data['session_access_timestamp'] = now
@@ -1034,6 +1091,14 @@ class MemcacheSessionManager(SessionManager):
         memcached will cause a previously set expiration time for the
         item to be discarded and the item will no longer expire.
 
+        The session data is only written if an item other than the
+        timestamps was modified since it was loaded. Otherwise only the
+        expiration of the memcache item is updated, using touch, and
+        only if it moves the expiration earlier or extends it by at
+        least `expiration_granularity` seconds. The access and
+        expiration timestamps recorded in the memcache may therefore
+        lag behind.
+
         :parameters:
           session_data
             Session data dict, must contain session_id key.
@@ -1050,13 +1115,42 @@ class MemcacheSessionManager(SessionManager):
 
         session_expiration_timestamp = session_data['session_expiration_timestamp']
 
+        if (isinstance(session_data, SessionData) and
+                not session_data.is_modified()):
+            with self._touched_lock:
+                expiration = self.touched.get(
+                    session_key,
+                    session_data.stored['session_expiration_timestamp'])
+            if (0 < expiration <= session_expiration_timestamp <
+                    expiration + self.expiration_granularity or
+                    expiration == session_expiration_timestamp):
+                self.debug('store session: session_id=%s not modified',
+                           session_id)
+                return session_id
+
+            touch = getattr(self.mc, 'touch', None)
+            if touch is not None and touch(
+                    session_key, time=session_expiration_timestamp):
+                self.debug('store session: session_id=%s expiration_timestamp=%s',
+                           session_id, fmt_time(session_expiration_timestamp))
+                with self._touched_lock:
+                    self.touched.pop(session_key, None)
+                    self.touched[session_key] = session_expiration_timestamp
+                    while len(self.touched) > self.max_touched:
+                        self.touched.popitem(last=False)
+                return session_id
+
         self.debug('store session: session_id=%s start_timestamp=%s access_timestamp=%s expiration_timestamp=%s',
                    session_id,
                    fmt_time(session_data['session_start_timestamp']),
                    fmt_time(session_data['session_access_timestamp']),
                    fmt_time(session_data['session_expiration_timestamp']))
 
-        self.mc.set(session_key, session_data, time=session_expiration_timestamp)
+        self.mc.set(session_key, dict(session_data), time=session_expiration_timestamp)
+        if isinstance(session_data, SessionData):
+            session_data.mark_stored()
+        with self._touched_lock:
+            self.touched.pop(session_key, None)
         return session_id
 
     def generate_cookie(self, url_path, session_id, expiration=None, add_header=False):
@@ -1203,12 +1297,46 @@ class MemcacheSessionManager(SessionManager):
 
         self.debug('delete session data from memcache, session_id=%s', session_id)
         self.mc.delete(session_key)
+        with self._touched_lock:
+            self.touched.pop(session_key, None)
 
 
 #-------------------------------------------------------------------------------
 krbccache_dir =paths.IPA_MEMCACHED_DIR
 krbccache_prefix = 'krbcc_'
 
+# Memory files are passed to libkrb5 as FILE ccaches by their /proc path
+memfd_prefix = '/proc/self/fd/'
+
+MFD_CLOEXEC = 1
+
+def _memfd_create(name):
+    '''
+    Create an anonymous memory file, see memfd_create(2). Returns its file
+    descriptor or None if memory files are not supported.
+    '''
+    memfd_create = getattr(os, 'memfd_create', None)
+    if memfd_create is not None:
+        try:
+            return memfd_create(name, MFD_CLOEXEC)
+        except OSError as e:
+            if e.errno == errno.ENOSYS:
+                return None
+            raise
+
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        memfd_create = libc.memfd_create
+    except (OSError, AttributeError):
+        return None
+    fd = memfd_create(name.encode('ascii'), MFD_CLOEXEC)
+    if fd < 0:
+        e = ctypes.get_errno()
+        if e == errno.ENOSYS:
+            return None
+        raise OSError(e, os.strerror(e))
+    return fd
+
 def _get_krbccache_pathname():
     return os.path.join(krbccache_dir, '%s%s' % (krbccache_prefix, os.getpid()))
 
@@ -1224,24 +1352,56 @@ def get_ipa_ccache_name(scheme='FILE'):
 
 def load_ccache_data(ccache_name):
     scheme, name = krb5_parse_ccache(ccache_name)
-    if scheme == 'FILE':
+    if scheme == 'FILE' and name.startswith(memfd_prefix):
+        root_logger.debug('reading ccache data from memory file "%s"', name)
+        fd = int(name[len(memfd_prefix):])
+        os.lseek(fd, 0, os.SEEK_SET)
+        chunks = []
+        while True:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b''.join(chunks)
+    elif scheme == 'FILE':
         root_logger.debug('reading ccache data from file "%s"', name)
-        src = open(name)
+        src = open(name, 'rb')
         ccache_data = src.read()
         src.close()
         return ccache_data
     else:
         raise ValueError('ccache scheme "%s" unsupported (%s)', scheme, ccache_name)
 
-def bind_ipa_ccache(ccache_data, scheme='FILE'):
-    if scheme == 'FILE':
+def bind_ipa_ccache(ccache_data, scheme='FILE', memfd=True):
+    '''
+    Make the ccache data the current request's ccache by storing it and
+    pointing the KRB5CCNAME environment variable at it.
+
+    With memfd set the data is stored in an anonymous memory file instead
+    of a file in krbccache_dir, so that binding, loading and releasing the
+    ccache does not touch the file system. It is still a FILE: ccache,
+    libkrb5 opens the memory file through its /proc/self/fd path. A file in
+    krbccache_dir is used when memory files are not supported.
+    '''
+    if scheme != 'FILE':
+        raise ValueError('ccache scheme "%s" unsupported', scheme)
+
+    name = None
+    if memfd:
+        fd = _memfd_create('ipa_ccache')
+        if fd is not None:
+            name = '%s%d' % (memfd_prefix, fd)
+            root_logger.debug('storing ccache data into memory file "%s"', name)
+            data = ccache_data
+            while data:
+                data = data[os.write(fd, data):]
+
+    if name is None:
         name = _get_krbccache_pathname()
         root_logger.debug('storing ccache data into file "%s"', name)
-        dst = open(name, 'w')
+        dst = open(name, 'wb')
         dst.write(ccache_data)
         dst.close()
-    else:
-        raise ValueError('ccache scheme "%s" unsupported', scheme)
 
     ccache_name = krb5_unparse_ccache(scheme, name)
     os.environ['KRB5CCNAME'] = ccache_name
@@ -1251,7 +1411,8 @@ def release_ipa_ccache(ccache_name):
     '''
     Stop using the current request's ccache.
       * Remove KRB5CCNAME from the enviroment
-      * Remove the ccache file from the file system
+      * Remove the ccache file from the file system or close the
+        memory file
 
     Note, we do not demand any of these elements exist, but if they
     do we'll remove them.
@@ -1266,7 +1427,12 @@ def release_ipa_ccache(ccache_name):
         root_logger.debug('release_ipa_ccache: KRB5CCNAME environment variable not set')
 
     scheme, name = krb5_parse_ccache(ccache_name)
-    if scheme == 'FILE':
+    if scheme == 'FILE' and name.startswith(memfd_prefix):
+        try:
+            os.close(int(name[len(memfd_prefix):]))
+        except OSError as e:
+            root_logger.error('unable to close session ccache memory file "%s", %s', name, e)
+    elif scheme == 'FILE':
         if os.path.exists(name):
             try:
                 os.unlink(name)
@@ -238,6 +238,7 @@ class BasePathNamespace(object):
     IPA_JS_PLUGINS_DIR = "/usr/share/ipa/ui/js/plugins"
     UPDATES_DIR = "/usr/share/ipa/updates/"
     CACHE_IPA_SESSIONS = "/var/cache/ipa/sessions"
+    IPA_SCHEMA_CACHE_DIR = "/var/cache/ipa/schema"
     VAR_KERBEROS_KRB5KDC_DIR = "/var/kerberos/krb5kdc/"
     VAR_KRB5KDC_K5_REALM = "/var/kerberos/krb5kdc/.k5."
     CACERT_PEM = "/var/kerberos/krb5kdc/cacert.pem"
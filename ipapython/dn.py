@@ -1100,6 +1100,10 @@ class DN(object):
     AVA_type = AVA
     RDN_type = RDN
 
+    # Normalized form used for hashing and comparison, computed on first
+    # use. DN objects are immutable, so it never has to be recomputed.
+    _key = None
+
     def __init__(self, *args, **kwds):
         self.rdns = self._rdns_from_sequence(args)
 
@@ -1183,21 +1187,23 @@ class DN(object):
             raise TypeError("unsupported type for DN indexing, must be int, basestring or slice; not %s" % \
                                 (key.__class__.__name__))
 
-    def __hash__(self):
-        # Hash is computed from DN's string representation.
-        #
+    def _get_key(self):
         # Because attrs & values are comparison case-insensitive the
-        # hash value between two objects which compare as equal but
-        # differ in case must yield the same hash value.
+        # normalized form is built from lower-cased attrs & values, so
+        # objects which compare as equal but differ in case yield the
+        # same hash value.
+        key = self._key
+        if key is None:
+            key = self._key = tuple(rdn_key(rdn) for rdn in self.rdns)
+        return key
 
-        str_dn = ';,'.join([
-            '++'.join(
-                ['=='.join((atype, avalue or '')) for atype,avalue,dummy in rdn]
-            ) for rdn in self.rdns
-        ])
-        return hash(str_dn.lower())
+    def __hash__(self):
+        return hash(self._get_key())
 
     def __eq__(self, other):
+        if isinstance(other, DN):
+            return self is other or self._get_key() == other._get_key()
+
         # Try coercing to DN, if successful compare to coerced object
         if isinstance(other, (six.string_types, RDN, AVA)):
             try:
@@ -1207,14 +1213,7 @@ class DN(object):
                 return False
 
         # If it's not an DN it can't be equal
-        if not isinstance(other, DN):
-            return False
-
-        if len(self) != len(other):
-            return False
-
-        # Perform comparison between objects of same type
-        return self._cmp_sequence(other, 0, len(self)) == 0
+        return False
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -1229,17 +1228,14 @@ class DN(object):
         return self._cmp_sequence(other, 0, len(self)) < 0
 
     def _cmp_sequence(self, pattern, self_start, pat_len):
-        self_idx = self_start
-        self_len = len(self)
-        pat_idx = 0
-        #  and self_idx < self_len
-        while pat_idx < pat_len:
-            r = cmp_rdns(self.rdns[self_idx], pattern.rdns[pat_idx])
-            if r != 0:
-                return r
-            self_idx += 1
-            pat_idx += 1
-        return 0
+        self_key = self._get_key()[self_start:self_start + pat_len]
+        pat_key = pattern._get_key()[:pat_len]
+        if self_key == pat_key:
+            return 0
+        elif self_key < pat_key:
+            return -1
+        else:
+            return 1
 
     def __add__(self, other):
         return self.__class__(self, other)
@@ -18,9 +18,14 @@
 #
 
 import collections
+import random
+import socket
+import threading
+import time
 import xml.dom.minidom
 
 import nss.nss as nss
+from nss.error import NSPRError
 import six
 from six.moves.urllib.parse import urlencode
 
@@ -50,6 +55,147 @@ INCLUDED_PROFILES = {
 DEFAULT_PROFILE = u'caIPAserviceCert'
 
 
+# Idle connections authenticated with the agent certificate. Tomcat keeps
+# idle connections open for the connectionTimeout of the connector, which
+# defaults to 20 seconds in the Dogtag server.xml.
+agent_connection_pool = nsslib.ConnectionPool(idle_timeout=15, max_idle=8)
+
+
+class RequestStats(object):
+    """
+    Thread-safe counters of the requests made by `https_request()`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.failures = 0
+            self.connections = 0
+            self.reused = 0
+            self.retries = 0
+            self.total_time = 0.0
+            self.max_time = 0.0
+
+    def record(self, elapsed, connections=0, reused=False, retries=0,
+               failed=False):
+        """
+        Record a request which took ``elapsed`` seconds, opened
+        ``connections`` new connections and was first sent on a pooled
+        connection if ``reused``.
+        """
+        with self._lock:
+            self.requests += 1
+            self.connections += connections
+            if reused:
+                self.reused += 1
+            self.retries += retries
+            if failed:
+                self.failures += 1
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+
+    def as_dict(self):
+        """
+        Return a snapshot of the counters. Times are in seconds.
+        """
+        with self._lock:
+            return dict(
+                requests=self.requests,
+                failures=self.failures,
+                connections=self.connections,
+                reused=self.reused,
+                retries=self.retries,
+                total_time=self.total_time,
+                max_time=self.max_time,
+                avg_time=self.total_time / self.requests if self.requests else 0.0,
+            )
+
+
+https_request_stats = RequestStats()
+
+
+class MasterSelector(object):
+    """
+    Thread-safe selection of the master to send the requests for a service
+    to.
+
+    The masters providing the service are looked up at most every ``ttl``
+    seconds. The preferred masters (the local host) come first, the others
+    are ordered by their average response time. A master which failed
+    within the last ``failure_timeout`` seconds is tried after all the
+    others.
+    """
+
+    ttl = 300
+    failure_timeout = 60
+
+    def __init__(self):
+        self._masters = []
+        self._expires = 0
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def get_hosts(self, find_masters, preferred=(), default=None):
+        """
+        :param find_masters: function returning the list of the masters
+            providing the service, called when the cached list expired
+        :param preferred: masters to use first if they provide the service
+        :param default: host to use if no master provides the service
+        :return: list of hosts in the order they should be tried
+        """
+        now = time.time()
+        with self._lock:
+            masters = self._masters
+            expired = self._expires <= now
+        if expired:
+            masters = list(find_masters())
+            with self._lock:
+                self._masters = masters
+                # an empty list is most likely an LDAP error, look the
+                # masters up again on the next request
+                if masters:
+                    self._expires = now + self.ttl
+        if not masters:
+            return [default]
+
+        deadline = now - self.failure_timeout
+        with self._lock:
+            def key(host):
+                info = self._hosts.get(host, {})
+                failed = info.get('failed', 0) > deadline
+                if host in preferred:
+                    return (failed, 0, preferred.index(host))
+                # masters without a response time come after the measured
+                # ones
+                return (failed, 1, 'rtt' not in info, info.get('rtt', 0))
+            # spread the load among the masters without a response time
+            masters = list(masters)
+            random.shuffle(masters)
+            return sorted(masters, key=key)
+
+    def record_success(self, host, rtt):
+        """
+        Record that ``host`` answered in ``rtt`` seconds.
+        """
+        with self._lock:
+            info = self._hosts.setdefault(host, {})
+            if 'rtt' in info:
+                rtt = 0.7 * info['rtt'] + 0.3 * rtt
+            info['rtt'] = rtt
+            info.pop('failed', None)
+
+    def record_failure(self, host):
+        """
+        Record that a request to ``host`` failed.
+        """
+        with self._lock:
+            self._hosts.setdefault(host, {})['failed'] = time.time()
+
+
 def error_from_xml(doc, message_template):
     try:
         item_node = doc.getElementsByTagName("Error")
@@ -125,11 +271,14 @@ def ca_status(ca_host=None):
 
 
 def https_request(host, port, url, secdir, password, nickname,
-        method='POST', headers=None, body=None, **kw):
+        method='POST', headers=None, body=None, keep_alive=False, **kw):
     """
     :param method: HTTP request method (defalut: 'POST')
     :param url: The path (not complete URL!) to post to.
     :param body: The request body (encodes kw if None)
+    :param keep_alive: Keep the connection open in `agent_connection_pool`
+        and reuse it for the next request. NSS cannot be shut down while
+        the pool holds open connections, use `agent_connection_pool.clear()`.
     :param kw:  Keyword arguments to encode into POST body.
     :return:   (http_status, http_headers, http_body)
                as (integer, dict, str)
@@ -153,7 +302,10 @@ def https_request(host, port, url, secdir, password, nickname,
         body = urlencode(kw)
     return _httplib_request(
         'https', host, port, url, connection_factory, body,
-        method=method, headers=headers)
+        method=method, headers=headers,
+        connection_pool=agent_connection_pool if keep_alive else None,
+        pool_key=(host, port, secdir, nickname),
+        stats=https_request_stats)
 
 
 def http_request(host, port, url, **kw):
@@ -172,12 +324,20 @@ def http_request(host, port, url, **kw):
 
 def _httplib_request(
         protocol, host, port, path, connection_factory, request_body,
-        method='POST', headers=None):
+        method='POST', headers=None, connection_pool=None, pool_key=None,
+        stats=None):
     """
     :param request_body: Request body
     :param connection_factory: Connection class to use. Will be called
         with the host and port arguments.
     :param method: HTTP request method (default: 'POST')
+    :param connection_pool: `ipapython.nsslib.ConnectionPool` to take an
+        idle connection from and to return the connection to if the server
+        keeps it open. Connections are closed after the request if None.
+    :param pool_key: Key of the connection in the connection pool
+    :param stats: `RequestStats` to record the request in
+    :raises NetworkError: on failure, its ``request_sent`` attribute is
+        False if the request never reached the server
 
     Perform a HTTP(s) request.
     """
@@ -194,17 +354,58 @@ def _httplib_request(
     ):
         headers['content-type'] = 'application/x-www-form-urlencoded'
 
+    start = time.time()
+    counters = dict(connections=0, reused=False, retries=0)
+    sent = False
     try:
-        conn = connection_factory(host, port)
-        conn.request(method, uri, body=request_body, headers=headers)
-        res = conn.getresponse()
-
-        http_status = res.status
-        http_headers = res.msg.dict
-        http_body = res.read()
-        conn.close()
+        conn = None
+        if connection_pool is not None:
+            conn = connection_pool.get(pool_key)
+        retry = counters['reused'] = conn is not None
+
+        while True:
+            if conn is None:
+                conn = connection_factory(host, port)
+                counters['connections'] += 1
+            try:
+                conn.request(method, uri, body=request_body, headers=headers)
+            except (httplib.HTTPException, socket.error, NSPRError):
+                conn.close()
+                if not retry:
+                    raise
+                # The server closed the idle connection, so it did not
+                # receive the request. Retry on a new connection.
+                root_logger.debug('retrying request on a new connection')
+                conn = None
+                retry = False
+                counters['retries'] += 1
+                continue
+            break
+
+        # Once the request is sent it is never retried, the server might
+        # have processed it already
+        sent = True
+        try:
+            res = conn.getresponse()
+
+            http_status = res.status
+            http_headers = res.msg.dict
+            http_body = res.read()
+        except Exception:
+            conn.close()
+            raise
+
+        if connection_pool is not None and not res.will_close:
+            connection_pool.put(pool_key, conn)
+        else:
+            conn.close()
     except Exception as e:
-        raise NetworkError(uri=uri, error=str(e))
+        if stats is not None:
+            stats.record(time.time() - start, failed=True, **counters)
+        raise NetworkError(uri=uri, error=str(e), request_sent=sent)
+
+    if stats is not None:
+        stats.record(time.time() - start, **counters)
 
     root_logger.debug('response status %d',    http_status)
     root_logger.debug('response headers %s',   http_headers)
@@ -28,13 +28,18 @@ import contextlib
 import collections
 import os
 import pwd
+import hashlib
+import stat
+import tempfile
+import threading
 
 import ldap
 import ldap.sasl
 import ldap.filter
-from ldap.controls import SimplePagedResultsControl
+from ldap.controls import SimplePagedResultsControl, RequestControl
 import ldapurl
 import six
+from six.moves import cPickle as pickle
 
 from ipalib import errors, _
 from ipalib.constants import LDAP_GENERALIZED_TIME_FORMAT
@@ -90,25 +95,59 @@ def value_to_utf8(val):
 
     return unicode(val).encode('utf-8')
 
+
+def _decode_generalized_time(val):
+    return datetime.datetime.strptime(val, LDAP_GENERALIZED_TIME_FORMAT)
+
+
+# Functions converting raw LDAP values to types returned by
+# LDAPClient.get_attribute_type(), other types are converted by calling them.
+_DECODERS = {
+    bytes: lambda val: val,
+    unicode: unicode_from_utf8,
+    datetime.datetime: _decode_generalized_time,
+    DNSName: DNSName.from_text,
+}
+
 class _ServerSchema(object):
     '''
     Properties of a schema retrieved from an LDAP server.
     '''
 
-    def __init__(self, server, schema):
+    def __init__(self, server, schema, dn=None, timestamp=None):
         self.server = server
         self.schema = schema
+        self.dn = dn
+        # modifyTimestamp of the schema entry
+        self.timestamp = timestamp
         self.retrieve_timestamp = time.time()
+        self.check_timestamp = self.retrieve_timestamp
+        self.refreshing = False
 
 
 class SchemaCache(object):
     '''
     Cache the schema's from individual LDAP servers.
+
+    Once retrieved, the schema of a server is revalidated at most every
+    ``check_interval`` seconds by reading the modifyTimestamp of the schema
+    entry. When it changed, the new schema is parsed in a background thread
+    while the old one is still handed out.
+
+    If ``cache_dir`` is set, parsed schemas are also stored in files in that
+    directory, so that a new process only has to validate the timestamp
+    instead of retrieving and parsing the whole schema.
     '''
 
-    def __init__(self):
+    # version of the format of the cache files
+    file_version = 1
+
+    def __init__(self, cache_dir=None, check_interval=60):
         self.log = log_mgr.get_logger(self)
         self.servers = {}
+        self.cache_dir = cache_dir
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
 
     def get_schema(self, url, conn, force_update=False):
         '''
@@ -123,11 +162,30 @@ class SchemaCache(object):
         if force_update:
             self.flush(url)
 
+        now = time.time()
         server_schema = self.servers.get(url)
-        if server_schema is None:
-            schema = self._retrieve_schema_from_server(url, conn)
-            server_schema = _ServerSchema(url, schema)
-            self.servers[url] = server_schema
+        if server_schema is not None:
+            if now - server_schema.check_timestamp < self.check_interval:
+                return server_schema.schema
+            server_schema.check_timestamp = now
+            if not self._is_modified(server_schema, url, conn):
+                return server_schema.schema
+            self._refresh_in_background(server_schema, conn)
+            return server_schema.schema
+
+        if not force_update:
+            server_schema = self._load_from_file(url)
+            if (server_schema is not None and
+                    not self._is_modified(server_schema, url, conn)):
+                self.servers[url] = server_schema
+                return server_schema.schema
+
+        dn, entry = self._retrieve_schema_from_server(url, conn)
+        server_schema = _ServerSchema(
+            url, ldap.schema.SubSchema(entry), dn,
+            self._get_timestamp(entry))
+        self.servers[url] = server_schema
+        self._store_to_file(server_schema)
         return server_schema.schema
 
     def flush(self, url):
@@ -137,6 +195,135 @@ class SchemaCache(object):
         except KeyError:
             pass
 
+    def _get_timestamp(self, entry):
+        for name, value in entry.items():
+            if name.lower() == 'modifytimestamp' and value:
+                return value[0]
+        return None
+
+    def _is_modified(self, server_schema, url, conn):
+        """
+        Check if the schema changed since ``server_schema`` was retrieved.
+
+        A schema without timestamp is considered unmodified.
+        """
+        if server_schema.timestamp is None:
+            return False
+
+        try:
+            entry = conn.search_s(server_schema.dn, ldap.SCOPE_BASE,
+                                  attrlist=['modifyTimestamp'])[0][1]
+        except (ldap.LDAPError, IndexError) as e:
+            self.log.debug('cannot check timestamp of schema of %s: %s',
+                           url, e)
+            return False
+
+        return self._get_timestamp(entry) != server_schema.timestamp
+
+    def _refresh_in_background(self, server_schema, conn):
+        """
+        Retrieve the modified schema of a server and parse it in a thread.
+        """
+        url = server_schema.server
+        with self._lock:
+            if server_schema.refreshing:
+                return
+            server_schema.refreshing = True
+
+        try:
+            dn, entry = self._retrieve_schema_from_server(url, conn)
+        except (errors.ExecutionError, IndexError) as e:
+            # keep using the old schema
+            self.log.debug('cannot refresh schema of %s: %s', url, e)
+            server_schema.refreshing = False
+            return
+
+        def refresh():
+            try:
+                new_schema = _ServerSchema(
+                    url, ldap.schema.SubSchema(entry), dn,
+                    self._get_timestamp(entry))
+            except Exception as e:
+                self.log.error('cannot parse schema of %s: %s', url, e)
+            else:
+                if self.servers.get(url) is server_schema:
+                    self.servers[url] = new_schema
+                self._store_to_file(new_schema)
+            finally:
+                server_schema.refreshing = False
+
+        self.log.debug('schema of %s modified, refreshing', url)
+        thread = threading.Thread(target=refresh)
+        thread.daemon = True
+        thread.start()
+
+    def _get_filename(self, url):
+        if not self.cache_dir:
+            return None
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, '%s.schema' % digest)
+
+    def _load_from_file(self, url):
+        """
+        Load the parsed schema of a server from the cache directory.
+
+        Only files owned by the current user which are not writable by
+        anyone else are loaded.
+        """
+        filename = self._get_filename(url)
+        if filename is None:
+            return None
+
+        try:
+            with open(filename, 'rb') as f:
+                st = os.fstat(f.fileno())
+                if (st.st_uid != os.geteuid() or
+                        st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)):
+                    self.log.warning('ignoring insecure schema cache file %s',
+                                     filename)
+                    return None
+                data = pickle.load(f)
+        except (IOError, OSError):
+            return None
+        except Exception as e:
+            self.log.debug('cannot load schema cache file %s: %s',
+                           filename, e)
+            return None
+
+        try:
+            version, server, dn, timestamp, schema = data
+        except (TypeError, ValueError):
+            return None
+        if (version != self.file_version or server != url or
+                timestamp is None):
+            return None
+
+        self.log.debug('loaded schema of %s from %s', url, filename)
+        return _ServerSchema(url, schema, dn, timestamp)
+
+    def _store_to_file(self, server_schema):
+        """
+        Store the parsed schema of a server to the cache directory.
+        """
+        filename = self._get_filename(server_schema.server)
+        if filename is None or server_schema.timestamp is None:
+            return
+
+        data = (self.file_version, server_schema.server, server_schema.dn,
+                server_schema.timestamp, server_schema.schema)
+        try:
+            fd, tmpname = tempfile.mkstemp(dir=self.cache_dir)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+                os.rename(tmpname, filename)
+            except BaseException:
+                os.unlink(tmpname)
+                raise
+        except (IOError, OSError, pickle.PicklingError) as e:
+            self.log.debug('cannot store schema cache file %s: %s',
+                           filename, e)
+
     def _retrieve_schema_from_server(self, url, conn):
         """
         Retrieve the LDAP schema from the provided url and determine if
@@ -149,6 +336,8 @@ class SchemaCache(object):
 
         If a connection is provided then it the credentials bound to it are
         used. The connection is not closed when the request is done.
+
+        Return a tuple of the DN and the attributes of the schema entry.
         """
         tmpdir = None
         assert conn is not None
@@ -156,16 +345,19 @@ class SchemaCache(object):
         self.log.debug(
             'retrieving schema for SchemaCache url=%s conn=%s', url, conn)
 
+        attrlist = ['attributetypes', 'objectclasses', 'modifyTimestamp']
         try:
             try:
-                schema_entry = conn.search_s('cn=schema', ldap.SCOPE_BASE,
-                    attrlist=['attributetypes', 'objectclasses'])[0]
+                dn = 'cn=schema'
+                schema_entry = conn.search_s(dn, ldap.SCOPE_BASE,
+                    attrlist=attrlist)[0]
             except ldap.NO_SUCH_OBJECT:
                 # try different location for schema
                 # openldap has schema located in cn=subschema
                 self.log.debug('cn=schema not found, fallback to cn=subschema')
-                schema_entry = conn.search_s('cn=subschema', ldap.SCOPE_BASE,
-                    attrlist=['attributetypes', 'objectclasses'])[0]
+                dn = 'cn=subschema'
+                schema_entry = conn.search_s(dn, ldap.SCOPE_BASE,
+                    attrlist=attrlist)[0]
         except ldap.SERVER_DOWN:
             raise errors.NetworkError(uri=url,
                                error=u'LDAP Server Down, unable to retrieve LDAP schema')
@@ -183,11 +375,50 @@ class SchemaCache(object):
             if tmpdir:
                 shutil.rmtree(tmpdir)
 
-        return ldap.schema.SubSchema(schema_entry[1])
+        return dn, schema_entry[1]
 
 schema_cache = SchemaCache()
 
 
+def _ber_encode(tag, content):
+    length = len(content)
+    if length < 0x80:
+        header = [tag, length]
+    else:
+        octets = []
+        while length:
+            octets.insert(0, length & 0xff)
+            length >>= 8
+        header = [tag, 0x80 | len(octets)] + octets
+    return bytes(bytearray(header)) + content
+
+
+class MatchedValuesControl(RequestControl):
+    """
+    Matched Values control (RFC 3876).
+
+    Only attribute values equal to one of the given (attr, value) pairs are
+    returned in the search result entries; other values of the attributes
+    are left out. Servers which do not support the control return all
+    values.
+    """
+    controlType = '1.2.826.0.1.3344810.2.3'
+
+    def __init__(self, assertions, criticality=False):
+        RequestControl.__init__(self, self.controlType, criticality)
+        self.assertions = assertions
+
+    def encodeControlValue(self):
+        items = []
+        for attr, value in self.assertions:
+            # equalityMatch [3] AttributeValueAssertion
+            items.append(_ber_encode(
+                0xa3,
+                _ber_encode(0x04, value_to_utf8(attr)) +
+                _ber_encode(0x04, value_to_utf8(value))))
+        return _ber_encode(0x30, b''.join(items))
+
+
 class LDAPEntry(collections.MutableMapping):
     __slots__ = ('_conn', '_dn', '_names', '_nice', '_raw', '_sync',
                  '_not_list', '_orig', '_raw_view', '_single_value_view')
@@ -330,6 +561,25 @@ class LDAPEntry(collections.MutableMapping):
         if len(nice) > 1:
             self._not_list.discard(name)
 
+    def _decode_all(self):
+        """
+        Set the nice values of all attributes which have only raw values.
+        """
+        for name, raw in self._raw.items():
+            if raw is None or self._nice[name] is not None:
+                continue
+            decoder = self._conn._get_attribute_info(name)[1]
+            try:
+                nice = [decoder(value) for value in raw]
+            except Exception:
+                # let _sync_attr() report the value which failed
+                continue
+            self._nice[name] = nice
+            # decoded values are immutable, copying the lists is enough
+            self._sync[name] = (list(nice), list(raw))
+            if len(nice) > 1:
+                self._not_list.discard(name)
+
     def _attr_name(self, name):
         if not isinstance(name, six.string_types):
             raise TypeError(
@@ -345,18 +595,8 @@ class LDAPEntry(collections.MutableMapping):
         if name in self._names:
             return self._names[name]
 
-        if self._conn.schema is not None:
-            if six.PY2:
-                encoded_name = name.encode('utf-8')
-            else:
-                encoded_name = name
-            attrtype = self._conn.schema.get_obj(
-                ldap.schema.AttributeType, encoded_name)
-            if attrtype is not None:
-                for altname in attrtype.names:
-                    if six.PY2:
-                        altname = altname.decode('utf-8')
-                    self._names[altname] = name
+        for altname in self._conn._get_attribute_info(name)[2]:
+            self._names[altname] = name
 
         self._names[name] = name
 
@@ -495,7 +735,8 @@ class LDAPEntry(collections.MutableMapping):
         if other is None:
             other = self
         assert isinstance(other, LDAPEntry)
-        self._orig = deepcopy(dict(other.raw))
+        # raw values are immutable, copying the lists is enough
+        self._orig = dict((k, list(v)) for k, v in other.raw.items())
 
     def generate_modlist(self):
         modlist = []
@@ -721,6 +962,8 @@ class LDAPClient(object):
         self.log = log_mgr.get_logger(self)
         self._has_schema = False
         self._schema = None
+        # (schema, {lower-cased attribute name: (type, decoder, names)})
+        self._attribute_table = (None, {})
 
         self._conn = self._connect()
 
@@ -796,6 +1039,48 @@ class LDAPClient(object):
 
         return unicode
 
+    def _get_attribute_info(self, name):
+        """
+        Return a ``(type, decoder, names)`` tuple for attribute ``name``.
+
+        ``type`` is the result of `get_attribute_type()`, ``decoder`` is a
+        function converting a raw value to ``type`` and ``names`` are the
+        names of the attribute known by the schema.
+
+        The information is looked up once per attribute name and kept in a
+        table which is rebuilt when the schema of the connection changes.
+        """
+        schema = self._get_schema()
+        table_schema, table = self._attribute_table
+        if table_schema is not schema:
+            table = {}
+            # bypass ldap2's locking
+            object.__setattr__(self, '_attribute_table', (schema, table))
+
+        key = name.lower()
+        try:
+            return table[key]
+        except KeyError:
+            pass
+
+        target_type = self.get_attribute_type(name)
+        decoder = _DECODERS.get(target_type, target_type)
+
+        names = ()
+        if schema is not None:
+            if six.PY2 and isinstance(name, unicode):
+                encoded_name = name.encode('utf-8')
+            else:
+                encoded_name = name
+            attrtype = schema.get_obj(ldap.schema.AttributeType, encoded_name)
+            if attrtype is not None:
+                names = tuple(attrtype.names)
+                if six.PY2:
+                    names = tuple(n.decode('utf-8') for n in names)
+
+        info = table[key] = (target_type, decoder, names)
+        return info
+
     def has_dn_syntax(self, name_or_oid):
         """
         Check the schema to see if the attribute uses DN syntax.
@@ -864,18 +1149,9 @@ class LDAPClient(object):
         Decode attribute value from LDAP representation (str).
         """
         if isinstance(val, bytes):
-            target_type = self.get_attribute_type(attr)
+            target_type, decoder, names = self._get_attribute_info(attr)
             try:
-                if target_type is bytes:
-                    return val
-                elif target_type is unicode:
-                    return val.decode('utf-8')
-                elif target_type is datetime.datetime:
-                    return datetime.datetime.strptime(val, LDAP_GENERALIZED_TIME_FORMAT)
-                elif target_type is DNSName:
-                    return DNSName.from_text(val)
-                else:
-                    return target_type(val)
+                return decoder(val)
             except Exception as e:
                 msg = 'unable to convert the attribute %r value %r to type %s' % (attr, val, target_type)
                 self.log.error(msg)
@@ -892,6 +1168,18 @@ class LDAPClient(object):
         else:
             raise TypeError("attempt to pass unsupported type from ldap, value=%s type=%s" %(val, type(val)))
 
+    def decode_entries(self, entries):
+        """
+        Decode the raw values of all attributes of ``entries`` at once.
+
+        This is faster than decoding the values one attribute at a time on
+        access, and should be used when most of the attributes of a large
+        result set are going to be read.
+        """
+        for entry in entries:
+            assert entry.conn is self
+            entry._decode_all()
+
     def _convert_result(self, result):
         '''
         result is a python-ldap result tuple of the form (dn, attrs),
@@ -1271,7 +1559,8 @@ class LDAPClient(object):
 
     def find_entries(self, filter=None, attrs_list=None, base_dn=None,
                      scope=ldap.SCOPE_SUBTREE, time_limit=None,
-                     size_limit=None, search_refs=False, paged_search=False):
+                     size_limit=None, search_refs=False, paged_search=False,
+                     serverctrls=None):
         """
         Return a list of entries and indication of whether the results were
         truncated ([(dn, entry_attrs)], truncated) matching specified search
@@ -1288,17 +1577,52 @@ class LDAPClient(object):
         search_refs -- allow search references to be returned
             (default skips these entries)
         paged_search -- search using paged results control
+        serverctrls -- additional server controls sent with the search
 
         :raises: errors.NotFound if result set is empty
                                  or base_dn doesn't exist
         """
+        res = []
+        truncated = False
+
+        try:
+            for entry in self.iter_entries(
+                    filter, attrs_list, base_dn, scope, time_limit=time_limit,
+                    size_limit=size_limit, search_refs=search_refs,
+                    paged_search=paged_search, serverctrls=serverctrls):
+                res.append(entry)
+        except errors.LimitsExceeded:
+            truncated = True
+
+        if not res and not truncated:
+            raise errors.EmptyResult(reason='no matching entry found')
+
+        return (res, truncated)
+
+    def iter_entries(self, filter=None, attrs_list=None, base_dn=None,
+                     scope=ldap.SCOPE_SUBTREE, time_limit=None,
+                     size_limit=None, search_refs=False, paged_search=False,
+                     page_size=None, serverctrls=None):
+        """
+        Iterate over the entries matching specified search parameters as they
+        are received from the server.
+
+        The arguments are the same as for `find_entries`. With paged_search,
+        at most page_size entries are requested at a time (default size_limit
+        or 2000), so neither the client nor the server has to hold the whole
+        result.
+
+        No exception is raised for an empty result set.
+
+        :raises: errors.LimitsExceeded if search hit a server limit, after
+                 the entries received until then
+                 errors.NotFound if base_dn doesn't exist
+        """
         if base_dn is None:
             base_dn = DN()
         assert isinstance(base_dn, DN)
         if not filter:
             filter = '(objectClass=*)'
-        res = []
-        truncated = False
 
         if time_limit is None:
             time_limit = self.time_limit
@@ -1316,10 +1640,11 @@ class LDAPClient(object):
         if attrs_list:
             attrs_list = [a.lower() for a in set(attrs_list)]
 
-        sctrls = None
+        sctrls = serverctrls
         cookie = ''
-        page_size = (size_limit if size_limit > 0 else 2000) - 1
-        if page_size == 0:
+        if page_size is None:
+            page_size = (size_limit if size_limit > 0 else 2000) - 1
+        if page_size <= 0:
             paged_search = False
 
         # pass arguments to python-ldap
@@ -1330,8 +1655,10 @@ class LDAPClient(object):
 
             while True:
                 if paged_search:
-                    sctrls = [SimplePagedResultsControl(0, page_size, cookie)]
+                    sctrls = list(serverctrls or []) + [
+                        SimplePagedResultsControl(0, page_size, cookie)]
 
+                id = None
                 try:
                     id = self.conn.search_ext(
                         str(base_dn), scope, filter, attrs_list,
@@ -1347,7 +1674,8 @@ class LDAPClient(object):
                         if (objtype == ldap.RES_SEARCH_ENTRY or
                                 (search_refs and
                                     objtype == ldap.RES_SEARCH_REFERENCE)):
-                            res.append(res_list[0])
+                            yield res_list[0]
+                    id = None
 
                     if paged_search:
                         # Get cookie for the next page
@@ -1357,34 +1685,37 @@ class LDAPClient(object):
                                 break
                         else:
                             cookie = ''
+                except GeneratorExit:
+                    # The caller stopped the iteration, abandon the search
+                    if id is not None:
+                        self.conn.abandon(id)
+                    if paged_search and cookie:
+                        self.__cancel_paged_search(
+                            base_dn, scope, filter, attrs_list, time_limit,
+                            size_limit, cookie)
+                    raise
                 except ldap.LDAPError as e:
                     # If paged search is in progress, try to cancel it
                     if paged_search and cookie:
-                        sctrls = [SimplePagedResultsControl(0, 0, cookie)]
-                        try:
-                            self.conn.search_ext_s(
-                                str(base_dn), scope, filter, attrs_list,
-                                serverctrls=sctrls, timeout=time_limit,
-                                sizelimit=size_limit)
-                        except ldap.LDAPError as e:
-                            self.log.warning(
-                                "Error cancelling paged search: %s", e)
+                        self.__cancel_paged_search(
+                            base_dn, scope, filter, attrs_list, time_limit,
+                            size_limit, cookie)
                         cookie = ''
-
-                    try:
-                        raise e
-                    except (ldap.ADMINLIMIT_EXCEEDED, ldap.TIMELIMIT_EXCEEDED,
-                            ldap.SIZELIMIT_EXCEEDED):
-                        truncated = True
-                        break
+                    raise e
 
                 if not paged_search or not cookie:
                     break
 
-        if not res and not truncated:
-            raise errors.EmptyResult(reason='no matching entry found')
-
-        return (res, truncated)
+    def __cancel_paged_search(self, base_dn, scope, filter, attrs_list,
+                              time_limit, size_limit, cookie):
+        sctrls = [SimplePagedResultsControl(0, 0, cookie)]
+        try:
+            self.conn.search_ext_s(
+                str(base_dn), scope, filter, attrs_list,
+                serverctrls=sctrls, timeout=time_limit,
+                sizelimit=size_limit)
+        except ldap.LDAPError as e:
+            self.log.warning("Error cancelling paged search: %s", e)
 
     def find_entry_by_attr(self, attr, value, object_class, attrs_list=None,
                            base_dn=None):
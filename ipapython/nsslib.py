@@ -22,6 +22,9 @@ from __future__ import print_function
 
 import getpass
 import socket
+import threading
+import time
+import weakref
 from ipapython.ipa_log_manager import root_logger
 
 from nss.error import NSPRError
@@ -40,6 +43,10 @@ except ImportError:
 # NSS database currently open
 current_dbdir = None
 
+# Connection pools whose idle connections must be closed before NSS is
+# shut down
+_connection_pools = weakref.WeakSet()
+
 def auth_certificate_callback(sock, check_sig, is_server, certdb):
     cert_is_valid = False
 
@@ -176,6 +183,67 @@ class NSSAddressFamilyFallback(object):
             error_message="Could not connect to %s using any address" % host)
 
 
+class ConnectionPool(object):
+    """
+    Thread-safe pool of idle keep-alive connections.
+
+    Connections are kept per key, which identifies the server and the NSS
+    database the connection was created for. A connection which has been
+    idle for more than ``idle_timeout`` seconds is closed rather than
+    reused, as the server has most likely closed it already (Apache closes
+    idle connections after 5 seconds by default).
+    """
+
+    def __init__(self, idle_timeout=4, max_idle=4):
+        self.idle_timeout = idle_timeout
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+        _connection_pools.add(self)
+
+    def get(self, key):
+        """
+        Return an idle connection for ``key`` or None if there is none.
+        """
+        conn = None
+        expired = []
+        deadline = time.time() - self.idle_timeout
+        with self._lock:
+            idle = self._idle.get(key, [])
+            if idle and idle[-1][0] > deadline:
+                conn = idle.pop()[1]
+            else:
+                # connections are stored in the order they were released,
+                # if the latest one has expired, all of them have
+                expired = [c for (timestamp, c) in idle]
+                del idle[:]
+        for c in expired:
+            c.close()
+        return conn
+
+    def put(self, key, conn):
+        """
+        Return an idle connection to the pool.
+        """
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            idle.append((time.time(), conn))
+            discarded = [c for (timestamp, c) in idle[:-self.max_idle]]
+            del idle[:-self.max_idle]
+        for c in discarded:
+            c.close()
+
+    def clear(self):
+        """
+        Close all idle connections.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for (timestamp, c) in conns:
+                c.close()
+
+
 class NSSConnection(httplib.HTTPConnection, NSSAddressFamilyFallback):
     default_port = httplib.HTTPSConnection.default_port
 
@@ -202,6 +270,9 @@ class NSSConnection(httplib.HTTPConnection, NSSAddressFamilyFallback):
         if not no_init:
 
             if nss.nss_is_initialized():
+                # NSS cannot be shut down while there are open connections
+                for pool in list(_connection_pools):
+                    pool.clear()
                 ssl.clear_session_cache()
                 try:
                     nss.nss_shutdown()
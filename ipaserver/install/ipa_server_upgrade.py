@@ -20,11 +20,14 @@ class ServerUpgrade(admintool.AdminTool):
         super(ServerUpgrade, cls).add_options(parser)
         parser.add_option("--force", action="store_true",
                           dest="force", default=False,
-                          help="force upgrade (alias for --skip-version-check)")
+                          help="force upgrade, applying all update files again "
+                               "(alias for --skip-version-check)")
         parser.add_option("--skip-version-check", action="store_true",
                           dest="skip_version_check", default=False,
-                          help="skip version check. WARNING: this may break "
-                               "your system")
+                          help="skip version check and apply all update "
+                               "files, also those applied to the current "
+                               "data already. WARNING: this may break your "
+                               "system")
 
     def validate_options(self):
         super(ServerUpgrade, self).validate_options(needs_root=True)
@@ -43,7 +46,10 @@ class ServerUpgrade(admintool.AdminTool):
 
         try:
             server.upgrade_check(self.options)
-            server.upgrade()
+            # with a forced upgrade all update files are applied again, e.g.
+            # to restore entries changed or deleted since the last upgrade
+            server.upgrade(
+                skip_unchanged=not self.options.skip_version_check)
         except RuntimeError as e:
             raise admintool.ScriptError(str(e))
 
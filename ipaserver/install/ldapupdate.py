@@ -23,6 +23,7 @@
 # save undo files?
 
 import base64
+import hashlib
 import sys
 import uuid
 import platform
@@ -30,12 +31,14 @@ import time
 import os
 import pwd
 import fnmatch
+import string
 
 import ldap
 import six
 
 from ipaserver.install import installutils
-from ipapython import ipautil, ipaldap
+from ipaserver.install import sysupgrade
+from ipapython import ipautil, ipaldap, version
 from ipalib import errors
 from ipalib import api, create_api
 from ipalib import constants
@@ -49,6 +52,13 @@ if six.PY3:
 
 UPDATES_DIR=paths.UPDATES_DIR
 UPDATE_SEARCH_TIME_LIMIT = 30  # seconds
+INDEX_TASK_POLL_MIN = 0.1  # seconds
+INDEX_TASK_POLL_MAX = 2  # seconds
+PREFETCH_CHUNK_SIZE = 100
+# actions whose result depends on the current values of the attribute
+STATEFUL_ACTIONS = ('addifnew', 'only', 'onlyifexist', 'replace')
+UPDATE_ATTRS = ["*", "aci", "attributeTypes", "objectClasses"]
+TASKS_DN = DN(('cn', 'tasks'), ('cn', 'config'))
 
 
 def connect(ldapi=False, realm=None, fqdn=None, dm_password=None, pw_name=None):
@@ -138,7 +148,7 @@ class LDAPUpdate:
     action_keywords = ["default", "add", "remove", "only", "onlyifexist", "deleteentry", "replace", "addifnew", "addifexist"]
 
     def __init__(self, dm_password=None, sub_dict={},
-                 online=True, ldapi=False):
+                 online=True, ldapi=False, skip_unchanged=False):
         '''
         :parameters:
             dm_password
@@ -149,6 +159,9 @@ class LDAPUpdate:
                 Do an online LDAP update or use an experimental LDIF updater
             ldapi
                 Bind using ldapi. This assumes autobind is enabled.
+            skip_unchanged
+                Skip update files which were already applied with the same
+                content to the current data version.
 
         Data Structure Example:
         -----------------------
@@ -258,6 +271,10 @@ class LDAPUpdate:
         self.dm_password = dm_password
         self.conn = None
         self.modified = False
+        self.pending_indices = []
+        self.entry_cache = {}
+        self.failed = False
+        self.skip_unchanged = skip_unchanged
         self.online = online
         self.ldapi = ldapi
         self.pw_name = pwd.getpwuid(os.geteuid()).pw_name
@@ -532,17 +549,15 @@ class LDAPUpdate:
 
         return all_updates
 
-    def create_index_task(self, attribute):
-        """Create a task to update an index for an attribute"""
-
-        # Sleep a bit to ensure previous operations are complete
-        time.sleep(5)
+    def create_index_task(self, *attributes):
+        """Create a task to update the indices of one or more attributes"""
 
         cn_uuid = uuid.uuid1()
         # cn_uuid.time is in nanoseconds, but other users of LDAPUpdate expect
         # seconds in 'TIME' so scale the value down
         self.sub_dict['TIME'] = int(cn_uuid.time/1e9)
-        cn = "indextask_%s_%s_%s" % (attribute, cn_uuid.time, cn_uuid.clock_seq)
+        cn = "indextask_%s_%s_%s" % ('_'.join(attributes), cn_uuid.time,
+                                     cn_uuid.clock_seq)
         dn = DN(('cn', cn), ('cn', 'index'), ('cn', 'tasks'), ('cn', 'config'))
 
         e = self.conn.make_entry(
@@ -550,53 +565,71 @@ class LDAPUpdate:
             objectClass=['top', 'extensibleObject'],
             cn=[cn],
             nsInstance=['userRoot'],
-            nsIndexAttribute=[attribute],
+            nsIndexAttribute=list(attributes),
         )
 
-        self.debug("Creating task to index attribute: %s", attribute)
+        self.debug("Creating task to index attributes: %s",
+                   ', '.join(attributes))
         self.debug("Task id: %s", dn)
 
         self.conn.add_entry(e)
 
         return dn
 
-    def monitor_index_task(self, dn):
-        """Give a task DN monitor it and wait until it has completed (or failed)
+    def monitor_index_task(self, *dns):
+        """Given task DNs monitor them and wait until all of them have
+        completed (or failed)
         """
 
-        assert isinstance(dn, DN)
-
-        # Pause for a moment to give the task time to be created
-        time.sleep(1)
-
         attrlist = ['nstaskstatus', 'nstaskexitcode']
-        entry = None
+        pending = list(dns)
+        delay = INDEX_TASK_POLL_MIN
 
-        while True:
-            try:
-                entry = self.conn.get_entry(dn, attrlist)
-            except errors.NotFound as e:
-                self.error("Task not found: %s", dn)
-                return
-            except errors.DatabaseError as e:
-                self.error("Task lookup failure %s", e)
-                return
+        while pending:
+            for dn in list(pending):
+                assert isinstance(dn, DN)
+                try:
+                    entry = self.conn.get_entry(dn, attrlist)
+                except errors.NotFound as e:
+                    self.error("Task not found: %s", dn)
+                    pending.remove(dn)
+                    continue
+                except errors.DatabaseError as e:
+                    self.error("Task lookup failure %s", e)
+                    pending.remove(dn)
+                    continue
 
-            status = entry.single_value.get('nstaskstatus')
-            if status is None:
-                # task doesn't have a status yet
-                time.sleep(1)
-                continue
+                exit_code = entry.single_value.get('nstaskexitcode')
+                if exit_code is None:
+                    # task is not finished yet
+                    continue
 
-            if status.lower().find("finished") > -1:
-                self.debug("Indexing finished")
-                break
+                pending.remove(dn)
+                if int(exit_code) != 0:
+                    self.error("Indexing task %s failed: %s", dn,
+                               entry.single_value.get('nstaskstatus'))
+                else:
+                    self.debug("Indexing finished: %s", dn)
 
-            self.debug("Indexing in progress")
-            time.sleep(1)
+            if pending:
+                self.debug("Indexing in progress")
+                time.sleep(delay)
+                delay = min(delay * 2, INDEX_TASK_POLL_MAX)
 
         return
 
+    def _run_index_tasks(self):
+        """Reindex all attributes whose index was changed since the last
+        call, using a single index task
+        """
+        if not self.pending_indices:
+            return
+
+        attributes = self.pending_indices
+        self.pending_indices = []
+        taskid = self.create_index_task(*attributes)
+        self.monitor_index_task(taskid)
+
     def _create_default_entry(self, dn, default):
         """Create the default entry from the values provided.
 
@@ -633,10 +666,57 @@ class LDAPUpdate:
         """
         assert isinstance(dn, DN)
         searchfilter="objectclass=*"
-        sattrs = ["*", "aci", "attributeTypes", "objectClasses"]
         scope = ldap.SCOPE_BASE
 
-        return self.conn.get_entries(dn, scope, searchfilter, sattrs)
+        return self.conn.get_entries(dn, scope, searchfilter, UPDATE_ATTRS)
+
+    def _prefetch_entries(self, updates):
+        """Retrieve the entries targeted by updates in bulk.
+
+        Entries sharing a parent are read with a single one-level search.
+        The result is stored in self.entry_cache, where a DN maps to its
+        entry or to None if the entry does not exist.
+        """
+        self.entry_cache = {}
+
+        children = {}
+        for update in updates:
+            if 'plugin' in update:
+                # the plugin may change any entry
+                break
+            dn = update['dn']
+            if 'deleteentry' in update or len(dn) < 2 or len(dn[0]) != 1:
+                continue
+            children.setdefault(dn[1:], set()).add(dn)
+
+        for parent, dns in children.items():
+            if len(dns) < 2:
+                # a base search is just as good
+                continue
+
+            dns = sorted(dns)
+            for i in range(0, len(dns), PREFETCH_CHUNK_SIZE):
+                chunk = dns[i:i + PREFETCH_CHUNK_SIZE]
+                searchfilter = self.conn.combine_filters(
+                    [self.conn.make_filter_from_attr(dn[0].attr, dn[0].value)
+                     for dn in chunk],
+                    rules=self.conn.MATCH_ANY)
+                try:
+                    entries = self.conn.get_entries(
+                        parent, ldap.SCOPE_ONELEVEL, searchfilter,
+                        UPDATE_ATTRS)
+                except errors.NotFound:
+                    entries = []
+                except errors.DatabaseError as e:
+                    self.debug("Prefetch of entries in %s failed: %s",
+                               parent, e)
+                    continue
+
+                found = {entry.dn: entry for entry in entries}
+                for dn in chunk:
+                    self.entry_cache[dn] = found.get(dn)
+
+        self.debug("Prefetched %d entries", len(self.entry_cache))
 
     def _apply_update_disposition(self, updates, entry):
         """
@@ -748,12 +828,25 @@ class LDAPUpdate:
         new_entry = self._create_default_entry(update.get('dn'),
                                                update.get('default'))
 
+        # a prefetched entry is used only once, the update may change it
+        cached = new_entry.dn in self.entry_cache
+        if cached and any(u['action'] in STATEFUL_ACTIONS
+                          for u in update.get('updates', [])):
+            # DS plugins may have changed the entry since it was prefetched
+            # and the changes would be silently overwritten, read it again
+            del self.entry_cache[new_entry.dn]
+            cached = False
         try:
-            e = self._get_entry(new_entry.dn)
-            if len(e) > 1:
-                # we should only ever get back one entry
-                raise BadSyntax("More than 1 entry returned on a dn search!? %s" % new_entry.dn)
-            entry = e[0]
+            if cached:
+                entry = self.entry_cache.pop(new_entry.dn)
+                if entry is None:
+                    raise errors.NotFound(reason=str(new_entry.dn))
+            else:
+                e = self._get_entry(new_entry.dn)
+                if len(e) > 1:
+                    # we should only ever get back one entry
+                    raise BadSyntax("More than 1 entry returned on a dn search!? %s" % new_entry.dn)
+                entry = e[0]
             found = True
             self.debug("Updating existing entry: %s", entry.dn)
         except errors.NotFound:
@@ -794,7 +887,12 @@ class LDAPUpdate:
                 added = True
                 self.modified = True
             except Exception as e:
+                if cached:
+                    # the prefetched entry may be out of date
+                    self.debug("Add failure %s, retrying", e)
+                    return self._update_record(update)
                 self.error("Add failure %s", e)
+                self.failed = True
         else:
             # Update LDAP
             try:
@@ -813,10 +911,22 @@ class LDAPUpdate:
                 self.debug("Entry already up-to-date")
                 updated = False
             except errors.DatabaseError as e:
+                if cached:
+                    # the prefetched entry may be out of date
+                    self.debug("Update failed: %s, retrying", e)
+                    return self._update_record(update)
                 self.error("Update failed: %s", e)
+                self.failed = True
                 updated = False
+            except errors.MidairCollision as e:
+                if not cached:
+                    raise
+                # a removed value was removed since the entry was prefetched
+                self.debug("Update failed: %s, retrying", e)
+                return self._update_record(update)
             except errors.ACIError as e:
                 self.error("Update failed: %s", e)
+                self.failed = True
                 updated = False
 
             if updated:
@@ -825,8 +935,11 @@ class LDAPUpdate:
         if entry.dn.endswith(DN(('cn', 'index'), ('cn', 'userRoot'),
                                 ('cn', 'ldbm database'), ('cn', 'plugins'),
                                 ('cn', 'config'))) and (added or updated):
-            taskid = self.create_index_task(entry.single_value['cn'])
-            self.monitor_index_task(taskid)
+            # reindex once at the end of the run, together with all other
+            # changed indices
+            attribute = entry.single_value['cn']
+            if attribute not in self.pending_indices:
+                self.pending_indices.append(attribute)
         return
 
     def _delete_record(self, updates):
@@ -835,6 +948,7 @@ class LDAPUpdate:
         """
 
         dn = updates['dn']
+        self.entry_cache.pop(dn, None)
         try:
             self.debug("Deleting entry %s", dn)
             self.conn.delete_entry(dn)
@@ -844,6 +958,7 @@ class LDAPUpdate:
             self.modified = True
         except errors.DatabaseError as e:
             self.error("Delete failed: %s", e)
+            self.failed = True
 
     def get_all_files(self, root, recursive=False):
         """Get all update files"""
@@ -858,6 +973,8 @@ class LDAPUpdate:
         return f
 
     def _run_update_plugin(self, plugin_name):
+        # the plugin may rely on the indices of the updates before it
+        self._run_index_tasks()
         self.log.debug("Executing upgrade plugin: %s", plugin_name)
         restart_ds, updates = self.api.Updater[plugin_name]()
         if updates:
@@ -865,6 +982,8 @@ class LDAPUpdate:
         # restart may be required even if no updates were returned
         # from plugin, plugin may change LDAP data directly
         if restart_ds:
+            # a restart would abort running index tasks
+            self._run_index_tasks()
             self.close_connection()
             self.restart_ds()
             self.create_connection()
@@ -882,13 +1001,57 @@ class LDAPUpdate:
             raise RuntimeError("Offline updates are not supported.")
 
     def _run_updates(self, all_updates):
-        for update in all_updates:
+        self._prefetch_entries(all_updates)
+        for i, update in enumerate(all_updates):
             if 'deleteentry' in update:
                 self._delete_record(update)
             elif 'plugin' in update:
                 self._run_update_plugin(update['plugin'])
+                self._prefetch_entries(all_updates[i + 1:])
             else:
                 self._update_record(update)
+        self.entry_cache = {}
+
+    def _get_checksum(self, data):
+        """Return a checksum of the content of an update file after
+        variable substitution
+        """
+        checksum = hashlib.sha256()
+        for line in data:
+            # unknown keywords are reported by parse_update_file()
+            line = string.Template(line).safe_substitute(self.sub_dict)
+            if isinstance(line, unicode):
+                line = line.encode('utf-8')
+            checksum.update(line)
+        return checksum.hexdigest()
+
+    def _is_volatile(self, updates):
+        """Check whether updates have to be applied on every run.
+
+        Update plugins check the current state of the server and entries in
+        cn=tasks,cn=config trigger an action rather than store data.
+        """
+        for update in updates:
+            if 'plugin' in update or update['dn'].endswith(TASKS_DN):
+                return True
+        return False
+
+    def _is_applied(self, filename, checksum):
+        """Check whether an update file with the given checksum was already
+        applied to the current data version
+        """
+        state = sysupgrade.get_upgrade_state('ldapupdate', filename)
+        if state is None:
+            return False
+        data_version = sysupgrade.get_upgrade_state('ipa', 'data_version')
+        return state == '%s %s' % (checksum, data_version)
+
+    def _set_applied(self, filename, checksum):
+        # the data version is stored once the whole upgrade is finished,
+        # until then the state does not match and nothing is skipped
+        sysupgrade.set_upgrade_state('ldapupdate', filename,
+                                     '%s %s' % (checksum,
+                                                version.VENDOR_VERSION))
 
     def update(self, files, ordered=True):
         """Execute the update. files is a list of the update files to use.
@@ -898,6 +1061,7 @@ class LDAPUpdate:
         """
         self.modified = False
         all_updates = []
+        applied = []
         try:
             self.create_connection()
 
@@ -913,9 +1077,25 @@ class LDAPUpdate:
                     self.error("error reading update file '%s'", f)
                     raise RuntimeError(e)
 
+                if self.skip_unchanged:
+                    checksum = self._get_checksum(data)
+                    if self._is_applied(f, checksum):
+                        self.debug("Update file '%s' is unchanged, skipping",
+                                   f)
+                        continue
+
                 self.parse_update_file(f, data, all_updates)
+                self.failed = False
                 self._run_updates(all_updates)
+                if (self.skip_unchanged and not self.failed and
+                        not self._is_volatile(all_updates)):
+                    applied.append((f, checksum))
                 all_updates = []
+
+            self._run_index_tasks()
+
+            for f, checksum in applied:
+                self._set_applied(f, checksum)
         finally:
             self.close_connection()
 
@@ -930,6 +1110,7 @@ class LDAPUpdate:
         try:
             self.create_connection()
             self._run_updates(updates)
+            self._run_index_tasks()
         finally:
             self.close_connection()
 
@@ -1691,11 +1691,12 @@ def upgrade_check(options):
                          "system")
 
 
-def upgrade():
+def upgrade(skip_unchanged=True):
     realm = api.env.realm
     schema_files = [os.path.join(ipautil.SHARE_DIR, f) for f
                     in dsinstance.ALL_SCHEMA_FILES]
-    data_upgrade = IPAUpgrade(realm, schema_files=schema_files)
+    data_upgrade = IPAUpgrade(realm, schema_files=schema_files,
+                              skip_unchanged=skip_unchanged)
 
     try:
         data_upgrade.create_instance()
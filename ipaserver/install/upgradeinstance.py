@@ -69,10 +69,13 @@ class IPAUpgrade(service.Service):
     listeners and updating over ldapi. This way we know the server is
     quiet.
     """
-    def __init__(self, realm_name, files=[], schema_files=[]):
+    def __init__(self, realm_name, files=[], schema_files=[],
+                 skip_unchanged=True):
         """
         realm_name: kerberos realm name, used to determine DS instance dir
         files: list of update files to process. If none use UPDATEDIR
+        skip_unchanged: skip the update files already applied to the current
+                        data, unless files are given
         """
 
         ext = ''
@@ -89,6 +92,7 @@ class IPAUpgrade(service.Service):
         self.serverid = serverid
         self.schema_files = schema_files
         self.realm = realm_name
+        self.skip_unchanged = skip_unchanged
 
     def __start(self):
         services.service(self.service_name).start(self.serverid, ldapi=True)
@@ -207,7 +211,11 @@ class IPAUpgrade(service.Service):
 
     def __upgrade(self):
         try:
-            ld = ldapupdate.LDAPUpdate(dm_password='', ldapi=True)
+            # update files already applied to the current data are skipped,
+            # unless the files were explicitly requested
+            ld = ldapupdate.LDAPUpdate(
+                dm_password='', ldapi=True,
+                skip_unchanged=self.skip_unchanged and not self.files)
             if len(self.files) == 0:
                 self.files = ld.get_all_files(ldapupdate.UPDATES_DIR)
             self.modified = (ld.update(self.files) or self.modified)
@@ -239,6 +239,7 @@ digits and nothing else follows.
 '''
 
 import datetime
+import gzip
 import json
 from lxml import etree
 import time
@@ -1216,39 +1217,13 @@ def parse_unrevoke_cert_xml(doc):
     return response
 
 
-def host_has_service(host, ldap2, service='CA'):
+def find_masters(ldap2, service='CA'):
     """
-    :param host: A host which might be a master for a service.
     :param ldap2: connection to the local database
-    :param service: The service for which the host might be a master.
-    :return:   (true, false)
+    :param service: The service for which we're looking for masters.
+    :return:   list of hosts as str
 
-    Check if a specified host is a master for a specified service.
-    """
-    base_dn = DN(('cn', host), ('cn', 'masters'), ('cn', 'ipa'),
-                 ('cn', 'etc'), api.env.basedn)
-    filter_attrs = {
-        'objectClass': 'ipaConfigObject',
-        'cn': service,
-        'ipaConfigString': 'enabledService',
-        }
-    query_filter = ldap2.make_filter(filter_attrs, rules='&')
-    try:
-        ent, trunc = ldap2.find_entries(filter=query_filter, base_dn=base_dn)
-        if len(ent):
-            return True
-    except Exception:
-        pass
-    return False
-
-
-def select_any_master(ldap2, service='CA'):
-    """
-    :param ldap2: connection to the local database
-    :param service: The service for which we're looking for a master.
-    :return:   host as str
-
-    Select any host which is a master for a specified service.
+    Find all the hosts which are masters for a specified service.
     """
     base_dn = DN(('cn', 'masters'), ('cn', 'ipa'), ('cn', 'etc'),
                   api.env.basedn)
@@ -1259,12 +1234,26 @@ def select_any_master(ldap2, service='CA'):
     query_filter = ldap2.make_filter(filter_attrs, rules='&')
     try:
         ent, trunc = ldap2.find_entries(filter=query_filter, base_dn=base_dn)
-        if len(ent):
-            entry = random.choice(ent)
-            return entry.dn[1].value
+        return [entry.dn[1].value for entry in ent]
     except Exception:
-        pass
-    return None
+        return []
+
+
+def select_hosts(api, selector, service='CA'):
+    """
+    :param api: API instance
+    :param selector: `ipapython.dogtag.MasterSelector` for the service
+    :param service: The service for which we're looking for masters.
+    :return:   list of hosts as str
+
+    List the masters for a specified service in the order they should be
+    tried. The local host and the configured CA host are preferred.
+    """
+    ldap2 = api.Backend.ldap2
+    return selector.get_hosts(
+        lambda: find_masters(ldap2, service),
+        preferred=(api.env.host, api.env.ca_host),
+        default=api.env.ca_host)
 
 #-------------------------------------------------------------------------------
 
@@ -1272,14 +1261,17 @@ from ipalib import api, errors, SkipPluginModule
 if api.env.ra_plugin != 'dogtag':
     # In this case, abort loading this plugin module...
     raise SkipPluginModule(reason='dogtag not selected as RA plugin')
-import os, random
+import os
 from ipaserver.plugins import rabase
 from ipalib.constants import TYPE_ERROR
-from ipalib.util import cachedproperty
 from ipapython import dogtag
 from ipalib import _
 from ipaplatform.paths import paths
 
+# Shared by all the backends of the process
+ca_selector = dogtag.MasterSelector()
+kra_selector = dogtag.MasterSelector()
+
 
 class ra(rabase.rabase):
     """
@@ -1327,7 +1319,7 @@ class ra(rabase.rabase):
         self.error('%s.%s(): %s', self.fullname, func_name, err_msg)
         raise errors.CertificateOperationError(error=err_msg)
 
-    @cachedproperty
+    @property
     def ca_host(self):
         """
         :return:   host
@@ -1335,17 +1327,33 @@ class ra(rabase.rabase):
 
         Select our CA host.
         """
-        ldap2 = self.api.Backend.ldap2
-        if host_has_service(api.env.ca_host, ldap2, "CA"):
-            return api.env.ca_host
-        if api.env.host != api.env.ca_host:
-            if host_has_service(api.env.host, ldap2, "CA"):
-                return api.env.host
-        host = select_any_master(ldap2)
-        if host:
-            return host
-        else:
-            return api.env.ca_host
+        return select_hosts(self.api, ca_selector)[0]
+
+    def _failover(self, func, *args, **kw):
+        """
+        :param func: request function, called with the CA host followed
+                     by args and kw
+        :return:   the result of func
+
+        Perform a request on the CA hosts in the order of preference until
+        one of them does not fail with a network error. A request is only
+        sent to the next host if it never reached the failed one, so it is
+        never processed twice. The response time and the failures of the
+        hosts are recorded in the CA selector.
+        """
+        hosts = select_hosts(self.api, ca_selector)
+        for i, host in enumerate(hosts):
+            start = time.time()
+            try:
+                result = func(host, *args, **kw)
+            except errors.NetworkError as e:
+                ca_selector.record_failure(host)
+                if i == len(hosts) - 1 or getattr(e, 'request_sent', True):
+                    raise
+                self.warning('CA %s failed, trying the next one: %s', host, e)
+                continue
+            ca_selector.record_success(host, time.time() - start)
+            return result
 
     def _request(self, url, port, **kw):
         """
@@ -1356,7 +1364,7 @@ class ra(rabase.rabase):
 
         Perform an HTTP request.
         """
-        return dogtag.http_request(self.ca_host, port, url, **kw)
+        return self._failover(dogtag.http_request, port, url, **kw)
 
     def _sslget(self, url, port, **kw):
         """
@@ -1367,7 +1375,22 @@ class ra(rabase.rabase):
 
         Perform an HTTPS request
         """
-        return dogtag.https_request(self.ca_host, port, url, self.sec_dir, self.password, self.ipa_certificate_nickname, **kw)
+        return self._failover(dogtag.https_request, port, url, self.sec_dir, self.password, self.ipa_certificate_nickname, keep_alive=True, **kw)
+
+    @property
+    def request_stats(self):
+        """
+        :return:   dict of counters
+                   (requests, failures, connections, reused, retries,
+                   total_time, max_time, avg_time)
+
+        Counters of the HTTPS requests made to the CA with the agent
+        certificate by this process, including the requests of the REST
+        API backends. Connections are kept open and reused between
+        requests, a request on a new connection includes the TLS
+        handshake.
+        """
+        return dogtag.https_request_stats.as_dict()
 
     def get_parse_result_xml(self, xml_text, parse_func):
         '''
@@ -1750,11 +1773,16 @@ class ra(rabase.rabase):
 
         return cmd_result
 
-    def find(self, options):
-        """
-        Search for certificates
+    # Number of certificates requested from the CA at once by find_iter()
+    find_page_size = 500
 
+    def _find_request(self, options):
+        """
         :param options: dictionary of search options
+        :return:   CertSearchRequest XML document
+                   as str
+
+        Build the CertSearchRequest for the search options.
         """
 
         def convert_time(value):
@@ -1764,8 +1792,6 @@ class ra(rabase.rabase):
             ts = time.strptime(value, '%Y-%m-%d')
             return int(time.mktime(ts) * 1000)
 
-        self.debug('%s.find()', self.fullname)
-
         # Create the root element
         page = etree.Element('CertSearchRequest')
 
@@ -1838,12 +1864,23 @@ class ra(rabase.rabase):
         payload = etree.tostring(doc, pretty_print=False, xml_declaration=True, encoding='UTF-8')
         self.debug('%s.find(): request: %s', self.fullname, payload)
 
-        url = 'http://%s/ca/rest/certs/search?size=%d' % (
-            ipautil.format_netloc(self.ca_host, 8080),
-            options.get('sizelimit', 100))
+        return payload
+
+    def _find_page(self, payload, start, size):
+        """
+        :param payload: CertSearchRequest XML document
+        :param start: index of the first certificate to return
+        :param size: maximum number of certificates to return
+        :return:   generator of search result dicts
+
+        Perform a search for a window of the results and parse the
+        response incrementally.
+        """
+        url = 'http://%s/ca/rest/certs/search?start=%d&size=%d' % (
+            ipautil.format_netloc(self.ca_host, 8080), start, size)
 
         opener = urllib.request.build_opener()
-        opener.addheaders = [('Accept-Encoding', 'gzip, deflate'),
+        opener.addheaders = [('Accept-Encoding', 'gzip'),
                              ('User-Agent', 'IPA')]
 
         req = urllib.request.Request(url=url, data=payload, headers={'Content-Type': 'application/xml'})
@@ -1860,35 +1897,77 @@ class ra(rabase.rabase):
             self.raise_certificate_operation_error('find',
                                                    detail=e.reason)
 
-        data = response.readlines()
-        self.debug('%s.find(): response: %s', self.fullname, data)
-        parser = etree.XMLParser()
         try:
-            doc = etree.fromstring(data[0], parser)
+            if response.info().get('Content-Encoding') == 'gzip':
+                source = gzip.GzipFile(fileobj=response)
+            else:
+                source = response
+
+            # Only the current certificate is kept in memory, each one is
+            # removed from the tree once it was converted
+            for event, cert in etree.iterparse(source, tag='CertDataInfo'):
+                response_request = {}
+                response_request['serial_number'] = int(cert.get('id'), 16) # parse as hex
+                response_request['serial_number_hex'] = u'0x%X' % response_request['serial_number']
+
+                dn = cert.xpath('SubjectDN')
+                if len(dn) == 1:
+                    response_request['subject'] = unicode(dn[0].text)
+                status = cert.xpath('Status')
+                if len(status) == 1:
+                    response_request['status'] = unicode(status[0].text)
+
+                cert.clear()
+                while cert.getprevious() is not None:
+                    del cert.getparent()[0]
+
+                yield response_request
         except etree.XMLSyntaxError as e:
             self.raise_certificate_operation_error('find',
                                                    detail=e.msg)
+        finally:
+            response.close()
 
-        # Grab all the certificates
-        certs = doc.xpath('//CertDataInfo')
+    def find_iter(self, options, limit=None):
+        """
+        Search for certificates
 
-        results = []
+        :param options: dictionary of search options
+        :param limit: maximum number of certificates to return, None for
+                      no limit
+        :return:   generator of search result dicts
 
-        for cert in certs:
-            response_request = {}
-            response_request['serial_number'] = int(cert.get('id'), 16) # parse as hex
-            response_request['serial_number_hex'] = u'0x%X' % response_request['serial_number']
+        The search results are requested from the CA in windows of
+        `find_page_size` certificates, the next window is only requested
+        once the previous one was consumed.
+        """
+        self.debug('%s.find_iter()', self.fullname)
+
+        payload = self._find_request(options)
+
+        start = 0
+        while limit is None or start < limit:
+            size = self.find_page_size
+            if limit is not None:
+                size = min(size, limit - start)
+            count = 0
+            for response_request in self._find_page(payload, start, size):
+                count += 1
+                yield response_request
+            start += count
+            if count < size:
+                break
 
-            dn = cert.xpath('SubjectDN')
-            if len(dn) == 1:
-                response_request['subject'] = unicode(dn[0].text)
-            status = cert.xpath('Status')
-            if len(status) == 1:
-                response_request['status'] = unicode(status[0].text)
-            results.append(response_request)
+    def find(self, options):
+        """
+        Search for certificates
 
-        return results
+        :param options: dictionary of search options
+        """
+        self.debug('%s.find()', self.fullname)
 
+        return list(self.find_iter(options,
+                                   limit=options.get('sizelimit', 100)))
 
 api.register(ra)
 
@@ -1913,17 +1992,7 @@ class kra(Backend):
 
         Select our KRA host.
         """
-        ldap2 = self.api.Backend.ldap2
-        if host_has_service(api.env.ca_host, ldap2, "KRA"):
-            return api.env.ca_host
-        if api.env.host != api.env.ca_host:
-            if host_has_service(api.env.host, ldap2, "KRA"):
-                return api.env.host
-        host = select_any_master(ldap2, "KRA")
-        if host:
-            return host
-        else:
-            return api.env.ca_host
+        return select_hosts(self.api, kra_selector, 'KRA')[0]
 
     def get_client(self):
         """
@@ -1995,9 +2064,10 @@ class RestClient(Backend):
         self._read_password()
         super(RestClient, self).__init__(api)
 
-        # session cookie
+        # session cookie and the CA host it is valid for
         self.override_port = None
         self.cookie = None
+        self.session_host = None
 
     def _read_password(self):
         try:
@@ -2006,51 +2076,60 @@ class RestClient(Backend):
         except IOError:
             self.password = ''
 
-    @cachedproperty
+    @property
     def ca_host(self):
         """
         :return:   host
                    as str
 
-        Select our CA host.
+        Select our CA host. The host the REST API is logged into is used
+        until logging out.
         """
-        ldap2 = self.api.Backend.ldap2
-        if host_has_service(api.env.ca_host, ldap2, "CA"):
-            return api.env.ca_host
-        if api.env.host != api.env.ca_host:
-            if host_has_service(api.env.host, ldap2, "CA"):
-                return api.env.host
-        host = select_any_master(ldap2)
-        if host:
-            return host
-        else:
-            return api.env.ca_host
+        if self.session_host is not None:
+            return self.session_host
+        return select_hosts(self.api, ca_selector)[0]
 
     def __enter__(self):
         """Log into the REST API"""
         if self.cookie is not None:
             return
-        status, resp_headers, resp_body = dogtag.https_request(
-            self.ca_host, self.override_port or self.env.ca_agent_port,
-            '/ca/rest/account/login',
-            self.sec_dir, self.password, self.ipa_certificate_nickname,
-            method='GET'
-        )
+        hosts = select_hosts(self.api, ca_selector)
+        for i, host in enumerate(hosts):
+            start = time.time()
+            try:
+                status, resp_headers, resp_body = dogtag.https_request(
+                    host, self.override_port or self.env.ca_agent_port,
+                    '/ca/rest/account/login',
+                    self.sec_dir, self.password, self.ipa_certificate_nickname,
+                    method='GET', keep_alive=True
+                )
+            except errors.NetworkError as e:
+                ca_selector.record_failure(host)
+                if i == len(hosts) - 1:
+                    raise
+                self.warning('CA %s failed, trying the next one: %s', host, e)
+                continue
+            ca_selector.record_success(host, time.time() - start)
+            break
         cookies = ipapython.cookie.Cookie.parse(resp_headers.get('set-cookie', ''))
         if status != 200 or len(cookies) == 0:
             raise errors.RemoteRetrieveError(reason=_('Failed to authenticate to CA REST API'))
         self.cookie = str(cookies[0])
+        self.session_host = host
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         """Log out of the REST API"""
-        dogtag.https_request(
-            self.ca_host, self.override_port or self.env.ca_agent_port,
-            '/ca/rest/account/logout',
-            self.sec_dir, self.password, self.ipa_certificate_nickname,
-            method='GET'
-        )
-        self.cookie = None
+        try:
+            dogtag.https_request(
+                self.ca_host, self.override_port or self.env.ca_agent_port,
+                '/ca/rest/account/logout',
+                self.sec_dir, self.password, self.ipa_certificate_nickname,
+                method='GET', keep_alive=True
+            )
+        finally:
+            self.cookie = None
+            self.session_host = None
 
     def _ssldo(self, method, path, headers=None, body=None):
         """
@@ -2071,12 +2150,18 @@ class RestClient(Backend):
         resource = os.path.join('/ca/rest', self.path, path)
 
         # perform main request
-        status, resp_headers, resp_body = dogtag.https_request(
-            self.ca_host, self.override_port or self.env.ca_agent_port,
-            resource,
-            self.sec_dir, self.password, self.ipa_certificate_nickname,
-            method=method, headers=headers, body=body
-        )
+        start = time.time()
+        try:
+            status, resp_headers, resp_body = dogtag.https_request(
+                self.ca_host, self.override_port or self.env.ca_agent_port,
+                resource,
+                self.sec_dir, self.password, self.ipa_certificate_nickname,
+                method=method, headers=headers, body=body, keep_alive=True
+            )
+        except errors.NetworkError:
+            ca_selector.record_failure(self.ca_host)
+            raise
+        ca_selector.record_success(self.ca_host, time.time() - start)
         if status < 200 or status >= 300:
             explanation = self._parse_dogtag_error(resp_body) or ''
             raise errors.RemoteRetrieveError(
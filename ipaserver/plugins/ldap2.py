@@ -27,15 +27,19 @@ Backend plugin for LDAP.
 # binding encodes them into the appropriate representation. This applies to
 # everything except the CrudBackend methods, where dn is part of the entry dict.
 
+import contextlib
 import os
 import pwd
+import threading
+import time
 
 import ldap as _ldap
 
 from ipalib import krb_utils
 from ipapython.dn import DN
 from ipapython.ipaldap import (LDAPClient, AUTOBIND_AUTO, AUTOBIND_ENABLED,
-                               AUTOBIND_DISABLED)
+                               AUTOBIND_DISABLED, schema_cache)
+from ipaplatform.paths import paths
 
 
 try:
@@ -57,6 +61,144 @@ from ipalib.crud import CrudBackend
 from ipalib.request import context
 
 
+class _PooledConnection(object):
+    '''
+    Bound python-ldap connection kept in `LDAPConnectionPool`.
+    '''
+
+    def __init__(self, conn, expires):
+        self.conn = conn
+        self.expires = expires
+        self.last_used = time.time()
+
+
+class LDAPConnectionPool(object):
+    '''
+    Process-wide pool of bound LDAP connections keyed by principal.
+
+    A GSSAPI bind is expensive compared to the short operations most
+    commands perform, so connections bound on behalf of a principal are
+    kept after the request ends and handed to the next request of the same
+    principal in the same process.
+
+    A connection is never handed out after the Kerberos ticket it was bound
+    with expires or after it has been idle for more than ``idle_timeout``
+    seconds. At most ``max_size`` idle connections are kept; when the pool
+    is full the least recently used connection is dropped.
+    '''
+
+    def __init__(self, max_size=10, idle_timeout=60):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._idle = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.binds = 0
+        self.bind_time = 0.0
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(conns) for conns in self._idle.values())
+
+    def _unbind(self, pooled):
+        self.evictions += 1
+        try:
+            pooled.conn.unbind_s()
+        except _ldap.LDAPError:
+            pass
+
+    def _expire(self, now):
+        for key, conns in list(self._idle.items()):
+            for pooled in list(conns):
+                if (pooled.expires <= now or
+                        now - pooled.last_used > self.idle_timeout):
+                    conns.remove(pooled)
+                    self._unbind(pooled)
+            if not conns:
+                del self._idle[key]
+
+    def get(self, key, check=None):
+        '''
+        Return an idle connection bound for ``key`` or None.
+
+        If ``check`` is given, it is called with each candidate python-ldap
+        connection before it is handed out. Connections for which it returns
+        False (e.g. closed by the server while idle) are dropped and the next
+        idle connection is tried.
+        '''
+        while True:
+            with self._lock:
+                self._expire(time.time())
+                conns = self._idle.get(key)
+                if not conns:
+                    self.misses += 1
+                    return None
+                pooled = conns.pop()
+                if not conns:
+                    del self._idle[key]
+
+            # do not hold the lock during the network round trip
+            if check is None or check(pooled.conn):
+                with self._lock:
+                    self.hits += 1
+                return pooled
+
+            with self._lock:
+                self._unbind(pooled)
+
+    def put(self, key, pooled):
+        '''
+        Return a connection bound for ``key`` to the pool.
+        '''
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if self.max_size <= 0 or pooled.expires <= now:
+                self._unbind(pooled)
+                return
+            size = sum(len(conns) for conns in self._idle.values())
+            if size >= self.max_size:
+                lru_key = min(self._idle,
+                              key=lambda k: self._idle[k][0].last_used)
+                lru = self._idle[lru_key].pop(0)
+                if not self._idle[lru_key]:
+                    del self._idle[lru_key]
+                self._unbind(lru)
+            pooled.last_used = now
+            self._idle.setdefault(key, []).append(pooled)
+
+    def record_bind(self, elapsed):
+        with self._lock:
+            self.binds += 1
+            self.bind_time += elapsed
+
+    def clear(self):
+        '''
+        Unbind and forget all idle connections.
+        '''
+        with self._lock:
+            for conns in self._idle.values():
+                for pooled in conns:
+                    self._unbind(pooled)
+            self._idle.clear()
+
+    def stats(self):
+        '''
+        Return a dict with the pool counters.
+        '''
+        with self._lock:
+            return dict(
+                size=sum(len(conns) for conns in self._idle.values()),
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                binds=self.binds,
+                bind_time=self.bind_time,
+            )
+
+
 class ldap2(CrudBackend, LDAPClient):
     """
     LDAP Backend Take 2.
@@ -75,6 +217,16 @@ class ldap2(CrudBackend, LDAPClient):
         self.__time_limit = None
         self.__size_limit = None
 
+        self.pool = LDAPConnectionPool(
+            max_size=api.env.ldap_pool_size,
+            idle_timeout=api.env.ldap_pool_idle_timeout)
+        self._pool_key_attr = '%s_pool_key' % self.id
+
+        if api.env.context == 'server':
+            # let new server processes load the parsed schema from disk
+            schema_cache.cache_dir = paths.IPA_SCHEMA_CACHE_DIR
+            schema_cache.check_interval = api.env.ldap_schema_check_interval
+
     @property
     def time_limit(self):
         if self.__time_limit is None:
@@ -117,6 +269,35 @@ class ldap2(CrudBackend, LDAPClient):
     def __str__(self):
         return self.ldap_uri
 
+    @contextlib.contextmanager
+    def error_handler(self, arg_desc=None):
+        try:
+            with super(ldap2, self).error_handler(arg_desc):
+                yield
+        except errors.NetworkError:
+            # a broken connection must not go back to the pool
+            if hasattr(context, self._pool_key_attr):
+                delattr(context, self._pool_key_attr)
+            raise
+
+    @staticmethod
+    def _is_alive(conn):
+        """
+        Check that a pooled connection was not closed by the server.
+        """
+        try:
+            conn.whoami_s()
+        except _ldap.LDAPError:
+            return False
+        return True
+
+    def pool_stats(self):
+        """
+        Return hit/miss/eviction and bind latency counters of the
+        connection pool.
+        """
+        return self.pool.stats()
+
     def create_connection(self, ccache=None, bind_dn=None, bind_pw='',
             tls_cacertfile=None, tls_certfile=None, tls_keyfile=None,
             debug_level=0, autobind=AUTOBIND_AUTO, serverctrls=None,
@@ -198,17 +379,47 @@ class ldap2(CrudBackend, LDAPClient):
 
             principal = krb_utils.get_principal(ccache_name=ccache)
 
+            use_pool = (self.pool.max_size > 0 and
+                        not self._force_schema_updates and
+                        serverctrls is None and clientctrls is None)
+            if use_pool:
+                pooled = self.pool.get(principal, check=self._is_alive)
+                if pooled is not None:
+                    setattr(context, self._pool_key_attr,
+                            (principal, pooled.expires))
+                    setattr(context, 'principal', principal)
+                    return pooled.conn
+
+            start = time.time()
             client.gssapi_bind(server_controls=serverctrls,
                                client_controls=clientctrls)
+            self.pool.record_bind(time.time() - start)
             setattr(context, 'principal', principal)
 
+            if use_pool:
+                creds = krb_utils.get_credentials_if_valid(ccache_name=ccache)
+                if creds is not None:
+                    expires = (time.time() + creds.lifetime -
+                               krb_utils.krb_ticket_expiration_threshold)
+                    setattr(context, self._pool_key_attr, (principal, expires))
+
         return conn
 
     def destroy_connection(self):
         """Disconnect from LDAP server."""
+        pool_key = getattr(context, self._pool_key_attr, None)
         try:
             if self.conn is not None:
-                self.unbind()
+                if pool_key is not None:
+                    # keep the bound connection for the next request of
+                    # the same principal
+                    principal, expires = pool_key
+                    delattr(context, self._pool_key_attr)
+                    self._flush_schema()
+                    self.pool.put(principal,
+                                  _PooledConnection(self.conn, expires))
+                else:
+                    self.unbind()
         except errors.PublicError:
             # ignore when trying to unbind multiple times
             pass
@@ -438,6 +649,136 @@ class ldap2(CrudBackend, LDAPClient):
         except errors.MidairCollision:
             raise errors.NotGroupMember()
 
+    def _get_existing_members(self, dns):
+        """
+        Return a dict mapping each DN of ``dns`` that exists to the DN
+        of the entry as stored on the server.
+
+        Instead of reading every entry, DNs sharing a parent entry are
+        looked up with a single one-level search on their RDNs.
+        """
+        children = {}
+        for dn in dns:
+            if len(dn) > 1:
+                children.setdefault(dn[1:], []).append(dn)
+
+        existing = {}
+        for parent_dn, parent_children in children.items():
+            wanted = set(parent_children)
+            filters = []
+            for child in wanted:
+                rdn = dict((ava.attr, ava.value) for ava in child[0])
+                filters.append(self.make_filter(rdn, rules=self.MATCH_ALL))
+            filter = self.combine_filters(filters, self.MATCH_ANY)
+            try:
+                entries, truncated = self.find_entries(
+                    filter, [''], parent_dn, self.SCOPE_ONELEVEL,
+                    size_limit=-1, paged_search=True)
+            except errors.NotFound:
+                continue
+            for entry in entries:
+                if entry.dn in wanted:
+                    existing[entry.dn] = entry.dn
+        return existing
+
+    def _modify_group_members(self, group_dn, member_attr, op, dns):
+        modlist = [(op, member_attr, list(dns))]
+        with self.error_handler():
+            modlist = [(a, self.encode(b), self.encode(c))
+                       for a, b, c in modlist]
+            self.conn.modify_s(str(group_dn), modlist)
+
+    def add_entries_to_group(self, dns, group_dn, member_attr='member',
+                             allow_same=False):
+        """
+        Add entries designated by dns to group group_dn in the member
+        attribute member_attr.
+
+        The existence of all entries is checked with as few searches as
+        possible and all of them are added with a single modify operation.
+        Only if that fails, the entries are added one by one to find out
+        which of them failed.
+
+        Returns a list of (dn, error) tuples for entries which could not be
+        added, in the order of dns.
+        """
+        assert isinstance(group_dn, DN)
+
+        self.log.debug(
+            "add_entries_to_group: %d dns group_dn=%s member_attr=%s",
+            len(dns), group_dn, member_attr)
+
+        existing = self._get_existing_members(dns)
+
+        failed = []
+        to_add = []
+        for dn in dns:
+            assert isinstance(dn, DN)
+            if dn not in existing:
+                failed.append((dn, errors.NotFound(reason='no such entry')))
+            elif dn == group_dn and not allow_same:
+                # check if we're not trying to add group into itself
+                failed.append((dn, errors.SameGroupError()))
+            else:
+                to_add.append(dn)
+
+        if not to_add:
+            return failed
+
+        try:
+            self._modify_group_members(
+                group_dn, member_attr, _ldap.MOD_ADD,
+                [existing[dn] for dn in to_add])
+        except errors.PublicError:
+            for dn in to_add:
+                try:
+                    self._modify_group_members(
+                        group_dn, member_attr, _ldap.MOD_ADD, [existing[dn]])
+                except errors.DatabaseError:
+                    failed.append((dn, errors.AlreadyGroupMember()))
+                except errors.PublicError as e:
+                    failed.append((dn, e))
+
+        order = dict((dn, i) for i, dn in reversed(list(enumerate(dns))))
+        failed.sort(key=lambda f: order[f[0]])
+        return failed
+
+    def remove_entries_from_group(self, dns, group_dn, member_attr='member'):
+        """
+        Remove entries designated by dns from group group_dn.
+
+        All entries are removed with a single modify operation. Only if that
+        fails, the entries are removed one by one to find out which of them
+        failed.
+
+        Returns a list of (dn, error) tuples for entries which could not be
+        removed, in the order of dns.
+        """
+        assert isinstance(group_dn, DN)
+
+        self.log.debug(
+            "remove_entries_from_group: %d dns group_dn=%s member_attr=%s",
+            len(dns), group_dn, member_attr)
+
+        if not dns:
+            return []
+
+        failed = []
+        try:
+            self._modify_group_members(
+                group_dn, member_attr, _ldap.MOD_DELETE, dns)
+        except errors.PublicError:
+            for dn in dns:
+                assert isinstance(dn, DN)
+                try:
+                    self._modify_group_members(
+                        group_dn, member_attr, _ldap.MOD_DELETE, [dn])
+                except errors.MidairCollision:
+                    failed.append((dn, errors.NotGroupMember()))
+                except errors.PublicError as e:
+                    failed.append((dn, e))
+        return failed
+
     def set_entry_active(self, dn, active):
         """Mark entry active/inactive."""
 
@@ -117,3 +117,17 @@ class rabase(Backend):
         :param options: dictionary of search options
         """
         raise errors.NotImplementedError(name='%s.find' % self.name)
+
+    def find_iter(self, options, limit=None):
+        """
+        Search for certificates
+
+        :param options: dictionary of search options
+        :param limit: maximum number of certificates to return, None for
+                      no limit
+        :return: generator of search result dicts
+        """
+        options = dict(options)
+        if limit is not None:
+            options['sizelimit'] = limit
+        return iter(self.find(options))
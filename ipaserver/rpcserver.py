@@ -31,6 +31,7 @@ import json
 import traceback
 import gssapi
 import time
+import zlib
 
 import ldap.controls
 from pyasn1.type import univ, namedtype
@@ -46,7 +47,7 @@ from ipalib.errors import (PublicError, InternalError, CommandError, JSONError,
     ExecutionError, PasswordExpired)
 from ipalib.request import context, destroy_context
 from ipalib.rpc import (xml_dumps, xml_loads,
-    json_encode_binary, json_decode_binary)
+    json_decode_binary, json_dumps_binary)
 from ipalib.util import parse_time_duration, normalize_name
 from ipapython.dn import DN
 from ipaserver.plugins.ldap2 import ldap2
@@ -67,6 +68,7 @@ if six.PY3:
     unicode = str
 
 HTTP_STATUS_SUCCESS = '200 Success'
+HTTP_STATUS_NOT_MODIFIED = '304 Not Modified'
 HTTP_STATUS_SERVER_ERROR = '500 Internal Server Error'
 
 _not_found_template = """<html>
@@ -214,6 +216,47 @@ def nicify_query(query, encoding='utf-8'):
             yield (key, tuple(v.decode(encoding) for v in value))
 
 
+def accepts_encoding(environ, encoding):
+    """
+    Return True if the Accept-Encoding header of the request allows the
+    response to be sent with the given Content-Encoding.
+    """
+    for item in environ.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        params = item.strip().split(';')
+        if params[0].strip().lower() not in (encoding, '*'):
+            continue
+        for param in params[1:]:
+            name, sep, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+def etag_matches(environ, etag):
+    """
+    Return True if the If-None-Match header of the request matches etag.
+    """
+    for tag in environ.get('HTTP_IF_NONE_MATCH', '').split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag in ('*', etag):
+            return True
+    return False
+
+
+def gzip_encode(data, level=6):
+    """
+    Compress data to the gzip format.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
 def extract_query(environ):
     """
     Return the query as a ``dict``, or ``None`` if no query is presest.
@@ -347,6 +390,13 @@ class WSGIExecutioner(Executioner):
             elif name not in self.Command:
                 raise CommandError(name=name)
             else:
+                etag = self.Command[name].get_etag(*args, **options)
+                if etag is not None:
+                    environ['ipa.etag'] = etag
+                    if etag_matches(environ, etag):
+                        self.debug('WSGI wsgi_execute: %s not modified', name)
+                        return None
+                context.call_params = None
                 result = self.Command[name](*args, **options)
         except PublicError as e:
             if self.api.env.debug:
@@ -362,14 +412,18 @@ class WSGIExecutioner(Executioner):
 
         principal = getattr(context, 'principal', 'UNKNOWN')
         if name and name in self.Command:
-            try:
-                params = self.Command[name].args_options_2_params(*args, **options)
-            except Exception as e:
-                self.info(
-                   'exception %s caught when converting options: %s', e.__class__.__name__, str(e)
-                )
-                # get at least some context of what is going on
-                params = options
+            # reuse the params mapped by the command, if it got that far
+            params = context.__dict__.pop('call_params', None)
+            if params is None:
+                try:
+                    params = self.Command[name].args_options_2_params(
+                        *args, **options)
+                except Exception as e:
+                    self.info(
+                       'exception %s caught when converting options: %s', e.__class__.__name__, str(e)
+                    )
+                    # get at least some context of what is going on
+                    params = options
             if error:
                 result_string = type(e).__name__
             else:
@@ -378,7 +432,7 @@ class WSGIExecutioner(Executioner):
                       type(self).__name__,
                       principal,
                       name,
-                      ', '.join(self.Command[name]._repr_iter(**params)),
+                      self.Command[name]._repr_params(**params),
                       result_string)
         else:
             self.info('[%s] %s: %s: %s',
@@ -405,6 +459,16 @@ class WSGIExecutioner(Executioner):
             status = HTTP_STATUS_SUCCESS
             response = self.wsgi_execute(environ)
             headers = [('Content-Type', self.content_type + '; charset=utf-8')]
+            etag = environ.get('ipa.etag')
+            if etag is not None:
+                # the client has to check whether its copy is still valid
+                headers.extend([('ETag', etag),
+                                ('Cache-Control', 'private, no-cache')])
+            if response is None:
+                status = HTTP_STATUS_NOT_MODIFIED
+                response = b''
+            else:
+                response = self.encode_response(environ, response, headers)
         except Exception as e:
             self.exception('WSGI %s.__call__():', self.name)
             status = HTTP_STATUS_SERVER_ERROR
@@ -422,6 +486,14 @@ class WSGIExecutioner(Executioner):
         start_response(status, headers)
         return [response]
 
+    def encode_response(self, environ, response, headers):
+        """
+        Return the marshaled response as it is to be sent to the client.
+
+        Additional response headers are appended to headers.
+        """
+        return response
+
     def unmarshal(self, data):
         raise NotImplementedError('%s.unmarshal()' % self.fullname)
 
@@ -441,6 +513,9 @@ class jsonserver(WSGIExecutioner, HTTP_Status):
 
     content_type = 'application/json'
 
+    # responses shorter than this are not worth compressing
+    gzip_min_length = 1024
+
     def __call__(self, environ, start_response):
         '''
         '''
@@ -450,6 +525,27 @@ class jsonserver(WSGIExecutioner, HTTP_Status):
         response = super(jsonserver, self).__call__(environ, start_response)
         return response
 
+    def encode_response(self, environ, response, headers):
+        '''
+        Pretty-print the response if the client asked for it with the
+        X-IPA-Pretty-Print header and compress it if the client accepts
+        gzip.
+        '''
+        if environ.get('HTTP_X_IPA_PRETTY_PRINT', '').lower() in (
+                '1', 'true', 'yes'):
+            response = json.dumps(
+                json.loads(response), sort_keys=True, indent=4)
+
+        if not isinstance(response, bytes):
+            response = response.encode('utf-8')
+
+        headers.append(('Vary', 'Accept-Encoding'))
+        if (len(response) >= self.gzip_min_length and
+                accepts_encoding(environ, 'gzip')):
+            response = gzip_encode(response)
+            headers.append(('Content-Encoding', 'gzip'))
+        return response
+
     def marshal(self, result, error, _id=None,
                 version=VERSION_WITHOUT_CAPABILITIES):
         if error:
@@ -467,8 +563,7 @@ class jsonserver(WSGIExecutioner, HTTP_Status):
             principal=unicode(principal),
             version=unicode(VERSION),
         )
-        response = json_encode_binary(response, version)
-        return json.dumps(response, sort_keys=True, indent=4)
+        return json_dumps_binary(response, version)
 
     def unmarshal(self, data):
         try:
@@ -556,6 +651,17 @@ class KerberosSession(object):
             self.error('unable to parse session_auth_duration, defaulting to %d: %s',
                        self.session_auth_duration, e)
 
+        # Set how far the session expiration must move to be written
+        try:
+            seconds = parse_time_duration(self.api.env.session_expiration_granularity)
+            session_mgr.expiration_granularity = int(seconds)
+            self.debug("session_expiration_granularity: %s",
+                       datetime.timedelta(seconds=session_mgr.expiration_granularity))
+        except Exception as e:
+            session_mgr.expiration_granularity = 0
+            self.error('unable to parse session_expiration_granularity, defaulting to %d: %s',
+                       session_mgr.expiration_granularity, e)
+
     def update_session_expiration(self, session_data, krb_endtime):
         '''
         Each time a session is created or accessed we need to update
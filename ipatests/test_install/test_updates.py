@@ -22,15 +22,18 @@ Test the `ipaserver/install/ldapupdate.py` module.
 
 import unittest
 import os
+import shutil
+import tempfile
 
 import nose
 import pytest
 
 from ipalib import api
 from ipalib import errors
+from ipaserver.install import ldapupdate
 from ipaserver.install.ldapupdate import LDAPUpdate, BadSyntax
 from ipaserver.install import installutils
-from ipapython import ipautil, ipaldap
+from ipapython import ipautil, ipaldap, version
 from ipaplatform.paths import paths
 from ipapython.dn import DN
 
@@ -47,6 +50,109 @@ The DM password needs to be set in ~/.ipa/.dmpw
 """
 
 
+class FakeUpgradeState(object):
+    """
+    Upgrade state kept in memory instead of the sysupgrade state file
+    """
+    def __init__(self, data_version):
+        self.state = {('ipa', 'data_version'): data_version}
+
+    def get_upgrade_state(self, module, state):
+        return self.state.get((module, state))
+
+    def set_upgrade_state(self, module, state, value):
+        self.state[(module, state)] = value
+
+
+class FakeTaskEntry(object):
+    def __init__(self, **attrs):
+        self.single_value = attrs
+
+
+class FakeTaskConnection(object):
+    """
+    Connection returning the next state of a task on each lookup
+    """
+    def __init__(self, tasks):
+        self.tasks = tasks
+        self.lookups = []
+
+    def get_entry(self, dn, attrs_list=None):
+        self.lookups.append(dn)
+        state = self.tasks[dn].pop(0)
+        if isinstance(state, Exception):
+            raise state
+        return state
+
+
+class FakeTime(object):
+    def __init__(self):
+        self.delays = []
+
+    def sleep(self, delay):
+        self.delays.append(delay)
+
+
+class monitor_updater(LDAPUpdate):
+    """
+    LDAP updater without a server recording the errors
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.errors = []
+
+    def debug(self, *args):
+        pass
+
+    def error(self, msg, *args):
+        self.errors.append(msg % args)
+
+
+@pytest.mark.tier0
+class test_monitor_index_task(object):
+    """
+    Test waiting for index tasks.
+    """
+    def setup(self):
+        self.time = ldapupdate.time
+        ldapupdate.time = FakeTime()
+
+    def teardown(self):
+        ldapupdate.time = self.time
+
+    def test_monitor_index_task(self):
+        finished, missing, failed, broken = [
+            DN(('cn', 'indextask_%s' % name), ('cn', 'index'), ('cn', 'tasks'),
+               ('cn', 'config'))
+            for name in ('finished', 'missing', 'failed', 'broken')]
+        conn = FakeTaskConnection({
+            finished: [FakeTaskEntry(nstaskstatus='started'),
+                       FakeTaskEntry(nstaskstatus='started'),
+                       FakeTaskEntry(nstaskstatus='finished',
+                                     nstaskexitcode='0')],
+            missing: [errors.NotFound(reason=u'no such entry')],
+            failed: [FakeTaskEntry(nstaskstatus='started'),
+                     FakeTaskEntry(nstaskstatus='index error',
+                                   nstaskexitcode='1')],
+            broken: [errors.DatabaseError(desc=u'busy', info=u'')],
+        })
+        updater = monitor_updater(conn)
+        updater.monitor_index_task(finished, missing, failed, broken)
+
+        # every task is looked up until it is done
+        assert conn.lookups == [finished, missing, failed, broken,
+                                finished, failed,
+                                finished]
+        assert all(not states for states in conn.tasks.values())
+        assert ldapupdate.time.delays == [ldapupdate.INDEX_TASK_POLL_MIN,
+                                          ldapupdate.INDEX_TASK_POLL_MIN * 2]
+        assert len(updater.errors) == 3
+        assert str(missing) in updater.errors[0]
+        assert 'busy' in updater.errors[1]
+        assert str(failed) in updater.errors[2]
+        assert 'index error' in updater.errors[2]
+
+
 @pytest.mark.tier0
 class test_update(unittest.TestCase):
     """
@@ -74,6 +180,7 @@ class test_update(unittest.TestCase):
 
         self.container_dn = DN(self.updater._template_str('cn=test, cn=accounts, $SUFFIX'))
         self.user_dn = DN(self.updater._template_str('uid=tuser, cn=test, cn=accounts, $SUFFIX'))
+        self.user2_dn = DN(self.updater._template_str('uid=tuser2, cn=test, cn=accounts, $SUFFIX'))
 
     def tearDown(self):
         if self.ld:
@@ -339,3 +446,129 @@ class test_update(unittest.TestCase):
         with self.assertRaises(errors.NotFound):
             entries = self.ld.get_entries(
                 self.user_dn, self.ld.SCOPE_BASE, 'objectclass=*', ['*'])
+
+    def test_skip_unchanged(self):
+        """
+        Test skipping an update file already applied to the current data
+        """
+        updater = LDAPUpdate(dm_password=self.dm_password, sub_dict={},
+                             skip_unchanged=True)
+        state = FakeUpgradeState(version.VENDOR_VERSION)
+        sysupgrade = ldapupdate.sysupgrade
+        ldapupdate.sysupgrade = state
+        tmpdir = tempfile.mkdtemp()
+        try:
+            update_file = os.path.join(tmpdir, "1_add.update")
+            shutil.copy(self.testdir + "1_add.update", update_file)
+
+            modified = updater.update([update_file])
+            self.assertTrue(modified)
+            self.ld.get_entry(self.user_dn)
+
+            # unchanged, the deleted user is not added again
+            self.ld.delete_entry(self.user_dn)
+            modified = updater.update([update_file])
+            self.assertFalse(modified)
+            with self.assertRaises(errors.NotFound):
+                self.ld.get_entry(self.user_dn)
+
+            # the file was applied to a different data version
+            state.state[('ipa', 'data_version')] = '0.0'
+            modified = updater.update([update_file])
+            self.assertTrue(modified)
+            self.ld.get_entry(self.user_dn)
+
+            # the file was changed
+            state.state[('ipa', 'data_version')] = version.VENDOR_VERSION
+            self.ld.delete_entry(self.user_dn)
+            with open(update_file, "a") as f:
+                with open(self.testdir + "2_update.update") as update:
+                    f.write("\n" + update.read())
+            modified = updater.update([update_file])
+            self.assertTrue(modified)
+            entry = self.ld.get_entry(self.user_dn)
+            self.assertEqual(entry.single_value['gecos'], 'Test User')
+        finally:
+            ldapupdate.sysupgrade = sysupgrade
+            shutil.rmtree(tmpdir)
+            self.updater.update([self.testdir + "0_reset.update"])
+
+    def test_prefetch_same_dn(self):
+        """
+        Test two updates of a prefetched entry in one file
+        """
+        try:
+            self.updater.update([self.testdir + "1_add.update"])
+            modified = self.updater.update([self.testdir + "10_prefetch.update"])
+            self.assertTrue(modified)
+
+            entry = self.ld.get_entry(self.user_dn)
+            self.assertEqual(sorted(entry.get('cn')),
+                             sorted(['Test User New', 'Test User New2']))
+            entry = self.ld.get_entry(self.user2_dn)
+            self.assertEqual(sorted(entry.get('cn')),
+                             sorted(['Test User2', 'Test User2 Old']))
+        finally:
+            self.updater.update([self.testdir + "0_reset.update"])
+
+    def test_prefetch_changed(self):
+        """
+        Test updating prefetched entries changed before the update
+        """
+        updater = LDAPUpdate(dm_password=self.dm_password, sub_dict={})
+        prefetch_entries = updater._prefetch_entries
+
+        def change_entries(updates):
+            prefetch_entries(updates)
+            self.assertIn(self.user_dn, updater.entry_cache)
+            self.assertIn(self.user2_dn, updater.entry_cache)
+
+            entry = self.ld.get_entry(self.user_dn, ['cn'])
+            entry['cn'] = ['Test User New', 'Test User New2', 'Test User New3']
+            self.ld.update_entry(entry)
+            entry = self.ld.get_entry(self.user2_dn, ['cn'])
+            entry['cn'] = ['Test User2']
+            self.ld.update_entry(entry)
+
+        updater._prefetch_entries = change_entries
+        try:
+            self.updater.update([self.testdir + "1_add.update"])
+            self.updater.update([self.testdir + "10_prefetch.update"])
+
+            # the add and the remove fail with the prefetched entries and
+            # are retried with the current ones
+            updater.update([self.testdir + "11_prefetch.update"])
+            self.assertFalse(updater.failed)
+
+            entry = self.ld.get_entry(self.user_dn)
+            self.assertEqual(
+                sorted(entry.get('cn')),
+                sorted(['Test User New', 'Test User New2', 'Test User New3']))
+            entry = self.ld.get_entry(self.user2_dn)
+            self.assertEqual(entry.get('cn'), ['Test User2'])
+        finally:
+            self.updater.update([self.testdir + "0_reset.update"])
+
+    def test_index_task(self):
+        """
+        Test indexing all changed indices with a single task
+        """
+        tasks = []
+        create_index_task = self.updater.create_index_task
+
+        def record_index_task(*attributes):
+            tasks.append(attributes)
+            return create_index_task(*attributes)
+
+        self.updater.create_index_task = record_index_task
+        try:
+            modified = self.updater.update([self.testdir + "12_index.update"])
+            self.assertTrue(modified)
+            self.assertEqual(tasks, [('roomNumber', 'employeeNumber')])
+
+            # the indices are up to date
+            modified = self.updater.update([self.testdir + "12_index.update"])
+            self.assertFalse(modified)
+            self.assertEqual(len(tasks), 1)
+        finally:
+            self.updater.update([self.testdir + "13_index_reset.update"])
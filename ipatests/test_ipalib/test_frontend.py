@@ -23,6 +23,8 @@ Test the `ipalib.frontend` module.
 
 # FIXME: Pylint errors
 # pylint: disable=no-member
+import logging
+
 import pytest
 
 import six
@@ -629,6 +631,50 @@ class test_Command(ClassChecker):
         assert e['three'] == ['three1', 'three2']
         assert e['four'] == 'four'
 
+    def test_repr_params(self):
+        """
+        Test the `ipalib.frontend.Command._repr_params` method.
+        """
+        o = self.get_instance(
+            args=('one',),
+            options=(parameters.Password('passwd'), 'two?'))
+        params = dict(one=u'Okay.', passwd=u'Private!')
+        r = o._repr_params(**params)
+        assert str(r) == ', '.join(o._repr_iter(**params))
+        assert 'Private!' not in str(r)
+
+        # Nothing is formatted unless the log record is emitted
+        calls = []
+
+        class Value(object):
+            def __repr__(self):
+                calls.append(self)
+                return 'Value()'
+
+        class Handler(logging.Handler):
+            def __init__(self):
+                logging.Handler.__init__(self)
+                self.messages = []
+
+            def emit(self, record):
+                self.messages.append(record.getMessage())
+
+        handler = Handler()
+        logger = logging.getLogger('test_repr_params')
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(handler)
+        try:
+            logger.debug('%s(%s)', o.name, o._repr_params(one=Value()))
+            assert calls == []
+            assert handler.messages == []
+            logger.info('%s(%s)', o.name, o._repr_params(one=Value()))
+            assert calls
+            assert len(handler.messages) == 1
+            assert 'Value()' in handler.messages[0]
+        finally:
+            logger.removeHandler(handler)
+
     def test_params_2_args_options(self):
         """
         Test the `ipalib.frontend.Command.params_2_args_options` method.
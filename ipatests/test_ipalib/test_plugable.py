@@ -24,8 +24,12 @@ Test the `ipalib.plugable` module.
 # FIXME: Pylint errors
 # pylint: disable=no-member
 
+import os
+import subprocess
+import sys
+
 from ipatests.util import raises, read_only
-from ipatests.util import ClassChecker, create_test_api
+from ipatests.util import ClassChecker, create_test_api, TempDir
 from ipalib import plugable, errors, text
 
 import pytest
@@ -288,3 +292,109 @@ class test_API(ClassChecker):
         assert o.isdone('load_plugins') is True
         e = raises(Exception, o.load_plugins)
         assert str(e) == 'API.load_plugins() already called'
+
+
+class test_PluginIndex(ClassChecker):
+    """
+    Test the `ipalib.plugable.PluginIndex` class.
+    """
+    _cls = plugable.PluginIndex
+
+    def new(self):
+        tmp = TempDir()
+        files = {}
+        for name in ('a', 'b', 'c', 'd'):
+            files['plugins.%s' % name] = tmp.touch('plugins', '%s.py' % name)
+        o = self.cls(tmp.join('cache', 'plugins.index'))
+        o.add_module('plugins.a', files['plugins.a'],
+                     provides=['Command.a_show', 'Object.a'],
+                     requires=['Object.a'], uses=['Object.c'],
+                     imports=['plugins.b'])
+        o.add_module('plugins.b', files['plugins.b'],
+                     provides=['Object.b'])
+        o.add_module('plugins.c', files['plugins.c'],
+                     provides=['Object.c'], requires=['Object.d'])
+        o.add_module('plugins.d', files['plugins.d'],
+                     provides=['Object.d'])
+        return o, files, tmp
+
+    def test_resolve(self):
+        """
+        Test the `ipalib.plugable.PluginIndex.resolve` method.
+        """
+        (o, files, tmp) = self.new()
+        assert o.resolve(['Command.a_show']) == set(
+            ['plugins.a', 'plugins.b', 'plugins.c'])
+        assert o.resolve(['Object.c']) == set(['plugins.c', 'plugins.d'])
+        assert o.resolve(['Object.d']) == set(['plugins.d'])
+        assert o.resolve(['Command.b_show']) is None
+
+    def test_is_current(self):
+        """
+        Test the `ipalib.plugable.PluginIndex.is_current` method.
+        """
+        (o, files, tmp) = self.new()
+        assert o.is_current(files) is True
+
+        stat = os.stat(files['plugins.d'])
+        os.utime(files['plugins.d'], (stat.st_atime, stat.st_mtime + 10))
+        assert o.is_current(files) is False
+
+        o.add_module('plugins.d', files['plugins.d'])
+        assert o.is_current(files) is True
+
+        files['plugins.e'] = tmp.touch('plugins', 'e.py')
+        assert o.is_current(files) is False
+
+    def test_save_load(self):
+        """
+        Test the `ipalib.plugable.PluginIndex.save` and
+        `ipalib.plugable.PluginIndex.load` methods.
+        """
+        (o, files, tmp) = self.new()
+        loaded = self.cls(o.filename)
+        assert loaded.load() is False
+
+        assert o.save() is True
+        assert loaded.load() is True
+        assert loaded.modules == o.modules
+        assert loaded.is_current(files) is True
+
+        with open(o.filename, 'w') as f:
+            f.write('{"version": 0, "modules": {}}')
+        assert loaded.load() is False
+
+
+STARTUP_SCRIPT = """
+import sys
+from ipalib import api
+api.bootstrap(context='cli', in_server=False, plugin_index=sys.argv[1])
+api.load_plugins(command=sys.argv[2] or None)
+api.finalize()
+api.Command.ping.ensure_finalized()
+print(len(api.plugins))
+"""
+
+
+def test_cli_startup():
+    """
+    Test that the CLI loads only the plugins it needs with the plugin index.
+    """
+    tmp = TempDir()
+    index = tmp.join('plugins.index')
+    cwd = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+
+    def startup(command):
+        output = subprocess.check_output(
+            [sys.executable, '-c', STARTUP_SCRIPT, index, command],
+            cwd=cwd)
+        return int(output.decode('ascii'))
+
+    full_plugins = startup('')
+    # build the index
+    startup('ping')
+    assert os.path.isfile(index)
+    lazy_plugins = startup('ping')
+
+    assert lazy_plugins < full_plugins
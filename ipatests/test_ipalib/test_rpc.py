@@ -22,16 +22,26 @@ Test the `ipalib.rpc` module.
 """
 from __future__ import print_function
 
+import datetime
+import json
+import socket
+import threading
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves import http_client as httplib
 from six.moves.xmlrpc_client import Binary, Fault, dumps, loads
 
 import nose
 import six
 
 from ipatests.util import raises, assert_equal, PluginTester, DummyClass
+from ipatests.util import TempDir
 from ipatests.data import binary_bytes, utf8_bytes, unicode_str
 from ipalib.frontend import Command
 from ipalib.request import context, Connection
 from ipalib import rpc, errors, api, request
+from ipapython.dn import DN
+from ipapython.dnsutil import DNSName
 from ipapython.version import API_VERSION
 
 if six.PY3:
@@ -196,6 +206,38 @@ def test_xml_loads():
         assert type(e.faultString) is unicode
 
 
+def test_json_dumps_binary():
+    """
+    Test the `ipalib.rpc.json_dumps_binary` function.
+    """
+    f = rpc.json_dumps_binary
+    when = datetime.datetime(2016, 5, 4, 3, 2, 1)
+    value = dict(
+        binary=binary_bytes,
+        text=unicode_str,
+        numbers=(1, -2, 3.5, True, False, None),
+        nested=[dict(empty=[], dn=DN(('cn', 'admins'), ('dc', 'example')))],
+    )
+
+    data = f(value, API_VERSION)
+    assert ' ' not in data
+    assert json.loads(data)['nested'][0]['dn'] == u'cn=admins,dc=example'
+    result = rpc.json_decode_binary(json.loads(data))
+    assert result['binary'] == binary_bytes
+    assert result['text'] == unicode_str
+    assert result['numbers'] == (1, -2, 3.5, True, False, None)
+
+    # The special values depend on the capabilities of the client
+    assert json.loads(f(when, API_VERSION)) == {
+        u'__datetime__': u'20160504030201Z'}
+    assert json.loads(f(when, u'2.0')) == u'20160504030201Z'
+    assert json.loads(f(DNSName(u'example.com.'), API_VERSION)) == {
+        u'__dns_name__': u'example.com.'}
+    assert json.loads(f(DNSName(u'example.com.'), u'2.0')) == u'example.com.'
+
+    raises(TypeError, f, object(), API_VERSION)
+
+
 class test_xmlclient(PluginTester):
     """
     Test the `ipalib.rpc.xmlclient` plugin.
@@ -346,3 +388,234 @@ class test_xml_introspection(object):
                 "command 'system.methodHelp' takes at most 1 argument")
         else:
             raise AssertionError('did not raise')
+
+
+class FakeRPCClient(object):
+    def __init__(self, cache, servers):
+        self.cache = cache
+        self.servers = servers
+
+    def get_server_cache(self):
+        return self.cache
+
+    def discover_servers(self):
+        return self.servers
+
+
+class test_ServerCache(object):
+    """
+    Test the `ipalib.rpc.ServerCache` class.
+    """
+    def setup(self):
+        self.tmp = TempDir()
+        self.cache = rpc.ServerCache(self.tmp.join('servers.cache'))
+
+    def teardown(self):
+        self.tmp.rmtree()
+
+    def test_servers(self):
+        cache = self.cache
+        assert cache.get_servers(u'example.com') is None
+        cache.set_servers(u'example.com', [u'a.example.com'], 60)
+        assert cache.get_servers(u'example.com') == [u'a.example.com']
+        # the SRV records expired
+        cache.set_servers(u'example.com', [u'a.example.com'], 0)
+        assert cache.get_servers(u'example.com') is None
+
+    def test_rank(self):
+        cache = self.cache
+        urls = ['https://%s.example.com/ipa/json' % s for s in 'abcd']
+        assert cache.rank(urls) == urls
+        assert not any(cache.is_healthy(url) for url in urls)
+
+        cache.record_failure(urls[0])
+        cache.record_success(urls[1], 0.2)
+        cache.record_success(urls[3], 0.1)
+        # the session URL of a server shares its health
+        assert cache.is_healthy('https://d.example.com/ipa/session/json')
+        assert not cache.is_healthy(urls[0])
+        assert cache.rank(urls) == [urls[3], urls[1], urls[2], urls[0]]
+
+        cache.record_failure(urls[3])
+        assert not cache.is_healthy(urls[3])
+        assert cache.rank(urls) == [urls[1], urls[2], urls[0], urls[3]]
+
+    def test_has_failed(self):
+        cache = self.cache
+        url = 'https://a.example.com/ipa/json'
+        assert not cache.has_failed(url)
+        cache.record_failure(url)
+        assert cache.has_failed(url)
+        cache.failure_timeout = 0
+        assert not cache.has_failed(url)
+
+    def test_url_list(self):
+        cache = self.cache
+        urls = ['https://%s.example.com/ipa/json' % s for s in 'abc']
+        client = FakeRPCClient(cache, ['c.example.com', 'b.example.com'])
+        get_url_list = six.get_unbound_function(rpc.RPCClient.get_url_list)
+
+        # the configured server is tried first even if others are faster
+        cache.record_success(urls[1], 0.2)
+        cache.record_success(urls[2], 0.1)
+        assert get_url_list(client, urls[0]) == [urls[0], urls[2], urls[1]]
+
+        # unless it failed recently
+        cache.record_failure(urls[0])
+        assert get_url_list(client, urls[0]) == [urls[2], urls[1], urls[0]]
+
+    def test_save_load(self):
+        cache = self.cache
+        cache.set_servers(u'example.com', [u'a.example.com'], 60)
+        cache.record_success('https://a.example.com/ipa/json', 0.1)
+        assert cache.save()
+        assert not cache.modified
+
+        cache = rpc.ServerCache(cache.filename)
+        assert cache.load()
+        assert cache.get_servers(u'example.com') == [u'a.example.com']
+        assert cache.is_healthy('https://a.example.com/ipa/json')
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Answer every JSON-RPC request with an empty result.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        # headers and body are written separately, do not let Nagle's
+        # algorithm delay the body
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests += 1
+        if self.server.drop:
+            # close the connection without answering
+            self.close_connection = True
+            return
+        body = json.dumps(
+            dict(result=dict(summary=None), error=None, id=0)).encode('ascii')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    connections = 0
+    requests = 0
+    drop = False
+
+
+class HTTPKerbTransport(rpc.KerbTransport):
+    """
+    KerbTransport talking plain HTTP to the stand-in server.
+    """
+    def _create_connection(self, host, dbdir):
+        conn = httplib.HTTPConnection(host)
+        conn.connect()
+        return conn
+
+
+class test_KerbTransport_keepalive(object):
+    """
+    Test connection reuse of `ipalib.rpc.KerbTransport`.
+    """
+    @classmethod
+    def setup_class(cls):
+        cls.server = StandInServer(('127.0.0.1', 0), StandInHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+        cls.url = 'http://127.0.0.1:%d/ipa/session/json' % (
+            cls.server.server_address[1])
+        # skip the Kerberos negotiation
+        context.session_cookie = 'ipa_session=stand-in'
+
+    @classmethod
+    def teardown_class(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        rpc.connection_pool.clear()
+        del context.session_cookie
+
+    def setup(self):
+        rpc.connection_pool.clear()
+        self.server.connections = 0
+        self.server.requests = 0
+        self.server.drop = False
+        self.idle_timeout = rpc.connection_pool.idle_timeout
+
+    def teardown(self):
+        rpc.connection_pool.idle_timeout = self.idle_timeout
+
+    def proxy(self):
+        return rpc.JSONServerProxy(
+            self.url, HTTPKerbTransport(protocol='json'), 'UTF-8', 0, True)
+
+    def run(self, count):
+        proxy = self.proxy()
+        for i in range(count):
+            assert proxy.ping([], {}) == dict(summary=None)
+
+    def test_reuse(self):
+        self.run(10)
+        assert self.server.connections == 1
+
+        # a new proxy reuses the pooled connection as well
+        self.run(1)
+        assert self.server.connections == 1
+
+    def test_idle_expiry(self):
+        rpc.connection_pool.idle_timeout = 0
+        self.run(3)
+        assert self.server.connections == 3
+
+    def test_send_failed(self):
+        self.run(1)
+        # sending over the pooled connection fails, the request is sent
+        # again over a new connection
+        for (timestamp, conn) in list(rpc.connection_pool._idle.values())[0]:
+            conn.sock.shutdown(socket.SHUT_RDWR)
+        self.run(1)
+        assert self.server.connections == 2
+        assert self.server.requests == 2
+
+    def test_closed_by_server(self):
+        self.run(1)
+        # the server closes the connection after reading the request, the
+        # request must not be sent again
+        self.server.drop = True
+        raises(httplib.BadStatusLine, self.run, 1)
+        assert self.server.requests == 2
+        assert self.server.connections == 1
+
+        # the closed connection is not reused
+        self.server.drop = False
+        self.run(1)
+        assert self.server.connections == 2
+
+    def test_connect(self):
+        transport = HTTPKerbTransport(protocol='json')
+        transport.connect(self.url.split('/')[2])
+        # the request is sent over the connection opened before
+        proxy = rpc.JSONServerProxy(self.url, transport, 'UTF-8', 0, True)
+        assert proxy.ping([], {}) == dict(summary=None)
+        assert self.server.connections == 1
+
+        # nothing listens on the port of a closed server
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        transport = HTTPKerbTransport(protocol='json')
+        raises(socket.error, transport.connect, '127.0.0.1:%d' % port)
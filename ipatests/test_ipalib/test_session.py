@@ -0,0 +1,204 @@
+#
+# Copyright (C) 2016  FreeIPA Contributors see COPYING for license
+#
+
+"""
+Test the `ipalib.session` module.
+"""
+import os
+import time
+
+import nose
+import pytest
+
+from ipatests.util import TempDir
+from ipalib import session
+
+pytestmark = pytest.mark.tier0
+
+# not a valid ccache, the session code does not parse it
+CCACHE_DATA = b'\x05\x04' + os.urandom(4096)
+
+
+def memfd_supported():
+    fd = session._memfd_create('test')
+    if fd is None:
+        return False
+    os.close(fd)
+    return True
+
+
+class test_ccache(object):
+    """
+    Test binding the session ccache to the request.
+    """
+    def setup(self):
+        self.tmp = TempDir()
+        self.krbccache_dir = session.krbccache_dir
+        session.krbccache_dir = self.tmp.path
+
+    def teardown(self):
+        session.krbccache_dir = self.krbccache_dir
+        self.tmp.rmtree()
+
+    def bind_load_release(self, memfd):
+        ccache_name = session.bind_ipa_ccache(CCACHE_DATA, memfd=memfd)
+        assert os.environ['KRB5CCNAME'] == ccache_name
+        ccache_data = session.load_ccache_data(ccache_name)
+        session.release_ipa_ccache(ccache_name)
+        assert 'KRB5CCNAME' not in os.environ
+        assert ccache_data == CCACHE_DATA
+        return ccache_name
+
+    def test_file(self):
+        ccache_name = self.bind_load_release(False)
+        assert ccache_name.startswith('FILE:%s/' % self.tmp.path)
+        assert os.listdir(self.tmp.path) == []
+
+    def test_memfd(self):
+        if not memfd_supported():
+            raise nose.SkipTest('memfd_create(2) not supported')
+        ccache_name = self.bind_load_release(True)
+        assert ccache_name.startswith('FILE:/proc/self/fd/')
+        assert os.listdir(self.tmp.path) == []
+        assert not os.path.exists(ccache_name[len('FILE:'):])
+
+    def test_memfd_update(self):
+        """
+        The ccache data changed by libkrb5 during the request is loaded back.
+        """
+        if not memfd_supported():
+            raise nose.SkipTest('memfd_create(2) not supported')
+        ccache_name = session.bind_ipa_ccache(CCACHE_DATA)
+        try:
+            with open(ccache_name[len('FILE:'):], 'ab') as f:
+                f.write(b'new credentials')
+            assert session.load_ccache_data(ccache_name) == (
+                CCACHE_DATA + b'new credentials')
+        finally:
+            session.release_ipa_ccache(ccache_name)
+
+
+class FakeMemcache(object):
+    """
+    Stand-in for `memcache.Client` which counts the writes.
+    """
+    def __init__(self):
+        self.items = {}
+        self.sets = 0
+        self.touches = 0
+
+    def get(self, key):
+        item = self.items.get(key)
+        if item is None:
+            return None
+        return dict(item[0])
+
+    def set(self, key, value, time=0):
+        self.sets += 1
+        self.items[key] = (dict(value), time)
+        return True
+
+    def touch(self, key, time=0):
+        self.touches += 1
+        if key not in self.items:
+            return False
+        self.items[key] = (self.items[key][0], time)
+        return True
+
+    def delete(self, key):
+        self.items.pop(key, None)
+        return 1
+
+
+class test_store_session_data(object):
+    """
+    Test that storing unmodified session data is coalesced.
+    """
+    def setup(self):
+        self.mgr = session.MemcacheSessionManager()
+        self.mgr.mc = FakeMemcache()
+        self.mgr.expiration_granularity = 60
+
+    def request(self, session_id, expiration, **items):
+        session_data = self.mgr.get_session_data(session_id)
+        session_data.update(items)
+        session_data['session_expiration_timestamp'] = expiration
+        self.mgr.store_session_data(session_data)
+
+    def new_session(self, expiration):
+        session_data = self.mgr.new_session_data(self.mgr.new_session_id())
+        session_data['session_expiration_timestamp'] = expiration
+        self.mgr.store_session_data(session_data)
+        return session_data['session_id']
+
+    def expiration(self, session_id):
+        return self.mgr.mc.items[self.mgr.session_key(session_id)][1]
+
+    def test_new_session(self):
+        now = time.time()
+        session_id = self.new_session(now + 1200)
+        assert self.mgr.mc.sets == 1
+        assert self.expiration(session_id) == now + 1200
+
+    def test_modified(self):
+        now = time.time()
+        session_id = self.new_session(now + 1200)
+        self.request(session_id, now + 1201, ccache_data=CCACHE_DATA)
+        assert self.mgr.mc.sets == 2
+        assert self.mgr.mc.touches == 0
+        assert self.mgr.get_session_data(session_id)['ccache_data'] == (
+            CCACHE_DATA)
+
+    def test_within_granularity(self):
+        now = time.time()
+        session_id = self.new_session(now + 1200)
+        for i in range(10):
+            self.request(session_id, now + 1201 + i)
+        assert self.mgr.mc.sets == 1
+        assert self.mgr.mc.touches == 0
+        assert self.expiration(session_id) == now + 1200
+
+    def test_touch(self):
+        now = time.time()
+        session_id = self.new_session(now + 1200)
+        self.request(session_id, now + 1300)
+        assert self.mgr.mc.sets == 1
+        assert self.mgr.mc.touches == 1
+        assert self.expiration(session_id) == now + 1300
+
+        # measured from the last touch, not from the stored data
+        self.request(session_id, now + 1330)
+        assert self.mgr.mc.touches == 1
+        self.request(session_id, now + 1400)
+        assert self.mgr.mc.touches == 2
+        assert self.expiration(session_id) == now + 1400
+
+    def test_earlier(self):
+        """
+        An expiration moved earlier is always written.
+        """
+        now = time.time()
+        session_id = self.new_session(now + 1200)
+        self.request(session_id, now + 1190)
+        assert self.mgr.mc.touches == 1
+        assert self.expiration(session_id) == now + 1190
+
+    def test_no_touch(self):
+        """
+        The whole session is written if touch is not available.
+        """
+        now = time.time()
+        session_id = self.new_session(now + 1200)
+        self.mgr.mc.touch = lambda key, time=0: False
+        self.request(session_id, now + 1300)
+        assert self.mgr.mc.sets == 2
+        assert self.expiration(session_id) == now + 1300
+
+    def test_delete(self):
+        now = time.time()
+        session_id = self.new_session(now + 1200)
+        self.request(session_id, now + 1300)
+        self.mgr.delete_session_data(session_id)
+        assert self.mgr.get_session_data(session_id) is None
+        assert self.mgr.session_key(session_id) not in self.mgr.touched
@@ -1165,6 +1165,20 @@ class TestDN(unittest.TestCase):
         self.assertFalse(dn3_a in s)
         self.assertFalse(dn3_b in s)
 
+    def test_hashing_derived(self):
+        # DNs derived from a DN whose hash was already computed must
+        # compute their own normalized form
+        dn = DN('t=0,t=1,T=2,t=3')
+        hash(dn)
+
+        self.assertEqual(dn[1:], DN('t=1,t=2,t=3'))
+        self.assertEqual(hash(dn[1:]), hash(DN('T=1,T=2,T=3')))
+        self.assertEqual(hash(dn + DN('t=4')), hash(DN('t=0,t=1,t=2,t=3,t=4')))
+        self.assertTrue(dn.endswith(DN('t=2,T=3')))
+        self.assertTrue(dn.startswith(DN('T=0')))
+        self.assertFalse(dn.endswith(DN('t=1,t=3')))
+        self.assertTrue(DN('t=0,t=1,t=2') < dn)
+
 
 class TestEscapes(unittest.TestCase):
     def setUp(self):
@@ -0,0 +1,210 @@
+#
+# Copyright (C) 2016  FreeIPA Contributors see COPYING for license
+#
+
+"""
+Test the `ipapython.dogtag` module.
+"""
+
+import socket
+
+import pytest
+
+from ipalib.errors import NetworkError
+from ipapython import dogtag
+from ipapython.nsslib import ConnectionPool
+
+pytestmark = pytest.mark.tier0
+
+
+class FakeMessage(object):
+    def __init__(self):
+        self.dict = {'content-type': 'application/xml'}
+
+
+class FakeResponse(object):
+    def __init__(self, will_close):
+        self.status = 200
+        self.msg = FakeMessage()
+        self.will_close = will_close
+
+    def read(self):
+        return '<XMLResponse/>'
+
+
+class FakeConnection(object):
+    """
+    Stand-in for `ipapython.nsslib.NSSConnection`.
+    """
+    def __init__(self, server):
+        self.server = server
+        self.closed = False
+        self.requests = 0
+
+    def request(self, method, uri, body=None, headers=None):
+        if self.closed or self in self.server.dropped:
+            raise socket.error('connection reset by peer')
+        self.requests += 1
+
+    def getresponse(self):
+        if self in self.server.lost:
+            raise socket.error('connection reset by peer')
+        return FakeResponse(self.server.will_close)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeServer(object):
+    def __init__(self):
+        self.connections = []
+        self.dropped = set()
+        self.lost = set()
+        self.will_close = False
+
+    def connect(self, host, port):
+        conn = FakeConnection(self)
+        self.connections.append(conn)
+        return conn
+
+
+class test_https_request_pool(object):
+    """
+    Test reuse of the connections to the CA.
+    """
+    def setup(self):
+        self.server = FakeServer()
+        self.pool = ConnectionPool(idle_timeout=60)
+        self.stats = dogtag.RequestStats()
+
+    def request(self):
+        return dogtag._httplib_request(
+            'https', 'ca.example.test', 8443, '/ca/agent/ca/displayBySerial',
+            self.server.connect, 'serialNumber=1',
+            connection_pool=self.pool, pool_key=('ca.example.test', 8443),
+            stats=self.stats)
+
+    def test_reuse(self):
+        for i in range(10):
+            assert self.request()[0] == 200
+        assert len(self.server.connections) == 1
+        assert self.server.connections[0].requests == 10
+        stats = self.stats.as_dict()
+        assert stats['requests'] == 10
+        assert stats['connections'] == 1
+        assert stats['reused'] == 9
+        assert stats['failures'] == 0
+
+    def test_closed_by_server(self):
+        self.server.will_close = True
+        self.request()
+        self.request()
+        assert len(self.server.connections) == 2
+        assert all(conn.closed for conn in self.server.connections)
+
+    def test_reconnect(self):
+        self.request()
+        self.server.dropped.add(self.server.connections[0])
+        assert self.request()[0] == 200
+        assert len(self.server.connections) == 2
+        assert self.server.connections[0].closed
+        stats = self.stats.as_dict()
+        assert stats['retries'] == 1
+        assert stats['failures'] == 0
+
+    def test_no_resend(self):
+        """
+        A request which reached the server is not sent again.
+        """
+        self.request()
+        self.server.lost.add(self.server.connections[0])
+        with pytest.raises(NetworkError) as excinfo:
+            self.request()
+        assert excinfo.value.request_sent
+        assert len(self.server.connections) == 1
+        assert self.server.connections[0].requests == 2
+        assert self.server.connections[0].closed
+        stats = self.stats.as_dict()
+        assert stats['failures'] == 1
+        assert stats['retries'] == 0
+
+    def test_failure(self):
+        """
+        A request which fails on a new connection is not retried.
+        """
+        connect = self.server.connect
+
+        def connect_dropped(host, port):
+            conn = connect(host, port)
+            self.server.dropped.add(conn)
+            return conn
+        self.server.connect = connect_dropped
+        with pytest.raises(NetworkError) as excinfo:
+            self.request()
+        # another CA can be asked
+        assert not excinfo.value.request_sent
+        assert len(self.server.connections) == 1
+        stats = self.stats.as_dict()
+        assert stats['failures'] == 1
+        assert stats['retries'] == 0
+
+
+class test_MasterSelector(object):
+    """
+    Test the selection of the CA master.
+    """
+    def setup(self):
+        self.selector = dogtag.MasterSelector()
+        self.lookups = 0
+
+    def find_masters(self):
+        self.lookups += 1
+        return ['ca1.example.test', 'ca2.example.test', 'local.example.test']
+
+    def get_hosts(self):
+        return self.selector.get_hosts(
+            self.find_masters, preferred=('local.example.test',),
+            default='default.example.test')
+
+    def test_cache(self):
+        self.get_hosts()
+        self.get_hosts()
+        assert self.lookups == 1
+        self.selector._expires = 0
+        self.get_hosts()
+        assert self.lookups == 2
+
+    def test_no_masters(self):
+        hosts = self.selector.get_hosts(
+            lambda: [], default='default.example.test')
+        assert hosts == ['default.example.test']
+        assert self.selector._expires == 0
+
+    def test_order(self):
+        assert self.get_hosts()[0] == 'local.example.test'
+
+        self.selector.record_success('ca1.example.test', 0.5)
+        self.selector.record_success('ca2.example.test', 0.1)
+        assert self.get_hosts() == [
+            'local.example.test', 'ca2.example.test', 'ca1.example.test']
+
+        # the average response time moves towards the new measurements
+        for i in range(10):
+            self.selector.record_success('ca2.example.test', 1.0)
+        assert self.get_hosts() == [
+            'local.example.test', 'ca1.example.test', 'ca2.example.test']
+
+    def test_unmeasured(self):
+        self.selector.record_success('ca2.example.test', 0.5)
+        for i in range(10):
+            # masters without a response time come after the measured ones
+            assert self.get_hosts() == [
+                'local.example.test', 'ca2.example.test', 'ca1.example.test']
+
+    def test_failover(self):
+        self.selector.record_failure('local.example.test')
+        hosts = self.get_hosts()
+        assert hosts[-1] == 'local.example.test'
+
+        self.selector.record_success('local.example.test', 0.1)
+        assert self.get_hosts()[0] == 'local.example.test'
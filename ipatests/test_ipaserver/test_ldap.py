@@ -26,21 +26,28 @@
 # The DM password needs to be set in ~/.ipa/.dmpw
 
 import os
+import re
 import sys
+import time
 
+import ldap.schema
+from ldap.controls import SimplePagedResultsControl
 import pytest
 import nose
 from nose.tools import assert_raises  # pylint: disable=E0611
 import nss.nss as nss
 import six
 
-from ipaserver.plugins.ldap2 import ldap2
+from ipaserver.plugins.ldap2 import (
+    ldap2, LDAPConnectionPool, _PooledConnection)
+from ipapython.ipaldap import LDAPClient, SchemaCache, MatchedValuesControl
 from ipalib.plugins.service import service, service_show
 from ipalib.plugins.host import host
 from ipalib import api, x509, create_api, errors
 from ipapython import ipautil
 from ipaplatform.paths import paths
 from ipapython.dn import DN
+from ipatests.util import TempDir
 
 if six.PY3:
     unicode = str
@@ -321,3 +328,449 @@ class test_LDAPEntry(object):
 
         e.raw['test'].append('second')
         assert e['test'] == ['not list', u'second']
+
+    def test_decode_entries(self):
+        e = self.conn.make_entry(self.dn1)
+        e.raw['cn'] = [b'test1']
+        raw = e.raw['memberOf'] = [b'cn=g1,dc=example', b'cn=g2,dc=example']
+        self.conn.decode_entries([e])
+        assert e['cn'] == self.cn1
+        assert e['memberof'] == [DN('cn=g1,dc=example'),
+                                 DN('cn=g2,dc=example')]
+        assert e.raw['memberOf'] is raw
+
+        raw.append(b'cn=g3,dc=example')
+        assert e['memberof'][-1] == DN('cn=g3,dc=example')
+
+
+class FakeLDAPObject(object):
+    def __init__(self, alive=True):
+        self.unbound = False
+        self.alive = alive
+
+    def unbind_s(self):
+        self.unbound = True
+
+    def whoami_s(self):
+        if not self.alive:
+            raise ldap.SERVER_DOWN()
+        return u'dn: uid=admin'
+
+
+@pytest.mark.tier0
+class test_LDAPConnectionPool(object):
+    """
+    Test the LDAPConnectionPool class
+    """
+
+    def setup(self):
+        self.pool = LDAPConnectionPool(max_size=2, idle_timeout=60)
+
+    def make_conn(self, lifetime=3600):
+        return _PooledConnection(FakeLDAPObject(), time.time() + lifetime)
+
+    def test_reuse(self):
+        pooled = self.make_conn()
+        assert self.pool.get(u'admin@EXAMPLE.COM') is None
+        self.pool.put(u'admin@EXAMPLE.COM', pooled)
+        assert self.pool.get(u'admin@EXAMPLE.COM') is pooled
+        assert self.pool.get(u'admin@EXAMPLE.COM') is None
+        stats = self.pool.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 2
+        assert not pooled.conn.unbound
+
+    def test_keyed_by_principal(self):
+        self.pool.put(u'admin@EXAMPLE.COM', self.make_conn())
+        assert self.pool.get(u'user@EXAMPLE.COM') is None
+        assert len(self.pool) == 1
+
+    def test_expired_credentials(self):
+        pooled = self.make_conn(lifetime=-1)
+        self.pool.put(u'admin@EXAMPLE.COM', pooled)
+        assert pooled.conn.unbound
+        assert self.pool.get(u'admin@EXAMPLE.COM') is None
+
+    def test_idle_timeout(self):
+        pooled = self.make_conn()
+        self.pool.put(u'admin@EXAMPLE.COM', pooled)
+        pooled.last_used -= 61
+        assert self.pool.get(u'admin@EXAMPLE.COM') is None
+        assert pooled.conn.unbound
+
+    def test_max_size(self):
+        first = self.make_conn()
+        self.pool.put(u'a@EXAMPLE.COM', first)
+        first.last_used -= 10
+        self.pool.put(u'b@EXAMPLE.COM', self.make_conn())
+        self.pool.put(u'c@EXAMPLE.COM', self.make_conn())
+        assert len(self.pool) == 2
+        assert first.conn.unbound
+        assert self.pool.stats()['evictions'] == 1
+
+    def test_closed_by_server(self):
+        alive = self.make_conn()
+        dead = self.make_conn()
+        dead.conn.alive = False
+        self.pool.put(u'admin@EXAMPLE.COM', alive)
+        self.pool.put(u'admin@EXAMPLE.COM', dead)
+        pooled = self.pool.get(u'admin@EXAMPLE.COM', check=ldap2._is_alive)
+        assert pooled is alive
+        assert dead.conn.unbound
+        assert self.pool.get(
+            u'admin@EXAMPLE.COM', check=ldap2._is_alive) is None
+        stats = self.pool.stats()
+        assert stats['hits'] == 1
+        assert stats['evictions'] == 1
+
+    def test_disabled(self):
+        pool = LDAPConnectionPool(max_size=0)
+        pooled = self.make_conn()
+        pool.put(u'admin@EXAMPLE.COM', pooled)
+        assert pooled.conn.unbound
+        assert len(pool) == 0
+
+
+class FakeSchemaConnection(object):
+    def __init__(self):
+        self.searches = []
+        self.timestamp = '20160101000000Z'
+        self.attributetypes = ["( 2.5.4.3 NAME 'cn' SUP name )"]
+
+    def search_s(self, base, scope, attrlist=None):
+        self.searches.append(attrlist)
+        attrs = {'modifyTimestamp': [self.timestamp]}
+        if 'attributetypes' in attrlist:
+            attrs['attributeTypes'] = self.attributetypes
+            attrs['objectClasses'] = [
+                "( 2.5.6.0 NAME 'top' ABSTRACT MUST objectClass )"]
+        return [(base, attrs)]
+
+
+@pytest.mark.tier0
+class test_SchemaCache(object):
+    """
+    Test the SchemaCache class
+    """
+
+    url = 'ldap://ipa.example.com'
+
+    def setup(self):
+        self.tmpdir = TempDir()
+        self.conn = FakeSchemaConnection()
+
+    def teardown(self):
+        self.tmpdir.rmtree()
+
+    def test_check_interval(self):
+        cache = SchemaCache(check_interval=60)
+        schema = cache.get_schema(self.url, self.conn)
+        assert cache.get_schema(self.url, self.conn) is schema
+        assert len(self.conn.searches) == 1
+
+    def test_unmodified(self):
+        cache = SchemaCache(check_interval=0)
+        schema = cache.get_schema(self.url, self.conn)
+        assert cache.get_schema(self.url, self.conn) is schema
+        assert self.conn.searches[1] == ['modifyTimestamp']
+
+    def test_refresh(self):
+        cache = SchemaCache(check_interval=0)
+        schema = cache.get_schema(self.url, self.conn)
+        self.conn.timestamp = '20160102000000Z'
+        self.conn.attributetypes = self.conn.attributetypes + [
+            "( 2.5.4.4 NAME 'sn' SUP name )"]
+
+        # the old schema is returned while the new one is being parsed
+        assert cache.get_schema(self.url, self.conn) is schema
+        for i in range(50):
+            if cache.servers[self.url].schema is not schema:
+                break
+            time.sleep(0.1)
+        new_schema = cache.get_schema(self.url, self.conn)
+        assert new_schema is not schema
+        assert new_schema.get_obj(ldap.schema.AttributeType, 'sn')
+
+    def test_cache_dir(self):
+        cache = SchemaCache(cache_dir=self.tmpdir.path)
+        cache.get_schema(self.url, self.conn)
+        assert len(os.listdir(self.tmpdir.path)) == 1
+
+        self.conn.searches = []
+        cache = SchemaCache(cache_dir=self.tmpdir.path)
+        schema = cache.get_schema(self.url, self.conn)
+        assert self.conn.searches == [['modifyTimestamp']]
+        assert schema.get_obj(ldap.schema.AttributeType, 'cn')
+
+        # a modified schema is not loaded from the file
+        self.conn.searches = []
+        self.conn.timestamp = '20160102000000Z'
+        cache = SchemaCache(cache_dir=self.tmpdir.path)
+        cache.get_schema(self.url, self.conn)
+        assert len(self.conn.searches) == 2
+
+
+class FakeSearchConnection(object):
+    """
+    Serves a paged search like `ldap.ldapobject.LDAPObject`.
+    """
+    def __init__(self, count):
+        self.entries = [('uid=user%d,dc=example' % i, {'uid': [b'user']})
+                        for i in range(count)]
+        self.searches = []
+        self.abandoned = []
+        self.cancelled = 0
+        self.results = {}
+        self.controls = []
+
+    def search_ext(self, base, scope, filter, attrs_list, serverctrls=None,
+                   timeout=-1, sizelimit=0):
+        start, size = 0, len(self.entries)
+        paged = False
+        for ctrl in serverctrls or []:
+            if isinstance(ctrl, SimplePagedResultsControl):
+                start, size = int(ctrl.cookie or 0), ctrl.size
+                paged = True
+            else:
+                self.controls.append(ctrl)
+        self.searches.append((start, size))
+        cookie = ''
+        if start + size < len(self.entries):
+            cookie = str(start + size)
+        msgid = len(self.searches)
+        self.results[msgid] = (
+            self.entries[start:start + size], cookie, paged)
+        return msgid
+
+    def result3(self, msgid, all=1):
+        page, cookie, paged = self.results[msgid]
+        if page:
+            return ldap.RES_SEARCH_ENTRY, [page.pop(0)], msgid, []
+        ctrls = []
+        if paged:
+            ctrls.append(SimplePagedResultsControl(0, 0, cookie))
+        return ldap.RES_SEARCH_RESULT, [], msgid, ctrls
+
+    def search_ext_s(self, base, scope, filter, attrs_list, serverctrls=None,
+                     timeout=-1, sizelimit=0):
+        self.cancelled += 1
+        return []
+
+    def abandon(self, msgid):
+        self.abandoned.append(msgid)
+
+
+@pytest.mark.tier0
+class test_iter_entries(object):
+    """
+    Test iterating over the entries of a search
+    """
+
+    def setup(self):
+        self.client = LDAPClient('ldap://ipa.example.com', no_schema=True)
+        self.client._conn = FakeSearchConnection(5)
+
+    def test_paged(self):
+        entries = self.client.iter_entries(
+            base_dn=DN('dc=example'), paged_search=True, page_size=2)
+        assert [e.dn for e in entries] == [
+            DN('uid=user%d,dc=example' % i) for i in range(5)]
+        assert self.client.conn.searches == [(0, 2), (2, 2), (4, 2)]
+
+    def test_stop(self):
+        entries = self.client.iter_entries(
+            base_dn=DN('dc=example'), paged_search=True, page_size=2)
+        for i in range(3):
+            next(entries)
+        entries.close()
+        assert self.client.conn.abandoned == [2]
+        assert self.client.conn.cancelled == 1
+
+    def test_find_entries(self):
+        entries, truncated = self.client.find_entries(
+            base_dn=DN('dc=example'), paged_search=True)
+        assert len(entries) == 5
+        assert not truncated
+        assert self.client.conn.searches == [(0, 1999)]
+
+    def test_serverctrls(self):
+        ctrl = MatchedValuesControl([('member', DN('uid=user0,dc=example'))])
+        entries = self.client.iter_entries(
+            base_dn=DN('dc=example'), paged_search=True, page_size=2,
+            serverctrls=[ctrl])
+        assert len(list(entries)) == 5
+        # sent with every page
+        assert self.client.conn.controls == [ctrl] * 3
+
+    def test_empty(self):
+        self.client._conn = FakeSearchConnection(0)
+        entries = self.client.iter_entries(base_dn=DN('dc=example'))
+        assert list(entries) == []
+        with pytest.raises(errors.EmptyResult):
+            self.client.find_entries(base_dn=DN('dc=example'))
+
+
+@pytest.mark.tier0
+def test_matched_values_control():
+    ctrl = MatchedValuesControl([('member', DN('cn=a')), ('memberuser', 'b')])
+    assert ctrl.controlType == '1.2.826.0.1.3344810.2.3'
+    assert not ctrl.criticality
+    assert ctrl.encodeControlValue() == (
+        b'\x30\x21'
+        b'\xa3\x0e\x04\x06member\x04\x04cn=a'
+        b'\xa3\x0f\x04\x0amemberuser\x04\x01b')
+
+    long_value = 'x' * 200
+    value = MatchedValuesControl([('cn', long_value)]).encodeControlValue()
+    assert value[:3] == b'\x30\x81\xd2'
+    assert value[3:7] == b'\xa3\x81\xcf\x04'
+
+
+class FakeGroupConnection(object):
+    """
+    Serves one-level RDN searches and modifications of the member attribute
+    of a single group like `ldap.ldapobject.LDAPObject`.
+    """
+    def __init__(self, dns, members):
+        self.dns = [DN(dn) for dn in dns]
+        self.members = [DN(dn) for dn in members]
+        self.searches = []
+        self.modifications = []
+        self.results = {}
+
+    def search_ext(self, base, scope, filter, attrs_list, serverctrls=None,
+                   timeout=-1, sizelimit=0):
+        if isinstance(filter, bytes):
+            filter = filter.decode('utf-8')
+        self.searches.append((DN(base), scope))
+        rdns = set((attr.lower(), value.lower()) for attr, value in
+                   re.findall(r'\((\w+)=([^()]+)\)', filter))
+        found = [(str(dn), {}) for dn in self.dns
+                 if dn[1:] == DN(base) and
+                 (dn[0].attr.lower(), dn[0].value.lower()) in rdns]
+        msgid = len(self.searches)
+        self.results[msgid] = (found, bool(serverctrls))
+        return msgid
+
+    def result3(self, msgid, all=1):
+        found, paged = self.results[msgid]
+        if found:
+            return ldap.RES_SEARCH_ENTRY, [found.pop(0)], msgid, []
+        ctrls = []
+        if paged:
+            ctrls.append(SimplePagedResultsControl(0, 0, ''))
+        return ldap.RES_SEARCH_RESULT, [], msgid, ctrls
+
+    def modify_s(self, dn, modlist):
+        members = list(self.members)
+        for op, attr, values in modlist:
+            for value in values:
+                if isinstance(value, bytes):
+                    value = value.decode('utf-8')
+                value = DN(value)
+                if op == ldap.MOD_ADD:
+                    if value in members:
+                        raise ldap.TYPE_OR_VALUE_EXISTS(
+                            {'desc': 'Type or value exists'})
+                    members.append(value)
+                else:
+                    if value not in members:
+                        raise ldap.NO_SUCH_ATTRIBUTE(
+                            {'desc': 'No such attribute'})
+                    members.remove(value)
+        self.modifications.append(modlist)
+        self.members = members
+
+
+class FakeEnv(object):
+    ldap_uri = 'ldap://ipa.example.com'
+    context = 'cli'
+    ldap_pool_size = 0
+    ldap_pool_idle_timeout = 60
+
+
+class FakeAPI(object):
+    env = FakeEnv()
+
+
+class FakeGroupLDAP(ldap2):
+    conn = None
+
+
+@pytest.mark.tier0
+class test_group_members(object):
+    """
+    Test adding and removing several members of a group at once
+    """
+    group_dn = DN('cn=g1,cn=groups,dc=example')
+
+    def user_dn(self, name):
+        return DN(('uid', name), ('cn', 'users'), ('dc', 'example'))
+
+    def setup(self):
+        self.ldap = FakeGroupLDAP(FakeAPI())
+        # do not read the limits from the IPA configuration
+        self.ldap.time_limit = 10
+        self.ldap.size_limit = 0
+        self.ldap.conn = FakeGroupConnection(
+            [self.user_dn(u'u%d' % i) for i in range(4)] +
+            [DN('cn=g2,cn=groups,dc=example')],
+            [self.user_dn(u'u0')])
+
+    def check_failed(self, failed, expected):
+        assert [(dn, type(e)) for dn, e in failed] == expected
+
+    def test_add_new(self):
+        dns = [self.user_dn(u'u1'), self.user_dn(u'u2'),
+               DN('cn=g2,cn=groups,dc=example')]
+        failed = self.ldap.add_entries_to_group(dns, self.group_dn)
+        assert failed == []
+        conn = self.ldap.conn
+        # one search per parent entry and a single modification
+        assert sorted(base for base, scope in conn.searches) == [
+            DN('cn=groups,dc=example'), DN('cn=users,dc=example')]
+        assert len(conn.modifications) == 1
+        assert conn.members == [self.user_dn(u'u0')] + dns
+
+    def test_add_present(self):
+        failed = self.ldap.add_entries_to_group(
+            [self.user_dn(u'u0')], self.group_dn)
+        self.check_failed(failed, [
+            (self.user_dn(u'u0'), errors.AlreadyGroupMember)])
+        assert self.ldap.conn.modifications == []
+
+    def test_add_missing(self):
+        failed = self.ldap.add_entries_to_group(
+            [self.user_dn(u'missing'), self.group_dn], self.group_dn)
+        self.check_failed(failed, [
+            (self.user_dn(u'missing'), errors.NotFound),
+            (self.group_dn, errors.NotFound)])
+        assert self.ldap.conn.modifications == []
+
+    def test_add_mixed(self):
+        dns = [self.user_dn(u'missing'), self.user_dn(u'u0'),
+               DN('UID=U1,CN=users,dc=example'), self.user_dn(u'u2')]
+        failed = self.ldap.add_entries_to_group(dns, self.group_dn)
+        self.check_failed(failed, [
+            (self.user_dn(u'missing'), errors.NotFound),
+            (self.user_dn(u'u0'), errors.AlreadyGroupMember)])
+        # the members are added under the DN stored on the server
+        assert self.ldap.conn.members == [
+            self.user_dn(u'u0'), self.user_dn(u'u1'), self.user_dn(u'u2')]
+
+    def test_remove(self):
+        self.ldap.conn.members.append(self.user_dn(u'u1'))
+        failed = self.ldap.remove_entries_from_group(
+            [self.user_dn(u'u0'), self.user_dn(u'u1')], self.group_dn)
+        assert failed == []
+        assert len(self.ldap.conn.modifications) == 1
+        assert self.ldap.conn.members == []
+
+    def test_remove_mixed(self):
+        failed = self.ldap.remove_entries_from_group(
+            [self.user_dn(u'u2'), self.user_dn(u'u0'),
+             self.user_dn(u'missing')], self.group_dn)
+        self.check_failed(failed, [
+            (self.user_dn(u'u2'), errors.NotGroupMember),
+            (self.user_dn(u'missing'), errors.NotGroupMember)])
+        assert self.ldap.conn.members == []
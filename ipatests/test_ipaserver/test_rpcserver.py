@@ -21,13 +21,19 @@
 Test the `ipaserver.rpc` module.
 """
 
+import contextlib
+import io
 import json
+import logging
+import os
+import zlib
+
 import pytest
 
 import six
 
 from ipatests.util import assert_equal, raises, PluginTester
-from ipalib import errors
+from ipalib import errors, Command, Flag, Str
 from ipaserver import rpcserver
 
 if six.PY3:
@@ -133,6 +139,31 @@ def test_params_2_args_options():
     assert f([args, options]) == (args, options)
 
 
+def test_accepts_encoding():
+    """
+    Test the `ipaserver.rpcserver.accepts_encoding` function.
+    """
+    f = rpcserver.accepts_encoding
+    assert not f({}, 'gzip')
+    assert f(dict(HTTP_ACCEPT_ENCODING='gzip'), 'gzip')
+    assert f(dict(HTTP_ACCEPT_ENCODING='deflate, GZip;q=0.5'), 'gzip')
+    assert f(dict(HTTP_ACCEPT_ENCODING='*'), 'gzip')
+    assert not f(dict(HTTP_ACCEPT_ENCODING='deflate'), 'gzip')
+    assert not f(dict(HTTP_ACCEPT_ENCODING='gzip;q=0'), 'gzip')
+
+
+def test_etag_matches():
+    """
+    Test the `ipaserver.rpcserver.etag_matches` function.
+    """
+    f = rpcserver.etag_matches
+    assert not f({}, '"a"')
+    assert f(dict(HTTP_IF_NONE_MATCH='"a"'), '"a"')
+    assert f(dict(HTTP_IF_NONE_MATCH='"b", W/"a"'), '"a"')
+    assert f(dict(HTTP_IF_NONE_MATCH='*'), '"a"')
+    assert not f(dict(HTTP_IF_NONE_MATCH='"b"'), '"a"')
+
+
 class test_session(object):
     klass = rpcserver.wsgi_dispatch
 
@@ -197,6 +228,33 @@ class test_xmlserver(PluginTester):
         (o, api, home) = self.instance('Backend', in_server=True)
 
 
+class etag_example(Command):
+    """
+    Command with an entity tag, recording its executions.
+    """
+    calls = []
+
+    def get_etag(self, *args, **options):
+        return '"example"'
+
+    def execute(self, **options):
+        self.calls.append(options)
+        return dict(result=u'example')
+
+
+class audit_example(Command):
+    """
+    Command with an option with a default value.
+    """
+    takes_options = (
+        Flag('all'),
+        Str('description?'),
+    )
+
+    def execute(self, **options):
+        return dict(result=u'example')
+
+
 class test_jsonserver(PluginTester):
     """
     Test the `ipaserver.rpcserver.jsonserver` plugin.
@@ -257,3 +315,133 @@ class test_jsonserver(PluginTester):
         options = dict(givenname=u'John', sn='Doe')
         d = dict(method=u'user_add', params=(args, options), id=18)
         assert o.unmarshal(json.dumps(d)) == (u'user_add', args, options, 18)
+
+    def test_encode_response(self):
+        """
+        Test the `ipaserver.rpcserver.jsonserver.encode_response` method.
+        """
+        (o, api, home) = self.instance('Backend', in_server=True)
+        response = json.dumps(dict(result=[u'x' * 100] * 100, error=None))
+
+        # Test with a client which accepts gzip:
+        headers = []
+        data = o.encode_response(
+            dict(HTTP_ACCEPT_ENCODING='gzip'), response, headers)
+        assert ('Content-Encoding', 'gzip') in headers
+        assert zlib.decompress(data, 16 + zlib.MAX_WBITS) == response.encode(
+            'utf-8')
+
+        # Test with a client which does not:
+        headers = []
+        data = o.encode_response({}, response, headers)
+        assert dict(headers).get('Content-Encoding') is None
+        assert data == response.encode('utf-8')
+
+        # Test pretty-printing:
+        headers = []
+        data = o.encode_response(
+            dict(HTTP_X_IPA_PRETTY_PRINT='true'), response, headers)
+        assert data == json.dumps(
+            json.loads(response), sort_keys=True, indent=4).encode('utf-8')
+
+    def test_not_modified(self):
+        """
+        Test answering conditional requests for a command with an entity tag.
+        """
+        (o, api, home) = self.instance('Backend', etag_example, in_server=True)
+        etag_example.calls = []
+
+        def request(**environ):
+            return self.request(o, 'etag_example', **environ)
+
+        with self.lang():
+            status, headers, body = request()
+            assert status == rpcserver.HTTP_STATUS_SUCCESS
+            assert headers['ETag'] == '"example"'
+            assert headers['Cache-Control'] == 'private, no-cache'
+            response = json.loads(body[0].decode('utf-8'))
+            assert response['result']['result'] == u'example'
+            assert len(etag_example.calls) == 1
+
+            # the command is not executed if the client has the result
+            status, headers, body = request(HTTP_IF_NONE_MATCH='"example"')
+            assert status == rpcserver.HTTP_STATUS_NOT_MODIFIED
+            assert headers['ETag'] == '"example"'
+            assert body == [b'']
+            assert len(etag_example.calls) == 1
+
+            status, headers, body = request(HTTP_IF_NONE_MATCH='"other"')
+            assert status == rpcserver.HTTP_STATUS_SUCCESS
+            assert len(etag_example.calls) == 2
+
+    def test_audit_params(self):
+        """
+        Test that the command is logged with the params sent by the client.
+        """
+        (o, api, home) = self.instance('Backend', audit_example, in_server=True)
+
+        class Handler(logging.Handler):
+            def __init__(self):
+                logging.Handler.__init__(self)
+                self.messages = []
+
+            def emit(self, record):
+                self.messages.append(record.getMessage())
+
+        handler = Handler()
+        logger = o.log
+        level, propagate = logger.level, logger.propagate
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.addHandler(handler)
+        try:
+            with self.lang():
+                status, headers, body = self.request(
+                    o, 'audit_example', dict(description=u'text'))
+        finally:
+            logger.removeHandler(handler)
+            logger.setLevel(level)
+            logger.propagate = propagate
+
+        assert status == rpcserver.HTTP_STATUS_SUCCESS
+        assert len(handler.messages) == 1
+        message = handler.messages[0]
+        assert message.startswith('[jsonserver] UNKNOWN: audit_example(')
+        assert message.endswith('): SUCCESS')
+        # neither defaults nor the version added by the server are logged
+        assert 'description=' in message
+        assert 'all=' not in message
+        assert 'version=' not in message
+
+    @contextlib.contextmanager
+    def lang(self):
+        """
+        Set the LANG environment variable expected by the WSGI application.
+        """
+        lang = os.environ.get('LANG')
+        os.environ['LANG'] = 'en_US.UTF-8'
+        try:
+            yield
+        finally:
+            if lang is None:
+                del os.environ['LANG']
+            else:
+                os.environ['LANG'] = lang
+
+    def request(self, o, name, options=None, **environ):
+        """
+        Call a command through the WSGI application.
+        """
+        data = json.dumps(
+            dict(method=name, params=[[], options or {}], id=0)).encode(
+            'utf-8')
+        environ.update({
+            'REQUEST_METHOD': 'POST',
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(data)),
+            'HTTP_REFERER': 'https://%s/ipa/ui' % o.api.env.host,
+            'wsgi.input': io.BytesIO(data),
+        })
+        start_response = StartResponse()
+        body = o(environ, start_response)
+        return start_response.status, dict(start_response.headers), body
@@ -21,11 +21,14 @@
 Test the `ipalib.plugins.baseldap` module.
 """
 
+import re
+
 import ldap
 
 from ipapython.dn import DN
 from ipapython import ipaldap
 from ipalib import errors
+from ipalib.request import context_frame
 from ipalib.plugins import baseldap
 from ipatests.util import assert_deepequal
 import pytest
@@ -217,3 +220,239 @@ def test_entry_to_dict():
     assert_deepequal(
         baseldap.entry_to_dict(entry, all=True, raw=True),
         the_dict)
+
+
+class FakeEnv(object):
+    basedn = DN('dc=example,dc=com')
+
+
+class FakeAPI(object):
+    env = FakeEnv()
+
+
+class FakeEntry(object):
+    def __init__(self, dn, **raw):
+        self.dn = DN(dn)
+        self.raw = raw
+
+
+class FakeMembershipBackend(ipaldap.LDAPClient):
+    """
+    Evaluate the OR filters used by the membership searches in memory
+    """
+    def __init__(self, entries):
+        super(FakeMembershipBackend, self).__init__(
+            'ldap://test', force_schema_updates=False)
+        self.entries = entries
+        self.searches = []
+
+    @staticmethod
+    def parse_filter(filter):
+        assertions = []
+        for attr, value in re.findall(r'\((\w+)=([^()*]+)\)', filter):
+            value = re.sub(r'\\([0-9a-fA-F]{2})',
+                           lambda m: chr(int(m.group(1), 16)), value)
+            assertions.append((attr.lower(), DN(value)))
+        return assertions
+
+    def find_entries(self, filter=None, attrs_list=None, base_dn=None,
+                     scope=ldap.SCOPE_SUBTREE, time_limit=None,
+                     size_limit=None, search_refs=False, paged_search=False,
+                     serverctrls=None):
+        self.searches.append((filter, attrs_list, serverctrls))
+        assertions = self.parse_filter(filter)
+        matched_values = None
+        for ctrl in serverctrls or []:
+            if isinstance(ctrl, ipaldap.MatchedValuesControl):
+                matched_values = [(attr.lower(), DN(value))
+                                  for attr, value in ctrl.assertions]
+
+        result = []
+        for entry in self.entries:
+            values = [(attr.lower(), DN(value))
+                      for attr, vals in entry.raw.items()
+                      if attr.lower() in ('member', 'memberuser',
+                                          'memberhost', 'memberof')
+                      for value in vals]
+            if not any(value in assertions for value in values):
+                continue
+            raw = {}
+            for attr in attrs_list:
+                vals = entry.raw.get(attr, [])
+                if matched_values is not None:
+                    vals = [v for v in vals
+                            if (attr, DN(v)) in matched_values]
+                if vals:
+                    raw[attr] = vals
+            result.append(FakeEntry(entry.dn, **raw))
+        if not result:
+            raise errors.NotFound(reason='no such entry')
+        return result, False
+
+
+class FakeLDAPObject(baseldap.LDAPObject):
+    backend = None
+
+
+@pytest.mark.tier0
+class test_indirect_membership(object):
+    """
+    Test resolving indirect membership of several entries at once
+    """
+    users_dn = 'cn=users,cn=accounts,dc=example,dc=com'
+    groups_dn = 'cn=groups,cn=accounts,dc=example,dc=com'
+
+    def user_dn(self, name):
+        return 'uid=%s,%s' % (name, self.users_dn)
+
+    def group_dn(self, name):
+        return 'cn=%s,%s' % (name, self.groups_dn)
+
+    def setup(self):
+        others = [self.user_dn('other%d' % i) for i in range(100)]
+        self.groups = [
+            FakeEntry(self.group_dn('ipausers'),
+                      member=others + [self.user_dn('u1'),
+                                       self.user_dn('u2')]),
+            FakeEntry(self.group_dn('g1'),
+                      member=[self.user_dn('u1')],
+                      memberof=[self.group_dn('g2')]),
+            # spelled differently than the DN of the entry
+            FakeEntry(self.group_dn('g2'),
+                      member=[self.group_dn('g1'),
+                              'UID=u2, CN=users,cn=accounts,'
+                              'dc=example, dc=com']),
+        ]
+        self.backend = FakeMembershipBackend(self.groups)
+        self.obj = FakeLDAPObject(FakeAPI())
+        self.obj.backend = self.backend
+
+    def get_users(self):
+        return [
+            FakeEntry(self.user_dn('u1'), memberof=[
+                self.group_dn('ipausers'), self.group_dn('g1'),
+                self.group_dn('g2')]),
+            FakeEntry(self.user_dn('u2'), memberof=[
+                self.group_dn('ipausers'), self.group_dn('g2')]),
+        ]
+
+    def check_users(self, users):
+        u1, u2 = users
+        assert sorted(u1.raw['memberof']) == sorted(
+            [self.group_dn('ipausers'), self.group_dn('g1')])
+        assert u1.raw['memberofindirect'] == [self.group_dn('g2')]
+        assert sorted(u2.raw['memberof']) == sorted(
+            [self.group_dn('ipausers'), self.group_dn('g2')])
+        assert 'memberofindirect' not in u2.raw
+
+    def test_memberofindirect_batch(self):
+        users = self.get_users()
+        self.obj.get_memberofindirect_batch(users)
+        self.check_users(users)
+        assert len(self.backend.searches) == 1
+
+        # only the member values referring to the entries are requested
+        filter, attrs_list, serverctrls = self.backend.searches[0]
+        ctrl, = serverctrls
+        assert sorted(set(value for attr, value in ctrl.assertions)) == \
+            sorted(entry.dn for entry in users)
+
+    def test_memberofindirect_single(self):
+        users = self.get_users()
+        for user in users:
+            self.obj.get_memberofindirect(user)
+        self.check_users(users)
+        for filter, attrs_list, serverctrls in self.backend.searches:
+            assert attrs_list == ['']
+
+    def test_chunks(self):
+        self.obj.indirect_members_batch_size = 1
+        users = self.get_users()
+        self.obj.get_indirect_members_batch(users, ['memberofindirect'])
+        self.check_users(users)
+        assert len(self.backend.searches) == 2
+
+    def test_memberindirect_batch(self):
+        groups = [FakeEntry(self.group_dn('g2'),
+                            member=[self.group_dn('g1')])]
+        self.obj.get_memberindirect_batch(groups)
+        assert groups[0].raw['memberindirect'] == [self.user_dn('u1')]
+
+
+class FakePrimaryKey(object):
+    name = 'uid'
+
+
+class FakePrimaryKeyEntry(dict):
+    def __init__(self, dn, **attrs):
+        super(FakePrimaryKeyEntry, self).__init__(attrs)
+        self.dn = DN(dn)
+
+
+class FakePrimaryKeyBackend(ipaldap.LDAPClient):
+    """
+    Evaluate the OR filters of RDN assertions used to resolve primary keys
+    """
+    def __init__(self, entries):
+        super(FakePrimaryKeyBackend, self).__init__(
+            'ldap://test', force_schema_updates=False)
+        self.entries = entries
+        self.searches = []
+
+    def find_entries(self, filter=None, attrs_list=None, base_dn=None,
+                     scope=ldap.SCOPE_SUBTREE, time_limit=None,
+                     size_limit=None, search_refs=False, paged_search=False,
+                     serverctrls=None):
+        values = re.findall(r'\(uid=([^()*]+)\)', filter)
+        self.searches.append(values)
+        result = [entry for entry in self.entries
+                  if entry.dn[0].value in values]
+        if not result:
+            raise errors.NotFound(reason='no such entry')
+        return result, False
+
+    def get_entry(self, dn, attrs_list=None, time_limit=None,
+                  size_limit=None, get_effective_rights=False):
+        raise AssertionError('unexpected lookup of %s' % dn)
+
+
+@pytest.mark.tier0
+class test_primary_keys_from_dns(object):
+    """
+    Test resolving the primary keys of several member DNs at once
+    """
+    users_dn = DN('cn=users,cn=accounts,dc=example,dc=com')
+
+    def setup(self):
+        self.entries = [
+            FakePrimaryKeyEntry(DN(('uid', 'u%d' % i), self.users_dn),
+                                uid=['u%d' % i])
+            for i in range(5)]
+        self.backend = FakePrimaryKeyBackend(self.entries)
+        self.obj = FakeLDAPObject(FakeAPI())
+        self.obj.backend = self.backend
+        self.obj.container_dn = DN('cn=users,cn=accounts')
+        self.obj.rdn_attribute = 'uid'
+        self.obj.primary_key = FakePrimaryKey()
+
+    def test_single_search(self):
+        dns = [entry.dn for entry in self.entries]
+        with context_frame():
+            self.obj.get_primary_keys_from_dns(dns)
+            assert len(self.backend.searches) == 1
+            assert [self.obj.get_primary_key_from_dn(dn) for dn in dns] == \
+                ['u%d' % i for i in range(5)]
+
+    def test_chunks(self):
+        self.obj.indirect_members_batch_size = 2
+        dns = [entry.dn for entry in self.entries]
+        with context_frame():
+            self.obj.get_primary_keys_from_dns(dns + dns[:2])
+            assert self.backend.searches == [
+                ['u0', 'u1'], ['u2', 'u3'], ['u4']]
+            assert [self.obj.get_primary_key_from_dn(dn) for dn in dns] == \
+                ['u%d' % i for i in range(5)]
+
+            # DNs resolved already are not searched again
+            self.obj.get_primary_keys_from_dns(dns)
+            assert len(self.backend.searches) == 3
@@ -21,12 +21,17 @@
 Test the `ipalib/plugins/batch.py` module.
 """
 
+import threading
+
 from ipalib import api
+from ipalib.plugins import baseldap, batch, group, trust
+from ipalib.request import context
 from ipatests.test_xmlrpc import objectclasses
 from ipatests.util import Fuzzy, assert_deepequal
 from ipatests.test_xmlrpc.xmlrpc_test import (Declarative, fuzzy_digits,
                                               fuzzy_uuid)
 from ipapython.dn import DN
+from ipapython.version import API_VERSION
 import pytest
 
 group1 = u'testgroup1'
@@ -172,6 +177,74 @@ class test_batch(Declarative):
             ),
         ),
 
+        dict(
+            desc='Create, show in parallel and delete a group',
+            command=('batch', [
+                dict(method='group_add',
+                    params=([group1], dict(description=u'Test desc 1'))),
+                dict(method='group_show', params=([group1], dict())),
+                dict(method='group_show', params=([group1], dict())),
+                dict(method='group_del', params=([group1], dict())),
+                dict(method='group_show', params=([group1], dict())),
+            ], dict(parallel=True)),
+            expected=dict(
+                count=5,
+                results=deepequal_list(
+                    dict(
+                        value=group1,
+                        summary=u'Added group "testgroup1"',
+                        result=dict(
+                            cn=[group1],
+                            description=[u'Test desc 1'],
+                            objectclass=objectclasses.group + [u'posixgroup'],
+                            ipauniqueid=[fuzzy_uuid],
+                            gidnumber=[fuzzy_digits],
+                            dn=DN(('cn', 'testgroup1'),
+                                  ('cn', 'groups'),
+                                  ('cn', 'accounts'),
+                                  api.env.basedn),
+                            ),
+                        error=None),
+                    dict(
+                        value=group1,
+                        summary=None,
+                        result=dict(
+                            cn=[group1],
+                            description=[u'Test desc 1'],
+                            gidnumber=[fuzzy_digits],
+                            dn=DN(('cn', 'testgroup1'),
+                                  ('cn', 'groups'),
+                                  ('cn', 'accounts'),
+                                  api.env.basedn),
+                            ),
+                        error=None),
+                    dict(
+                        value=group1,
+                        summary=None,
+                        result=dict(
+                            cn=[group1],
+                            description=[u'Test desc 1'],
+                            gidnumber=[fuzzy_digits],
+                            dn=DN(('cn', 'testgroup1'),
+                                  ('cn', 'groups'),
+                                  ('cn', 'accounts'),
+                                  api.env.basedn),
+                            ),
+                        error=None),
+                    dict(
+                        summary=u'Deleted group "%s"' % group1,
+                        result=dict(failed=[]),
+                        value=[group1],
+                        error=None),
+                    dict(
+                        error=u'%s: group not found' % group1,
+                        error_name=u'NotFound',
+                        error_code=4001,
+                    ),
+                ),
+            ),
+        ),
+
         dict(
             desc='Try bad command invocations',
             command=('batch', [
@@ -234,3 +307,118 @@ class test_batch(Declarative):
         ),
 
     ]
+
+
+class FakeEnv(object):
+    in_server = True
+    batch_max_parallel = 2
+
+
+class FakeBackend(object):
+    def connect(self, ccache=None):
+        pass
+
+
+class FakeBackends(object):
+    ldap2 = FakeBackend()
+
+
+class FakeAPI(object):
+    env = FakeEnv()
+    Backend = FakeBackends()
+
+    def __init__(self, commands):
+        self.Command = dict((cmd.name, cmd) for cmd in commands)
+
+
+class FakeCommand(object):
+    def __init__(self, name, read_only, calls, rendezvous=None):
+        self.name = name
+        self.read_only = read_only
+        self.calls = calls
+        self.rendezvous = rendezvous
+
+    def args_options_2_params(self, *args, **options):
+        return options
+
+    def _repr_iter(self, **params):
+        return iter([])
+
+    def __call__(self, *args, **options):
+        met = self.rendezvous() if self.rendezvous else None
+        self.calls.append((self.name, threading.current_thread().name, met))
+        return dict(result=self.name)
+
+
+@pytest.mark.tier0
+class test_batch_parallel(object):
+    """
+    Test which methods of a batch are executed concurrently
+    """
+
+    def setup(self):
+        self.calls = []
+        self.arrived = 0
+        self.condition = threading.Condition()
+        context.principal = u'admin@EXAMPLE.COM'
+
+    def teardown(self):
+        del context.principal
+
+    def rendezvous(self):
+        """
+        Wait until two read-only commands run at the same time.
+        """
+        with self.condition:
+            self.arrived += 1
+            self.condition.notify_all()
+            deadline = 5
+            while self.arrived < 2 and deadline > 0:
+                self.condition.wait(0.1)
+                deadline -= 0.1
+            return self.arrived >= 2
+
+    def test_read_only_flags(self):
+        assert baseldap.LDAPRetrieve.read_only
+        assert baseldap.LDAPSearch.read_only
+        assert group.group_show.read_only
+        assert group.group_find.read_only
+        assert not group.group_add.read_only
+        # an LDAPRetrieve which writes the trusted domain entries
+        assert not trust.trust_fetch_domains.read_only
+
+    def test_parallel(self):
+        commands = [
+            FakeCommand('user_show', True, self.calls, self.rendezvous),
+            FakeCommand('group_find', True, self.calls, self.rendezvous),
+            FakeCommand('trust_fetch_domains', False, self.calls),
+            FakeCommand('host_show', True, self.calls),
+        ]
+        cmd = batch.batch(FakeAPI(commands))
+        methods = [dict(method=c.name, params=([], {})) for c in commands]
+        result = cmd.execute(methods, version=API_VERSION, parallel=True)
+
+        assert [r['result'] for r in result['results']] == [
+            c.name for c in commands]
+        main = threading.current_thread().name
+        calls = dict((name, (thread, met))
+                     for name, thread, met in self.calls)
+        # the first two methods were executed at the same time by workers
+        assert calls['user_show'][0] != main
+        assert calls['group_find'][0] != main
+        assert calls['user_show'][1] and calls['group_find'][1]
+        # the other methods were executed alone, in order
+        assert [name for name, thread, met in self.calls][2:] == [
+            'trust_fetch_domains', 'host_show']
+        assert calls['trust_fetch_domains'][0] == main
+        assert calls['host_show'][0] == main
+
+    def test_sequential(self):
+        commands = [FakeCommand('user_show', True, self.calls),
+                    FakeCommand('group_find', True, self.calls)]
+        cmd = batch.batch(FakeAPI(commands))
+        methods = [dict(method=c.name, params=([], {})) for c in commands]
+        cmd.execute(methods, version=API_VERSION, parallel=False)
+        main = threading.current_thread().name
+        assert self.calls == [('user_show', main, None),
+                              ('group_find', main, None)]
@@ -427,10 +427,13 @@ class test_cert_find(XMLRPC_test):
 
     def test_0027_sizelimit_zero(self):
         """
-        Search with a sizelimit of 0
+        Search with a sizelimit of 0, which is unlimited
         """
         res = api.Command['cert_find'](sizelimit=0)
-        assert 'count' in res and res['count'] == 0
+        assert res['count'] >= 10
+        assert res['truncated'] is False
+        assert res['count'] == api.Command['cert_find'](
+            sizelimit=100000)['count']
 
     @raises(errors.ValidationError)
     def test_0028_find_negative_size(self):
@@ -459,3 +462,17 @@ class test_cert_find(XMLRPC_test):
         Search using invalid date format
         """
         res = api.Command['cert_find'](issuedon_from=u'xyz')
+
+    def test_0032_search_truncated(self):
+        """
+        Search with a sizelimit lower than the number of certificates
+        """
+        res = api.Command['cert_find'](sizelimit=5)
+        assert res['count'] == 5
+        assert res['truncated'] is True
+
+        res = api.Command['cert_find'](sizelimit=100000)
+        assert res['count'] >= 10
+        assert res['truncated'] is False
+        serial_numbers = [c['serial_number'] for c in res['result']]
+        assert len(set(serial_numbers)) == len(serial_numbers)
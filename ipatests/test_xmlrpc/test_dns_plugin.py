@@ -269,6 +269,20 @@ arec1 = u'172.16.29.111'
 arec2 = u'172.31.254.222'
 arec3 = u'172.16.250.123'
 
+import_name1 = u'testimport1'
+import_name1_dnsname = DNSName(import_name1)
+import_name1_dn = DN(('idnsname', import_name1), zone1_dn)
+import_name2 = u'testimport2'
+import_zonefile = u'''$TTL 3600
+%(name1)s IN A %(arec1)s
+%(name2)s IN CNAME %(name1)s
+''' % dict(name1=import_name1, name2=import_name2, arec1=arec1)
+import_json = u'{"%s": {"A": ["%s"]}, "%s": {"A": ["%s"]}}' % (
+    import_name1, arec2, import_name2, arec3)
+import_name3 = u'testimport3'
+import_json_names = u'{"%s": {"A": ["%s"]}, "%s.%s": {"A": ["%s"]}}' % (
+    import_name3, arec1, import_name3, zone1_absolute, arec2)
+
 fwd_ip = u'172.16.31.80'
 allowtransfer_tofwd = u'%s;' % fwd_ip
 
@@ -3108,6 +3122,103 @@ class test_dns(Declarative):
         ),
 
 
+        dict(
+            desc='Import records into zone %r from a zone file' % zone1,
+            command=('dnsrecord_import', [zone1],
+                     {'file': import_zonefile}),
+            expected={
+                'summary': u'Imported 2 record names, 0 failed',
+                'result': {'added': 2, 'updated': 0, 'unchanged': 0},
+                'failed': {},
+            },
+        ),
+
+
+        dict(
+            desc='Check the imported record %r' % import_name1,
+            command=('dnsrecord_show', [zone1, import_name1], {}),
+            expected={
+                'value': import_name1_dnsname,
+                'summary': None,
+                'result': {
+                    'dn': import_name1_dn,
+                    'idnsname': [import_name1_dnsname],
+                    'arecord': [arec1],
+                },
+            },
+        ),
+
+
+        dict(
+            desc='Import the same zone file into zone %r again' % zone1,
+            command=('dnsrecord_import', [zone1],
+                     {'file': import_zonefile}),
+            expected={
+                'summary': u'Imported 0 record names, 0 failed',
+                'result': {'added': 0, 'updated': 0, 'unchanged': 2},
+                'failed': {},
+            },
+        ),
+
+
+        dict(
+            desc='Try to import a record colliding with a CNAME into zone %r'
+                 % zone1,
+            command=('dnsrecord_import', [zone1],
+                     {'file': import_json, 'format': u'json'}),
+            expected=errors.ValidationError(
+                name=import_name2,
+                error=u"invalid 'cnamerecord': CNAME record is not allowed "
+                      u"to coexist with any other record "
+                      u"(RFC 1034, section 3.6.2)"),
+        ),
+
+
+        dict(
+            desc='Import records into zone %r in continuous mode' % zone1,
+            command=('dnsrecord_import', [zone1],
+                     {'file': import_json, 'format': u'json',
+                      'continue': True}),
+            expected={
+                'summary': u'Imported 1 record names, 1 failed',
+                'result': {'added': 0, 'updated': 1, 'unchanged': 0},
+                'failed': {
+                    import_name2: u"invalid 'cnamerecord': CNAME record is "
+                                  u"not allowed to coexist with any other "
+                                  u"record (RFC 1034, section 3.6.2)",
+                },
+            },
+        ),
+
+
+        dict(
+            desc='Import records of a relative and an absolute name of the '
+                 'same record name into zone %r' % zone1,
+            command=('dnsrecord_import', [zone1],
+                     {'file': import_json_names, 'format': u'json'}),
+            expected={
+                'summary': u'Imported 1 record names, 0 failed',
+                'result': {'added': 1, 'updated': 0, 'unchanged': 0},
+                'failed': {},
+            },
+        ),
+
+
+        dict(
+            desc='Check the updated record %r' % import_name1,
+            command=('dnsrecord_show', [zone1, import_name1], {}),
+            expected={
+                'value': import_name1_dnsname,
+                'summary': None,
+                'result': {
+                    'dn': import_name1_dn,
+                    'idnsname': [import_name1_dnsname],
+                    'arecord': [arec1, arec2],
+                },
+            },
+        ),
+
+
         dict(
             desc='Delete zone %r' % zone1,
             command=('dnszone_del', [zone1], {}),
@@ -5949,3 +6060,133 @@ class test_dns_soa(Declarative):
                        zone6_unresolvable_ns_dnsname,),
         ),
     ]
+
+
+class FakeZoneEntry(dict):
+    def __init__(self, name, objectclass, active=u'TRUE'):
+        super(FakeZoneEntry, self).__init__(objectclass=[objectclass])
+        self.dn = DN(('idnsname', name), api.env.container_dns,
+                     api.env.basedn)
+        self.single_value = dict(idnsname=DNSName(name))
+        if active is not None:
+            self.single_value['idnszoneactive'] = active
+
+
+class FakeZoneLDAP(object):
+    MATCH_ALL = '&'
+    MATCH_ANY = '|'
+    SCOPE_ONELEVEL = 1
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.searches = 0
+        # entries found by the lookups of zones missing in the map
+        self.found = []
+        self.lookups = 0
+
+    def get_entry(self, dn, attrs_list=None):
+        return {}
+
+    def make_filter(self, *args, **kwargs):
+        return '(objectclass=*)'
+
+    def combine_filters(self, *args, **kwargs):
+        return '(objectclass=*)'
+
+    def find_entries(self, **kwargs):
+        if 'objectclass' not in kwargs['attrs_list']:
+            self.lookups += 1
+            if not self.found:
+                raise errors.NotFound(reason=u'no such entry')
+            return self.found, False
+        self.searches += 1
+        return self.entries, False
+
+
+@pytest.mark.tier0
+class test_DNSZoneMap(object):
+    """
+    Test the `ipalib.plugins.dns.DNSZoneMap` lookups.
+    """
+    def setup(self):
+        from ipalib.plugins import dns
+        self.dns = dns
+        self.ldap = FakeZoneLDAP([
+            FakeZoneEntry(u'example.test.', 'idnszone'),
+            FakeZoneEntry(u'sub.example.test', 'idnszone'),
+            FakeZoneEntry(u'inactive.example.test.', 'idnszone',
+                          active=u'FALSE'),
+            FakeZoneEntry(u'unset.example.test.', 'idnszone', active=None),
+            FakeZoneEntry(u'fw.example.test.', 'idnsforwardzone'),
+            FakeZoneEntry(u'fw.sub.example.test.', 'idnsforwardzone'),
+        ])
+
+        class FakeAPI(object):
+            env = api.env
+            Backend = type('Backend', (object,), dict(ldap2=self.ldap))
+
+        self.api = FakeAPI()
+        self.zone_map = dns._dns_zone_map
+        self.zone_map.invalidate()
+
+    def teardown(self):
+        self.zone_map.invalidate()
+
+    def test_get_zone(self):
+        zone_info = self.zone_map.get_zone(
+            self.api, DNSName(u'sub.example.test.'))
+        assert zone_info.master
+        assert zone_info.active
+        assert zone_info.dn == DN(('idnsname', u'sub.example.test'),
+                                  api.env.container_dns, api.env.basedn)
+        assert self.zone_map.get_zone(
+            self.api, DNSName(u'other.example.test.')) is None
+        # a zone is active only if idnsZoneActive is TRUE
+        assert not self.zone_map.get_zone(
+            self.api, DNSName(u'inactive.example.test.')).active
+        assert not self.zone_map.get_zone(
+            self.api, DNSName(u'unset.example.test.')).active
+        assert self.ldap.searches == 1
+
+    def test_invalidate(self):
+        self.zone_map.get(self.api)
+        self.zone_map.get(self.api)
+        assert self.ldap.searches == 1
+        self.zone_map.invalidate()
+        self.zone_map.get(self.api)
+        assert self.ldap.searches == 2
+
+    def test_auth_zone(self):
+        assert self.dns._get_auth_zone_ldap(
+            self.api, DNSName(u'host.sub.example.test.')) == (
+                DNSName(u'sub.example.test.'), False)
+        assert self.dns._get_auth_zone_ldap(
+            self.api, DNSName(u'host.inactive.example.test.')) == (
+                DNSName(u'example.test.'), False)
+        assert self.dns._get_auth_zone_ldap(
+            self.api, DNSName(u'host.unset.example.test.')) == (
+                DNSName(u'example.test.'), False)
+        assert self.ldap.lookups == 0
+        assert self.dns._get_auth_zone_ldap(
+            self.api, DNSName(u'host.other.test.')) == (None, False)
+        assert self.ldap.lookups == 1
+
+    def test_auth_zone_missing(self):
+        """
+        A zone added after the map was loaded is found in LDAP.
+        """
+        self.zone_map.get(self.api)
+        self.ldap.found = [FakeZoneEntry(u'other.test.', 'idnszone')]
+        assert self.dns._get_auth_zone_ldap(
+            self.api, DNSName(u'host.other.test.')) == (
+                DNSName(u'other.test.'), False)
+        assert self.ldap.lookups == 1
+
+    def test_subtree_forward_zones(self):
+        zones, truncated = self.dns._find_subtree_forward_zones_ldap(
+            self.api, DNSName(u'example.test.'))
+        assert sorted(zones) == [DNSName(u'fw.example.test.'),
+                                 DNSName(u'fw.sub.example.test.')]
+        zones, truncated = self.dns._find_subtree_forward_zones_ldap(
+            self.api, DNSName(u'fw.example.test.'), child_zones_only=True)
+        assert zones == []
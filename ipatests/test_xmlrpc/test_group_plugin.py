@@ -394,6 +394,65 @@ class test_group(Declarative):
             ),
         ),
 
+        dict(
+            desc='Search for the first page of all groups',
+            command=('group_find', [], dict(page_size=2)),
+            expected=dict(
+                summary=u'2 groups matched',
+                count=2,
+                truncated=True,
+                result=[
+                    {
+                        'dn': get_group_dn('admins'),
+                        'member_user': [u'admin'],
+                        'gidnumber': [fuzzy_digits],
+                        'cn': [u'admins'],
+                        'description': [u'Account administrators group'],
+                    },
+                    {
+                        'dn': get_group_dn('editors'),
+                        'gidnumber': [fuzzy_digits],
+                        'cn': [u'editors'],
+                        'description': [u'Limited admins who can edit other users'],
+                    },
+                ],
+                messages=(
+                    {
+                        'message': (u'4 more entries match the search. Use '
+                                    u'page offset 2 to retrieve the next '
+                                    u'page.'),
+                        'code': 13019,
+                        'type': u'info',
+                        'name': u'SearchResultPaged',
+                    },
+                ),
+            ),
+        ),
+
+        dict(
+            desc='Search for the last page of all groups',
+            command=('group_find', [], dict(page_size=2, page_offset=4)),
+            expected=dict(
+                summary=u'2 groups matched',
+                count=2,
+                truncated=False,
+                result=[
+                    dict(
+                        dn=get_group_dn(group2),
+                        cn=[group2],
+                        description=[u'New desc 2'],
+                        gidnumber=[fuzzy_digits],
+                    ),
+                    {
+                        'dn': get_group_dn('trust admins'),
+                        'member_user': [u'admin'],
+                        'cn': [u'trust admins'],
+                        'description': [u'Trusts administrators group'],
+                    },
+                ],
+            ),
+        ),
+
         dict(
             desc='Search for non-POSIX groups',
             command=('group_find', [], dict(nonposix=True, all=True)),
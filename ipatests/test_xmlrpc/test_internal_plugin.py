@@ -0,0 +1,79 @@
+#
+# Copyright (C) 2016  FreeIPA Contributors see COPYING for license
+#
+
+"""
+Test the `ipalib.plugins.internal` module.
+"""
+
+import pytest
+
+from ipalib import Str
+from ipalib.request import context
+from ipalib.plugins import internal
+from ipatests.util import PluginTester
+
+
+class cached_example(internal.CachedCommand):
+    """
+    Cached command counting the results created.
+    """
+    takes_args = (
+        Str('name?'),
+    )
+
+    created = []
+
+    def execute(self, name=None, **options):
+        return self.get_cached(self._create, name, **options)
+
+    def _create(self, name=None, **options):
+        self.created.append(name)
+        return dict(result=name)
+
+
+@pytest.mark.tier0
+class test_CachedCommand(PluginTester):
+    """
+    Test the `ipalib.plugins.internal.CachedCommand` class.
+    """
+    _plugin = cached_example
+
+    def setup(self):
+        cached_example.created = []
+
+    def test_get_cached(self):
+        (o, api, home) = self.instance('Command', in_server=True)
+        context.languages = ('en',)
+
+        # one result per arguments
+        assert o.execute(u'a') == dict(result=u'a')
+        assert o.execute(u'a') == dict(result=u'a')
+        assert o.execute(u'b') == dict(result=u'b')
+        assert o.created == [u'a', u'b']
+
+        # the API version option does not matter
+        assert o.execute(u'a', version=u'2.0') == dict(result=u'a')
+        assert o.created == [u'a', u'b']
+
+        # one result per language
+        context.languages = ('de',)
+        assert o.execute(u'a') == dict(result=u'a')
+        assert o.created == [u'a', u'b', u'a']
+
+    def test_get_etag(self):
+        (o, api, home) = self.instance('Command', in_server=True)
+        context.languages = ('en',)
+        etag = o.get_etag(u'a')
+        assert etag.startswith('"') and etag.endswith('"')
+        assert o.get_etag(u'a') == etag
+        assert o.get_etag(u'a', version=u'2.0') == etag
+        assert o.get_etag(u'b') != etag
+
+        # the tag does not change with the process or the API instance
+        (o2, api2, home2) = self.instance('Command', in_server=True)
+        assert o2.get_etag(u'a') == etag
+
+        # but with the language
+        context.languages = ('de',)
+        assert o.get_etag(u'a') != etag
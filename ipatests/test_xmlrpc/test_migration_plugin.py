@@ -0,0 +1,362 @@
+#
+# Copyright (C) 2016  FreeIPA Contributors see COPYING for license
+#
+
+"""
+Test the `ipalib.plugins.migration` module.
+"""
+
+import contextlib
+import logging
+import threading
+import time
+
+import ldap
+import pytest
+import six
+from six.moves import queue
+
+from ipapython.dn import DN
+from ipalib import errors
+from ipalib.plugins import migration
+from ipatests.util import raises
+
+if six.PY3:
+    unicode = str
+
+BASEDN = DN('dc=example,dc=com')
+DS_BASEDN = DN('dc=ds,dc=example,dc=com')
+DS_USERS_DN = DN('ou=people', DS_BASEDN)
+DS_GROUPS_DN = DN('ou=groups', DS_BASEDN)
+
+
+class FakeEntry(dict):
+    def __init__(self, dn, **attrs):
+        super(FakeEntry, self).__init__(attrs)
+        self.dn = DN(dn)
+
+
+class FakePrimaryKey(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeObject(object):
+    def __init__(self, name, pkey_name, container_dn):
+        self.name = name
+        self.primary_key = FakePrimaryKey(pkey_name)
+        self.container_dn = container_dn
+        self.object_class_config = 'ipa%sobjectclasses' % name
+        self.object_class = ['top']
+
+    def get_dn(self, pkey):
+        return DN((self.primary_key.name, pkey), self.container_dn, BASEDN)
+
+
+class FakeNamespace(dict):
+    __getattr__ = dict.__getitem__
+
+
+class FakeEnv(object):
+    basedn = BASEDN
+    realm = u'EXAMPLE.COM'
+    container_user = DN('cn=users,cn=accounts')
+    container_group = DN('cn=groups,cn=accounts')
+
+
+class FakeIPA(object):
+    """
+    IPA LDAP connection recording the added entries and modifications
+    """
+    SCOPE_ONELEVEL = ldap.SCOPE_ONELEVEL
+    SCOPE_SUBTREE = ldap.SCOPE_SUBTREE
+
+    def __init__(self, existing=()):
+        self.existing = existing
+        self.added = []
+        self.conn = self
+        self.modifications = []
+        self.connect_error = None
+
+    def connect(self, ccache=None):
+        if self.connect_error is not None:
+            raise self.connect_error
+
+    def has_upg(self):
+        return False
+
+    def has_dn_syntax(self, attr):
+        return False
+
+    def get_entry(self, dn, attrs_list=None):
+        return FakeEntry(dn)
+
+    def iter_entries(self, filter, attrs_list, base_dn, scope, **kwargs):
+        return iter(FakeEntry(DN(('uid', uid), base_dn), uid=[uid])
+                    for uid in self.existing)
+
+    def find_entries(self, filter, attrs_list, base_dn, **kwargs):
+        raise errors.NotFound(reason=u'no such entry')
+
+    def find_entry_by_attr(self, attr, value, object_class, attrs_list=None,
+                           base_dn=None):
+        raise errors.NotFound(reason=u'no such entry')
+
+    def add_entry(self, entry):
+        self.added.append(entry.dn)
+
+    def encode(self, values):
+        return [str(value) for value in values]
+
+    @contextlib.contextmanager
+    def error_handler(self):
+        yield
+
+    def modify_s(self, dn, modlist):
+        self.modifications.append((dn, modlist))
+
+
+class FakeDS(object):
+    """
+    Source DS connection serving users and groups
+    """
+    def __init__(self, users=(), gids=()):
+        self.users = [
+            FakeEntry(DN(('uid', uid), DS_USERS_DN), uid=[uid],
+                      objectclass=['posixAccount'], gidnumber=[u'100'])
+            for uid in users]
+        self.groups = [
+            FakeEntry(DN(('cn', 'g%d' % i), DS_GROUPS_DN),
+                      cn=['g%d' % i], gidnumber=[gid])
+            for i, gid in enumerate(gids)]
+        self.lookups = []
+
+    def iter_entries(self, filter, attrs_list, base_dn, scope=None,
+                     **kwargs):
+        if 'posixgroup' in filter:
+            return iter(self.groups)
+        elif '(uid=*)' in filter:
+            return iter(self.users)
+        raise errors.NotFound(reason=u'no such entry')
+
+    def get_entry(self, dn, attrs_list=None):
+        self.lookups.append(dn)
+        raise errors.NotFound(reason=u'no such entry')
+
+    def find_entry_by_attr(self, attr, value, object_class, attrs_list=None,
+                           base_dn=None):
+        self.lookups.append(value)
+        found = sum(1 for group in self.groups
+                    if value in group['gidnumber'])
+        if found == 0:
+            raise errors.NotFound(reason=u'no such entry')
+        elif found > 1:
+            raise errors.SingleMatchExpected(found=found)
+        return self.groups[0]
+
+
+class FakeAPI(object):
+    env = FakeEnv()
+    log = logging.getLogger('test_migration_plugin')
+
+    def __init__(self, ldap2):
+        self.Backend = FakeNamespace(ldap2=ldap2)
+        self.Object = FakeNamespace(
+            user=FakeObject('user', 'uid', FakeEnv.container_user),
+            group=FakeObject('group', 'cn', FakeEnv.container_group))
+
+
+class fake_migrate_ds(migration.migrate_ds):
+    """
+    migrate_ds recording the users prepared and the batches written
+    """
+    def __init__(self, api):
+        super(fake_migrate_ds, self).__init__(api)
+        self.migrate_objects = dict(self.migrate_objects)
+        self.migrate_objects['user'] = dict(
+            self.migrate_objects['user'],
+            pre_callback=self.pre_callback, post_callback=None)
+        self.batches = []
+        self.prepared = []
+
+    def pre_callback(self, ldap, pkey, dn, entry_attrs, failed, config, ctx,
+                     **kwargs):
+        self.prepared.append(pkey)
+        return dn
+
+    def _write_batch(self, tasks, threads, batch):
+        self.batches.append([args[1] for args in batch])
+        return super(fake_migrate_ds, self)._write_batch(
+            tasks, threads, batch)
+
+
+@pytest.mark.tier0
+class test_migrate_ds(object):
+    """
+    Test the batched migration of `ipalib.plugins.migration.migrate_ds`
+    """
+    def setup(self):
+        self.api = migration.api
+        self.ldap = FakeIPA(existing=[u'u1'])
+        migration.api = FakeAPI(self.ldap)
+        self.cmd = fake_migrate_ds(migration.api)
+        self.config = {'ipadefaultprimarygroup': u'ipausers'}
+        self.options = dict(
+            scope=u'onelevel', batch_size=2, parallel=1,
+            usercontainer=DN('ou=people'), groupcontainer=DN('ou=groups'),
+            userobjectclass=(u'person',), groupobjectclass=(u'groupofnames',),
+            exclude_users=(u'u3',), exclude_groups=(), use_def_group=True,
+            schema=u'RFC2307bis')
+        # there are no groups to migrate
+        self.options['continue'] = True
+
+    def teardown(self):
+        migration.api = self.api
+
+    def migrate(self, users):
+        ds_ldap = FakeDS(users)
+        migrated, failed = self.cmd.migrate(
+            self.ldap, self.config, ds_ldap, DS_BASEDN, self.options)
+        return migrated['user'], failed['user'], ds_ldap
+
+    def test_batches(self):
+        users = [u'u%d' % i for i in range(8)]
+        migrated, failed, ds_ldap = self.migrate(users)
+        # u1 exists already and u3 is excluded
+        assert self.cmd.batches == [
+            [u'u0', u'u2'], [u'u4', u'u5'], [u'u6', u'u7']]
+        assert migrated == [u'u0', u'u2', u'u4', u'u5', u'u6', u'u7']
+
+        # the final batch is written even if it is not full
+        self.cmd.batches = []
+        migrated, failed, ds_ldap = self.migrate([u'u10', u'u11', u'u12'])
+        assert self.cmd.batches == [[u'u10', u'u11'], [u'u12']]
+        assert migrated == [u'u10', u'u11', u'u12']
+
+    def test_existing(self):
+        migrated, failed, ds_ldap = self.migrate([u'u0', u'u1'])
+        assert migrated == [u'u0']
+        assert failed == {u'u1': unicode(errors.DuplicateEntry())}
+        # the entry was neither prepared nor looked up in DS
+        assert self.cmd.prepared == [u'u0']
+        assert ds_ldap.lookups == []
+        assert self.ldap.added == [
+            DN(('uid', u'u0'), FakeEnv.container_user, BASEDN)]
+
+    def test_default_group(self):
+        users = [u'u%d' % i for i in range(8)]
+        self.migrate(users)
+        group_dn = str(DN(('cn', u'ipausers'), FakeEnv.container_group,
+                          BASEDN))
+        members = [
+            [str(DN(('uid', uid), FakeEnv.container_user, BASEDN))
+             for uid in batch]
+            for batch in self.cmd.batches]
+        # one modification per batch
+        assert self.ldap.modifications == [
+            (group_dn, [(ldap.MOD_ADD, 'member', batch_members)])
+            for batch_members in members]
+
+
+class fake_write_migrate_ds(migration.migrate_ds):
+    """
+    migrate_ds recording the threads adding entries
+    """
+    def __init__(self, api):
+        super(fake_write_migrate_ds, self).__init__(api)
+        self.threads = []
+
+    def _add_entry(self, ldap, ldap_obj_name, pkey, *args):
+        self.threads.append(threading.current_thread())
+        time.sleep(0.001)
+        if pkey % 3 == 0:
+            return u'failed %d' % pkey
+        return None
+
+
+@pytest.mark.tier0
+class test_parallel_writers(object):
+    """
+    Test writing a batch of entries from several threads
+    """
+    def setup(self):
+        self.ldap = FakeIPA()
+        self.cmd = fake_write_migrate_ds(FakeAPI(self.ldap))
+        self.batch = [('user', i) for i in range(20)]
+        self.expected = [u'failed %d' % i if i % 3 == 0 else None
+                         for i in range(20)]
+
+    def write(self, parallel):
+        tasks, threads = self.cmd._start_writers(parallel)
+        try:
+            return self.cmd._write_batch(tasks, threads, self.batch)
+        finally:
+            self.cmd._stop_writers(tasks, threads)
+
+    def test_serial(self):
+        assert self.write(1) == self.expected
+        assert set(self.cmd.threads) == {threading.current_thread()}
+
+    def test_order(self):
+        # the results are in the order of the batch
+        assert self.write(4) == self.expected
+        assert len(self.cmd.threads) == len(self.batch)
+
+    def test_writer_failed(self):
+        # the writers cannot connect, the current thread adds all entries
+        self.ldap.connect_error = errors.NetworkError(
+            uri='ldap://test', error=u'no route to host')
+        assert self.write(3) == self.expected
+        assert set(self.cmd.threads) == {threading.current_thread()}
+
+    def test_error(self):
+        tasks = queue.Queue()
+        self.batch.append(('user', None))
+        raises(TypeError, self.cmd._write_batch, tasks, [], self.batch)
+
+
+@pytest.mark.tier0
+class test_group_gids(object):
+    """
+    Test checking the GID number of a migrated user with the table of GID
+    numbers against searching DS for each user
+    """
+    def setup(self):
+        self.api = migration.api
+        migration.api = FakeAPI(FakeIPA())
+        self.ds_ldap = FakeDS(gids=[u'100', u'200', u'200'])
+        self.cmd = migration.migrate_ds(migration.api)
+
+    def teardown(self):
+        migration.api = self.api
+
+    def check_gid(self, gid, group_gids):
+        ctx = dict(ds_ldap=self.ds_ldap, has_upg=False)
+        if group_gids is not None:
+            ctx['group_gids'] = group_gids
+        valid_gids = set()
+        invalid_gids = set()
+        entry_attrs = dict(gidnumber=[gid], objectclass=['posixAccount'])
+        migration._pre_migrate_user(
+            migration.api.Backend.ldap2, u'u0',
+            DN(('uid', u'u0'), FakeEnv.container_user, BASEDN),
+            entry_attrs, {}, {}, ctx,
+            search_bases=dict(user=DS_USERS_DN, group=DS_GROUPS_DN),
+            valid_gids=valid_gids, invalid_gids=invalid_gids)
+        return valid_gids, invalid_gids
+
+    def test_group_gids(self):
+        group_gids = self.cmd._get_group_gids(
+            self.ds_ldap, dict(group=DS_GROUPS_DN), 100)
+        assert group_gids == {u'100': 1, u'200': 2}
+
+        for gid, expected in ((u'100', ({u'100'}, set())),
+                              (u'200', (set(), set())),
+                              (u'300', (set(), {u'300'}))):
+            # no group, one group and more groups with the GID number
+            assert self.check_gid(gid, None) == expected
+            assert self.ds_ldap.lookups == [gid]
+            self.ds_ldap.lookups = []
+
+            assert self.check_gid(gid, group_gids) == expected
+            assert self.ds_ldap.lookups == []